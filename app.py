@@ -1,13 +1,36 @@
 import streamlit as st
-from utils.whisper_utils import transcribe_whisper_blocks
-from utils.reformulate_utils import reformulate_transcription, validate_reformulation_input
-from utils.audio_utils import load_audio_file, extract_audio, validate_audio_file
+from utils.whisper_utils import transcribe_whisper_blocks, transcribe_progressive, DRAFT_MODEL_SIZE
+from utils.asr_backends import get_available_backends, is_model_loaded, DEFAULT_ASR_BACKEND
+from utils.reformulate_utils import reformulate_transcription, reformulate_hierarchical, validate_reformulation_input
+from utils.audio_utils import (
+    load_audio_file, normalize_audio, validate_audio_file, probe_audio, check_ffmpeg_available,
+    make_preview_audio, PARALLEL_EXTRACTION_MIN_SECONDS, DEFAULT_EXTRACTION_WORKERS,
+    PREVIEW_MAX_SECONDS, PREVIEW_MAX_FALLBACK_BYTES
+)
+from utils.upload_utils import spool_upload
+from utils.workspace_utils import create_job, OUTPUT
+from utils.batch_utils import (
+    BatchItem, run_queue, output_stem, write_zip, queue_summary, QUEUED, PREPARING, READY, PROCESSING, DONE, FAILED
+)
+from utils.cache_utils import cache_key
+from utils.admission_utils import (
+    estimate_job_footprint, admit_job, wait_for_admission, check_upload_space, record_footprint,
+    FootprintMonitor, ADMIT, DEFER
+)
+from utils.archive_utils import (
+    archive_lecture, find_lecture_by_hash, get_lecture, search_archive, format_timestamp, align_blocks
+)
+from utils.view_utils import page_count, clamp_page, page_bounds, page_of, search_blocks, highlight_snippet
+from utils.reformulate_utils import clean_text, split_chunks
+from utils.progress_utils import (
+    ProgressTracker, format_duration, TRANSCRIPTION_STAGE, NOTES_STAGE, AUDIO_UNIT, TOKEN_UNIT,
+    NOTES_TOKENS_PER_AUDIO_SECOND
+)
 from utils.pdf_utils import save_pdf, PDFGenerationError
 import os
 import sys
-import tempfile
-import shutil
 import re
+import time
 import logging
 from pathlib import Path
 
@@ -51,10 +74,134 @@ def validate_file_type(extension):
         return False
     return True
 
+STAGE_LABELS = {TRANSCRIPTION_STAGE: "🎧 Trascrizione", NOTES_STAGE: "✍️ Appunti"}
+
+def progress_status(snapshot):
+    """Riga di stato di un job: fase, avanzamento, RTF o token/s, ETA della fase e totale"""
+    if snapshot["unit"] == AUDIO_UNIT:
+        amount = f"{format_duration(snapshot['done'])} / {format_duration(snapshot['total'])} di audio"
+        speed = f"RTF {snapshot['rtf']:.2f}" if snapshot["rtf"] else "RTF --"
+    else:
+        amount = f"{snapshot['done']:.0f} / ~{snapshot['total']:.0f} token"
+        speed = f"{snapshot['rate']:.1f} token/s" if snapshot["rate"] else "-- token/s"
+    return (
+        f"{STAGE_LABELS.get(snapshot['stage'], snapshot['stage'])}: {amount} · {speed} · "
+        f"fase {format_duration(snapshot['stage_eta'])} · totale {format_duration(snapshot['eta'])}"
+    )
+
+# Le interazioni con la vista paginata rieseguono solo il frammento, non l'elaborazione (Streamlit >= 1.33)
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+def _go_to_page(key, page):
+    st.session_state[f"{key}_page"] = page
+
+def _jump_to_block(key):
+    # Il salto azzera la ricerca: il blocco è mostrato nella sua pagina della lezione
+    position = st.session_state[f"{key}_jump"] - 1
+    st.session_state[f"{key}_query"] = ""
+    st.session_state[f"{key}_focus"] = position
+    st.session_state[f"{key}_page"] = page_of(position)
+
+@_fragment
+def show_block_view(blocks, spans=None, key="compare", focus=None):
+    """
+    Confronto paginato tra testo originale e appunti: vengono disegnati solo i blocchi della pagina,
+    con ricerca nei blocchi e salto a un blocco. focus apre la pagina del blocco indicato.
+    """
+    if not blocks:
+        return
+    page_key, focus_key, query_key = f"{key}_page", f"{key}_focus", f"{key}_query"
+    if focus is not None and focus_key not in st.session_state:
+        st.session_state[focus_key] = focus
+        st.session_state[page_key] = page_of(focus)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("🔎 Cerca nei blocchi", key=query_key, on_change=_go_to_page, args=(key, 0))
+    with col2:
+        st.number_input("Vai al blocco", min_value=1, max_value=len(blocks), step=1, key=f"{key}_jump",
+                        on_change=_jump_to_block, args=(key,))
+    
+    matches = search_blocks(blocks, query)
+    positions = range(len(blocks)) if matches is None else matches
+    if matches is not None:
+        st.caption(f"{len(matches)} blocchi trovati" if matches else "Nessun blocco trovato")
+    page = clamp_page(st.session_state.get(page_key, 0), len(positions))
+    start, end = page_bounds(page, len(positions))
+    pages = page_count(len(positions))
+    
+    nav1, nav2, nav3 = st.columns([1, 3, 1])
+    with nav1:
+        st.button("◀", key=f"{key}_prev", disabled=page == 0, on_click=_go_to_page, args=(key, page - 1))
+    with nav2:
+        st.caption(f"Pagina {page + 1} di {pages} · blocchi {start + 1 if end else 0}–{end} di {len(positions)}")
+    with nav3:
+        st.button("▶", key=f"{key}_next", disabled=page >= pages - 1, on_click=_go_to_page, args=(key, page + 1))
+    
+    focused = st.session_state.get(focus_key)
+    for index in positions[start:end]:
+        original, rewritten = blocks[index]
+        label = f"Blocco {index + 1}"
+        if spans and spans[index][0] is not None:
+            label += f" · {format_timestamp(spans[index][0])}"
+        with st.expander(label, expanded=index == focused or matches is not None):
+            if matches is not None:
+                st.markdown(highlight_snippet(original + " " + (rewritten or ""), query))
+            col1, col2 = st.columns(2)
+            with col1:
+                st.markdown("**🎙️ Originale**")
+                st.markdown(f"`{original.strip()}`")
+            with col2:
+                st.markdown("**✏️ Riformulato**")
+                st.markdown(rewritten.strip() if rewritten else "_Nessun appunto_")
+
+def show_archive_search():
+    """Ricerca nell'archivio delle lezioni: ogni risultato apre la lezione sul blocco trovato"""
+    query = st.text_input("🔎 Cerca nelle lezioni archiviate", key="archive_query",
+                          help="Cerca nelle trascrizioni e negli appunti di tutte le lezioni salvate")
+    if query:
+        results = search_archive(query)
+        if not results:
+            st.caption("Nessun risultato")
+        for result in results:
+            label = (f"{result['filename'] or 'Lezione'} · blocco {result['position'] + 1} "
+                     f"· {format_timestamp(result['start_s'])}")
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.markdown(f"**{label}**  \n{result['snippet']}")
+            with col2:
+                if st.button("Apri", key=f"archive_open_{result['chunk_id']}"):
+                    st.session_state["archive_selection"] = (result["lecture_id"], result["position"])
+    
+    selection = st.session_state.get("archive_selection")
+    if selection:
+        lecture = get_lecture(selection[0])
+        if lecture is None:
+            st.session_state.pop("archive_selection", None)
+            return
+        lecture_id, position = selection
+        st.subheader(f"📖 {lecture['filename'] or 'Lezione'} ({time.strftime('%d/%m/%Y', time.localtime(lecture['created']))})")
+        # Si apre la pagina del blocco trovato (chiave per selezione: un nuovo risultato riparte dal suo blocco)
+        show_block_view(
+            [(chunk["text"], chunk["notes"]) for chunk in lecture["chunks"]],
+            spans=[(chunk["start_s"], chunk["end_s"]) for chunk in lecture["chunks"]],
+            key=f"archive_{lecture_id}_{position}",
+            focus=position
+        )
+        if st.button("Chiudi lezione", key="archive_close"):
+            st.session_state.pop("archive_selection", None)
+            st.rerun()
+
 # Interfaccia principale
 st.title("📚 Trascrizione & Appunti Universitari")
 st.markdown("---")
 
+with st.expander("🗄️ Archivio lezioni", expanded=bool(st.session_state.get("archive_selection"))):
+    try:
+        show_archive_search()
+    except Exception as e:
+        st.error(f"❌ Errore archivio: {str(e)}")
+
 # Sidebar per configurazioni
 with st.sidebar:
     st.header("⚙️ Configurazioni")
@@ -70,6 +217,26 @@ with st.sidebar:
         help="Aggiunge titoletti esplicativi agli appunti"
     )
     
+    notes_mode = st.selectbox(
+        "📚 Modalità appunti", 
+        ["Per blocchi", "Gerarchica (riassunto)"],
+        help="Gerarchica: appunti per blocco in parallelo, poi riassunti di sezione e della lezione (consigliata per lezioni lunghe)"
+    )
+    
+    job_deadline_minutes = st.slider(
+        "⏳ Tempo massimo generazione appunti (min)", 
+        min_value=0, 
+        max_value=120, 
+        value=0,
+        step=5,
+        help="Scadenza dell'intero job di riformulazione (0 = nessun limite): i blocchi oltre la scadenza non vengono riformulati"
+    )
+    
+    hedge_requests = st.checkbox(
+        "🏁 Richieste duplicate per blocchi lenti", 
+        help="Se un blocco tarda oltre la latenza tipica viene inviata una seconda richiesta e si usa la prima risposta (utile con OLLAMA_NUM_PARALLEL > 1)"
+    )
+    
     compare_blocks = st.checkbox(
         "🔍 Mostra confronto blocchi", 
         help="Mostra confronto tra trascrizione originale e appunti"
@@ -89,6 +256,31 @@ with st.sidebar:
         help="Modello Whisper per la trascrizione (più grande = più accurato)"
     )
     
+    language = st.selectbox(
+        "🌐 Lingua della lezione", 
+        ["auto", "it", "en", "fr", "de", "es"], 
+        index=0,
+        help="Con 'auto' la lingua viene rilevata una sola volta su alcuni tratti di parlato e usata per tutti i blocchi"
+    )
+    
+    available_backends = get_available_backends()
+    asr_backend = st.selectbox(
+        "🛠️ Motore di trascrizione", 
+        available_backends,
+        index=available_backends.index(DEFAULT_ASR_BACKEND) if DEFAULT_ASR_BACKEND in available_backends else 0,
+        help="openai-whisper (predefinito) o faster-whisper (CTranslate2, più veloce su CPU)"
+    )
+    
+    progressive_mode = st.checkbox(
+        "⚡ Trascrizione progressiva", 
+        help=f"Mostra subito una bozza (modello {DRAFT_MODEL_SIZE}) e la sostituisce blocco per blocco con il modello scelto"
+    )
+    
+    quantize_model = st.checkbox(
+        "⚡ Quantizzazione int8 (CPU)", 
+        help="Modello quantizzato int8: più veloce e leggero su CPU, accuratezza leggermente inferiore"
+    )
+    
     chunk_duration = st.slider(
         "⏱️ Durata blocchi audio (sec)", 
         min_value=10, 
@@ -97,19 +289,388 @@ with st.sidebar:
         step=10,
         help="Durata di ogni blocco audio per la trascrizione"
     )
+    
+    chunk_overlap = st.slider(
+        "🔗 Sovrapposizione blocchi (sec)", 
+        min_value=0, 
+        max_value=10, 
+        value=0,
+        help="Secondi condivisi tra blocchi consecutivi: evita parole tagliate ai confini (massimo metà della durata blocco)"
+    )
+    
+    batch_size = st.slider(
+        "📦 Blocchi per batch Whisper", 
+        min_value=1, 
+        max_value=16, 
+        value=1,
+        help="Blocchi trascritti insieme in un solo passaggio del modello (attivo con blocchi fino a 30 sec). "
+             "Sperimentale: senza fallback di temperatura e con massimo 224 token per blocco; "
+             "verifica la qualità con 'python benchmark.py batch' prima di usarlo"
+    )
+    
+    reuse_archive = st.checkbox(
+        "♻️ Riusa lezioni archiviate", 
+        value=True,
+        help="Se lo stesso file è già stato elaborato, trascrizione e appunti vengono recuperati dall'archivio"
+    )
+    
+    hallucination_guard = st.checkbox(
+        "🛡️ Filtro allucinazioni", 
+        value=True,
+        help="Salta i blocchi silenziosi e tronca le ripetizioni in ciclo (es. 'Grazie. Grazie. Grazie...') prima degli appunti"
+    )
+
+def _reusable_lecture(lecture):
+    """
+    Lezione archiviata riusabile solo se trascritta con modello, motore e lingua scelti ora
+    (come per gli appunti): chi passa a un modello più grande vuole una nuova trascrizione.
+    """
+    if lecture is None:
+        return None
+    if lecture["model_size"] != model_size or lecture["metadata"].get("backend") != asr_backend:
+        return None
+    if language != "auto" and lecture["language"] != language:
+        return None
+    return lecture
+
+def _batch_status_label(item):
+    labels = {
+        QUEUED: "⏳ In coda",
+        PREPARING: "🎬 Preparazione audio...",
+        READY: "✅ Audio pronto, in attesa",
+        DONE: "✅ Completato",
+    }
+    if item.status in (PROCESSING, READY) and item.message:
+        return item.message
+    if item.status == PROCESSING:
+        return "🎧 Elaborazione..."
+    if item.status == FAILED:
+        return f"❌ {item.message}"
+    if item.status == DONE and item.elapsed is not None:
+        return f"{labels[DONE]} in {format_duration(item.elapsed)}"
+    return labels.get(item.status, item.status)
+
+def _prepare_batch_item(item):
+    """
+    Ingest di un file della coda (thread di preparazione): salvataggio, ammissione e audio mono 16 kHz.
+    Se le risorse sono occupate dal file in elaborazione l'ammissione (e la normalizzazione)
+    è rinviata al turno del file, senza attendere qui.
+    """
+    job = item.job.activate()
+    try:
+        upload_ok, upload_msg = check_upload_space(item.source.size)
+        if not upload_ok:
+            raise RuntimeError(upload_msg)
+        extension = item.name.split(".")[-1].lower()
+        input_path = job.path_for(f"input.{extension}")
+        item.data["hash"], upload_bytes = spool_upload(item.source, input_path)
+        item.data["info"] = input_info = probe_audio(input_path)
+        
+        archived = _reusable_lecture(find_lecture_by_hash(item.data["hash"])) if reuse_archive else None
+        item.data["archived"] = archived
+        if archived is not None:
+            return
+        
+        if input_info is not None:
+            footprint = estimate_job_footprint(
+                input_info,
+                upload_bytes,
+                model_size=model_size,
+                backend=asr_backend,
+                quantize=quantize_model,
+                batch_windows=1 if chunk_duration > 30 else batch_size,
+                normalized=check_ffmpeg_available(),
+                loaded_models=[model_size] if is_model_loaded(asr_backend, model_size, quantize_model) else []
+            )
+            item.data["footprint"] = footprint
+        
+        if not _admit_batch_item(item):
+            item.set_status(READY, "⏸️ In attesa che il file in corso liberi le risorse")
+    except Exception:
+        _release_batch_item(item)
+        raise
+    finally:
+        job.deactivate()
+
+def _admit_batch_item(item, on_wait=None):
+    """
+    Ammissione del file e audio mono 16 kHz (con il job del file attivo).
+    Senza on_wait (preparazione in anticipo) l'ammissione è tentata una volta: se rinviata
+    restituisce False. Con on_wait(messaggio, secondi) attende come wait_for_admission.
+    """
+    job = item.job
+    footprint = item.data.get("footprint")
+    if footprint is not None and "monitor" not in item.data:
+        if on_wait is None:
+            status, message = admit_job(job, footprint)
+            if status == DEFER:
+                return False
+        else:
+            status, message = wait_for_admission(job, footprint, on_wait=on_wait)
+        if status != ADMIT:
+            raise RuntimeError(f"Job non ammesso: {message}")
+        item.data["monitor"] = FootprintMonitor(job).start()
+    
+    extension = item.name.split(".")[-1].lower()
+    input_path = job.path_for(f"input.{extension}")
+    audio_path = job.path_for("audio.wav")
+    success, error_msg, normalized_path = normalize_audio(input_path, audio_path)
+    if success:
+        audio_path = normalized_path
+    elif extension == "mp4":
+        raise RuntimeError(f"Impossibile estrarre audio dal video: {error_msg}")
+    else:
+        logger.warning(f"Normalizzazione non riuscita per {item.name}, uso il file originale: {error_msg}")
+        audio_path = input_path
+    if not validate_audio_file(audio_path):
+        raise RuntimeError("File audio non valido o corrotto")
+    item.data["audio_path"] = audio_path
+    return True
+
+def _release_batch_item(item):
+    """Chiude la misura dell'ingombro (e la riserva di risorse) del file"""
+    monitor = item.data.pop("monitor", None)
+    if monitor is not None:
+        record_footprint(item.job, item.data["footprint"], monitor)
+
+def _write_batch_output(item, name, text, title):
+    """Salva un output TXT e PDF del file nel suo job e lo aggiunge allo zip"""
+    txt_path = item.job.path_for(f"{name}.txt", OUTPUT)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    item.outputs.append((f"{item.data['stem']}/{name}.txt", txt_path))
+    try:
+        pdf_path = item.job.path_for(f"{name}.pdf", OUTPUT)
+        save_pdf(text, title=title, filename=pdf_path)
+        item.outputs.append((f"{item.data['stem']}/{name}.pdf", pdf_path))
+    except Exception as e:
+        # Il TXT basta: un PDF non generabile non fa fallire il file
+        logger.warning(f"PDF {name} non generato per {item.name}: {e}")
+
+def _process_batch_item(item, render):
+    """Trascrizione e appunti di un file della coda (thread dello script: modello condiviso)"""
+    job = item.job.activate()
+    try:
+        archived = item.data.get("archived")
+        info = item.data.get("info")
+        if archived is None and "audio_path" not in item.data:
+            # Ammissione rinviata in preparazione: ora il file precedente ha liberato le risorse
+            def show_wait(message, elapsed):
+                item.message = f"⏸️ In attesa di risorse ({elapsed:.0f}s): {message}"
+                render(item)
+            _admit_batch_item(item, on_wait=show_wait)
+            item.message = ""
+            render(item)
+        duration = (archived or {}).get("duration_s") or (info or {}).get("duration_ms", 0) / 1000
+        
+        def show_progress(snapshot):
+            item.progress = min(1.0, snapshot["overall_fraction"])
+            if snapshot["stage"] is not None:
+                item.message = progress_status(snapshot)
+            render(item)
+        
+        tracker = ProgressTracker(on_update=show_progress)
+        if archived is None:
+            tracker.plan(TRANSCRIPTION_STAGE, duration, AUDIO_UNIT)
+        if generate_notes:
+            tracker.plan(NOTES_STAGE, duration * NOTES_TOKENS_PER_AUDIO_SECOND, TOKEN_UNIT)
+        
+        transcription_stats = {}
+        if archived is not None:
+            transcription = archived["transcript"]
+            processing_time = 0.0
+            transcription_stats["language"] = archived["language"]
+        else:
+            transcription, processing_time = transcribe_whisper_blocks(
+                item.data["audio_path"],
+                language=language,
+                model_size=model_size,
+                chunk_duration=chunk_duration,
+                batch_size=batch_size,
+                quantize=quantize_model,
+                backend=asr_backend,
+                overlap=min(chunk_overlap, chunk_duration // 2),
+                stats=transcription_stats,
+                guard=hallucination_guard,
+                progress=tracker
+            )
+        if not transcription or not transcription.strip():
+            raise RuntimeError("Trascrizione vuota")
+        _write_batch_output(item, "trascrizione", transcription, "Trascrizione Lezione")
+        
+        final_notes, notes_by_block = "", []
+        notes_settings = {"notes_mode": notes_mode, "formal_level": formal_level, "use_sections": add_sections}
+        archived_notes = (
+            archived is not None
+            and archived["notes"]
+            and all(archived["metadata"].get(key) == value for key, value in notes_settings.items())
+        )
+        if generate_notes:
+            if archived_notes:
+                final_notes = archived["notes"]
+            elif notes_mode == "Gerarchica (riassunto)":
+                final_notes, notes_by_block, _ = reformulate_hierarchical(
+                    transcription, formal_level=formal_level, use_sections=add_sections,
+                    job_deadline=job_deadline_minutes * 60 or None, hedge=hedge_requests, progress=tracker
+                )
+            else:
+                final_notes, notes_by_block = reformulate_transcription(
+                    transcription, formal_level=formal_level, use_sections=add_sections,
+                    job_deadline=job_deadline_minutes * 60 or None, hedge=hedge_requests, progress=tracker
+                )
+            if final_notes:
+                _write_batch_output(item, "appunti", final_notes, "Appunti Universitari")
+        
+        if archived is None or (final_notes and not archived_notes):
+            try:
+                archive_lecture(
+                    item.data["hash"],
+                    transcription,
+                    notes_by_block if final_notes else [(chunk, "") for chunk in split_chunks(clean_text(transcription))],
+                    segments=transcription_stats.get("segments"),
+                    notes=final_notes,
+                    filename=item.name,
+                    job_id=job.id,
+                    metadata=dict(
+                        notes_settings if final_notes else {},
+                        duration_s=duration or None,
+                        language=transcription_stats.get("language"),
+                        language_probability=transcription_stats.get("language_probability"),
+                        model_size=archived["model_size"] if archived else model_size,
+                        backend=asr_backend,
+                        processing_time=processing_time
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"Impossibile archiviare {item.name}: {e}")
+        
+        if generate_notes and not final_notes:
+            item.message = "⚠️ Appunti non generati, solo trascrizione"
+        elif archived is not None:
+            item.message = "♻️ Dall'archivio"
+        else:
+            item.message = ""
+    finally:
+        _release_batch_item(item)
+        job.deactivate()
+        # Audio normalizzato e blocchi rimossi subito: lo spazio serve ai file successivi
+        job.release_scratch()
+
+def process_batch(uploaded_files):
+    """
+    Coda di più lezioni: un solo caricamento del modello, audio del file successivo preparato
+    mentre il precedente è in trascrizione, una riga di avanzamento per file e uno zip finale.
+    """
+    st.header(f"📚 Coda di {len(uploaded_files)} file")
+    files = []
+    for uploaded in uploaded_files:
+        name = sanitize_filename(uploaded.name)
+        if not name:
+            st.error(f"❌ Nome file non valido: {uploaded.name}")
+        elif validate_file_size(uploaded.size / (1024 * 1024)) and validate_file_type(name.split(".")[-1]):
+            files.append((name, uploaded))
+    if not files:
+        st.stop()
+    
+    signature = cache_key([(name, uploaded.size) for name, uploaded in files])
+    previous = st.session_state.get("batch_result")
+    start = st.button("▶️ Elabora la coda", type="primary")
+    if not start:
+        if previous and previous["signature"] == signature:
+            show_batch_result(previous)
+        else:
+            st.caption(f"{len(files)} file pronti: trascrizione in sequenza con lo stesso modello e uno zip con tutti gli output")
+        return
+    
+    # Job creati all'inizio: la quota non rimuove gli output dei file già elaborati prima dello zip
+    items = [BatchItem(name, uploaded, create_job("lesson")) for name, uploaded in files]
+    batch_job = create_job("batch")
+    used_stems = set()
+    for item in items:
+        item.data["stem"] = output_stem(item.name, used_stems)
+    
+    rows = []
+    for item in items:
+        col1, col2, col3 = st.columns([2, 4, 2])
+        with col1:
+            st.markdown(f"**{item.name}**")
+        rows.append((col2.empty(), col3.empty()))
+    
+    def render(item=None):
+        for row_item, (status_slot, bar_slot) in zip(items, rows):
+            if item is None or row_item is item:
+                status_slot.caption(_batch_status_label(row_item))
+                bar_slot.progress(row_item.progress)
+    
+    def process(item):
+        render(item)
+        _process_batch_item(item, render)
+    
+    render()
+    try:
+        run_queue(items, _prepare_batch_item, process, on_wait=render)
+        render()
+        
+        entries = [entry for item in items for entry in item.outputs]
+        zip_path = None
+        if entries:
+            zip_path = batch_job.path_for("lezioni.zip", OUTPUT)
+            zip_bytes = write_zip(entries, zip_path)
+            logger.info(f"Zip della coda: {len(entries)} file, {zip_bytes} byte")
+        result = {
+            "signature": signature,
+            "zip_path": zip_path,
+            "rows": [(item.name, _batch_status_label(item)) for item in items],
+            "summary": queue_summary(items),
+        }
+        st.session_state["batch_result"] = result
+        show_batch_result(result, show_rows=False)
+    finally:
+        # Coda interrotta (anche da un rerun): riserve e monitor dei file preparati ma non elaborati
+        for item in items:
+            _release_batch_item(item)
+        for job in [item.job for item in items] + [batch_job]:
+            job.finish()
+
+def show_batch_result(result, show_rows=True):
+    """Esito della coda (anche dopo il rerun causato dal download) e zip degli output"""
+    if show_rows:
+        for name, label in result["rows"]:
+            col1, col2 = st.columns([2, 6])
+            with col1:
+                st.markdown(f"**{name}**")
+            with col2:
+                st.caption(label)
+    summary = result["summary"]
+    completed, failed = summary.get(DONE, 0), summary.get(FAILED, 0)
+    if failed:
+        st.warning(f"⚠️ {completed} file elaborati, {failed} non riusciti")
+    else:
+        st.success(f"✅ {completed} file elaborati")
+    if result["zip_path"] and os.path.exists(result["zip_path"]):
+        with open(result["zip_path"], "rb") as file:
+            st.download_button(
+                "🗜️ Scarica tutti gli output (.zip)",
+                file,
+                file_name="lezioni.zip",
+                mime="application/zip",
+                help="Trascrizioni e appunti di tutti i file, in TXT e PDF"
+            )
 
 # Area principale
 st.header("🎙️ Carica File Audio/Video")
 
-uploaded_file = st.file_uploader(
+uploaded_files = st.file_uploader(
     "Seleziona file audio o video", 
     type=["mp3", "wav", "m4a", "mp4"],
-    help="Formati supportati: MP3, WAV, M4A, MP4 (massimo 500MB)"
+    accept_multiple_files=True,
+    help="Formati supportati: MP3, WAV, M4A, MP4 (massimo 500MB per file). Più file vengono elaborati in coda"
 )
+uploaded_file = uploaded_files[0] if len(uploaded_files or []) == 1 else None
 
-# Variabili per cleanup
-temp_files = []
-temp_dirs = []
+# Job del workspace (artefatti temporanei e output) e misura del suo ingombro
+job = None
+footprint_monitor = None
 
 if uploaded_file:
     try:
@@ -139,66 +700,217 @@ if uploaded_file:
         with col3:
             st.metric("🎵 Tipo", extension.upper())
         
-        # Anteprima audio
-        st.audio(uploaded_file)
-        
         # Creazione file temporaneo sicuro
         try:
-            # Crea directory temporanea sicura
-            temp_dir = tempfile.mkdtemp(prefix="lesson_notes_")
-            temp_dirs.append(temp_dir)
+            # Job nel workspace gestito: gli artefatti temporanei vengono rimossi a fine job,
+            # gli output (PDF) restano finché la quota non richiede di liberare spazio
+            job = create_job("lesson").activate()
+            
+            # Spazio per l'upload prima di scriverlo su disco
+            upload_ok, upload_msg = check_upload_space(uploaded_file.size)
+            if not upload_ok:
+                st.error(f"❌ {upload_msg}")
+                st.stop()
+            
+            temp_input_path = job.path_for(f"input.{extension}")
+            
+            # Salva file caricato a blocchi (memoria costante), con hash del contenuto
+            upload_hash, upload_bytes = spool_upload(uploaded_file, temp_input_path)
+            logger.info(f"Upload salvato: {sanitized_filename} ({upload_bytes} byte, sha256 {upload_hash[:12]})")
+            
+            # Stesso audio già elaborato: si riusano i risultati dell'archivio
+            archived_lecture = find_lecture_by_hash(upload_hash) if reuse_archive else None
+            if archived_lecture is not None and _reusable_lecture(archived_lecture) is None:
+                st.info(
+                    f"♻️ File già trascritto con {archived_lecture['model_size']} "
+                    f"({archived_lecture['metadata'].get('backend') or 'motore non registrato'}, "
+                    f"lingua {archived_lecture['language'] or 'n/d'}): nuova trascrizione con le impostazioni scelte"
+                )
+                archived_lecture = None
+            if archived_lecture is not None:
+                st.info(
+                    f"♻️ File già elaborato il "
+                    f"{time.strftime('%d/%m/%Y %H:%M', time.localtime(archived_lecture['created']))}: "
+                    f"trascrizione recuperata dall'archivio"
+                )
+            
+            # Ammissione: picco previsto di disco e RAM del job rispetto alle risorse libere
+            input_info = probe_audio(temp_input_path)
+            if input_info is not None and archived_lecture is None:
+                use_draft = progressive_mode and model_size != DRAFT_MODEL_SIZE
+                footprint = estimate_job_footprint(
+                    input_info,
+                    upload_bytes,
+                    model_size=model_size,
+                    backend=asr_backend,
+                    quantize=quantize_model,
+                    draft_model_size=DRAFT_MODEL_SIZE if use_draft else None,
+                    batch_windows=1 if use_draft or chunk_duration > 30 else batch_size,
+                    normalized=check_ffmpeg_available(),
+                    loaded_models=[
+                        size for size in (model_size, DRAFT_MODEL_SIZE)
+                        if is_model_loaded(asr_backend, size, quantize_model)
+                    ]
+                )
+                admission_status = st.empty()
+                
+                def show_admission_wait(message, elapsed):
+                    admission_status.info(f"⏳ In attesa di risorse ({elapsed:.0f}s): {message}")
+                
+                status, message = wait_for_admission(job, footprint, on_wait=show_admission_wait)
+                admission_status.empty()
+                if status == DEFER:
+                    st.error(f"❌ Risorse occupate da altri job, riprova più tardi: {message}")
+                    st.stop()
+                elif status != ADMIT:
+                    st.error(f"❌ Job rifiutato: {message}. Prova un modello più piccolo o un file più corto.")
+                    st.stop()
+                footprint_monitor = FootprintMonitor(job).start()
             
-            temp_input_path = os.path.join(temp_dir, f"input.{extension}")
-            temp_files.append(temp_input_path)
+            # Anteprima audio: proxy leggero invece di reinviare l'intero file al browser
+            preview_path = job.path_for("preview.mp3")
+            preview_ok, _ = make_preview_audio(temp_input_path, preview_path)
+            if preview_ok:
+                st.audio(preview_path, format="audio/mpeg")
+                st.caption(f"🔈 Anteprima a bassa qualità dei primi {PREVIEW_MAX_SECONDS // 60} minuti")
+            elif uploaded_file.size <= PREVIEW_MAX_FALLBACK_BYTES:
+                st.audio(temp_input_path)
+            else:
+                st.caption("🔈 Anteprima non disponibile senza FFmpeg per file di queste dimensioni")
             
-            # Salva file caricato
-            with open(temp_input_path, "wb") as f:
-                f.write(uploaded_file.read())
+            if archived_lecture is None:
+                # Registrazioni lunghe: estrazione parallela a segmenti durante la trascrizione
+                use_parallel_extraction = (
+                    input_info is not None
+                    and input_info["duration_ms"] / 1000 >= PARALLEL_EXTRACTION_MIN_SECONDS
+                    and check_ffmpeg_available()
+                )
+                extraction_workers = DEFAULT_EXTRACTION_WORKERS if use_parallel_extraction else 1
             
-            # Gestione audio/video
-            if extension == "mp4":
-                temp_audio_path = os.path.join(temp_dir, "audio.wav")
-                temp_files.append(temp_audio_path)
+                if use_parallel_extraction:
+                    st.info(f"⚡ Registrazione lunga: estrazione audio parallela ({extraction_workers} processi)")
+                    temp_audio_path = temp_input_path
+                else:
+                    # Ingest unico audio/video: un solo passaggio FFmpeg verso PCM mono 16 kHz
+                    temp_audio_path = job.path_for("audio.wav")
+                
+                    with st.spinner("🎬 Preparazione audio (mono 16 kHz)..."):
+                        success, error_msg, normalized_path = normalize_audio(temp_input_path, temp_audio_path)
                 
-                with st.spinner("🎬 Estrazione audio dal video..."):
-                    success, error_msg = extract_audio(temp_input_path, temp_audio_path)
-                    if not success:
+                    if success:
+                        temp_audio_path = normalized_path
+                    elif extension == "mp4":
                         st.error(f"❌ Impossibile estrarre audio dal video: {error_msg}")
                         st.stop()
-            else:
-                # Per file audio diretti
-                temp_audio_path = temp_input_path
+                    else:
+                        # Per file audio diretti si può procedere anche senza FFmpeg
+                        st.warning(f"⚠️ Normalizzazione audio non riuscita, uso il file originale: {error_msg}")
+                        temp_audio_path = temp_input_path
             
-            # Validazione file audio
-            if not validate_audio_file(temp_audio_path):
-                st.error("❌ File audio non valido o corrotto")
-                st.stop()
+                # Validazione file audio
+                if not validate_audio_file(temp_audio_path):
+                    st.error("❌ File audio non valido o corrotto")
+                    st.stop()
             
             # Progress bar con gestione errori
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            def update_progress(pct, status="Trascrizione in corso..."):
-                progress_bar.progress(pct)
-                status_text.text(f"🎧 {status}")
+            def show_progress(snapshot):
+                """Barra sul tempo stimato dell'intero job; testo con velocità ed ETA della fase"""
+                progress_bar.progress(min(1.0, snapshot["overall_fraction"]))
+                if snapshot["stage"] is not None:
+                    status_text.text(progress_status(snapshot))
+            
+            # Piano del job: la fase appunti è stimata dalla durata finché il testo non è noto
+            tracker = ProgressTracker(on_update=show_progress)
+            audio_duration = (archived_lecture or {}).get("duration_s") or (input_info or {}).get("duration_ms", 0) / 1000
+            if archived_lecture is None:
+                tracker.plan(TRANSCRIPTION_STAGE, audio_duration, AUDIO_UNIT)
+            if generate_notes:
+                tracker.plan(NOTES_STAGE, audio_duration * NOTES_TOKENS_PER_AUDIO_SECOND, TOKEN_UNIT)
             
             # Trascrizione con gestione errori
             st.header("🎧 Trascrizione")
             
+            transcription_stats = {}
             try:
-                with st.spinner("🎧 Trascrizione in corso..."):
-                    transcription, processing_time = transcribe_whisper_blocks(
+                if archived_lecture is not None:
+                    transcription = archived_lecture["transcript"]
+                    processing_time, first_text_time = 0.0, None
+                    transcription_stats["language"] = archived_lecture["language"]
+                    transcription_stats["language_probability"] = archived_lecture["metadata"].get("language_probability")
+                    transcription_stats["segments"] = [
+                        {"start": chunk["start_s"], "end": chunk["end_s"], "text": chunk["text"]}
+                        for chunk in archived_lecture["chunks"] if chunk["start_s"] is not None
+                    ]
+                    progress_bar.progress(1.0)
+                elif progressive_mode and model_size != DRAFT_MODEL_SIZE:
+                    # Bozza immediata, sostituita blocco per blocco dal modello scelto
+                    live_transcript = st.empty()
+                    live_updates = [0]
+                    
+                    def show_live_transcript(texts, refined):
+                        live_updates[0] += 1
+                        done = sum(refined)
+                        live_transcript.text_area(
+                            f"📝 Trascrizione (bozza in aggiornamento, {done}/{len(refined)} blocchi definitivi)",
+                            "\n\n".join(text for text in texts if text),
+                            height=300,
+                            key=f"live_transcript_{live_updates[0]}"
+                        )
+                    
+                    transcription, processing_time, first_text_time = transcribe_progressive(
                         temp_audio_path,
+                        language=language,
                         model_size=model_size,
+                        on_update=show_live_transcript,
                         chunk_duration=chunk_duration,
-                        progress_callback=update_progress
+                        quantize=quantize_model,
+                        backend=asr_backend,
+                        stats=transcription_stats,
+                        guard=hallucination_guard,
+                        progress=tracker
                     )
+                    live_transcript.empty()
+                else:
+                    first_text_time = None
+                    with st.spinner("🎧 Trascrizione in corso..."):
+                        transcription, processing_time = transcribe_whisper_blocks(
+                            temp_audio_path,
+                            language=language,
+                            model_size=model_size,
+                            chunk_duration=chunk_duration,
+                            extraction_workers=extraction_workers,
+                            batch_size=batch_size,
+                            quantize=quantize_model,
+                            backend=asr_backend,
+                            overlap=min(chunk_overlap, chunk_duration // 2),
+                            stats=transcription_stats,
+                            guard=hallucination_guard,
+                            progress=tracker
+                        )
                 
                 if not transcription or transcription.strip() == "":
                     st.error("❌ Trascrizione fallita. Verifica che il file contenga audio valido.")
                     st.stop()
                 
-                st.success(f"✅ Trascrizione completata in {processing_time:.1f}s")
+                if archived_lecture is None:
+                    st.success(f"✅ Trascrizione completata in {processing_time:.1f}s")
+                if first_text_time is not None:
+                    st.caption(f"⚡ Prima bozza disponibile dopo {first_text_time:.1f}s")
+                if language == "auto" and transcription_stats.get("language"):
+                    probability = transcription_stats.get("language_probability") or 0
+                    st.info(f"🌐 Lingua rilevata: {transcription_stats['language']} ({probability:.0%})")
+                guard_stats = transcription_stats.get("guard") or {}
+                if any(guard_stats.values()):
+                    st.caption(
+                        f"🛡️ Filtro allucinazioni: {guard_stats['silent_chunks']} blocchi silenziosi saltati, "
+                        f"{guard_stats['truncated_segments']} ripetizioni troncate, "
+                        f"{guard_stats.get('redecoded_chunks', 0)} blocchi ridecodificati, "
+                        f"{guard_stats['no_speech_segments'] + guard_stats['repetitive_segments']} segmenti scartati, "
+                        f"{guard_stats['dropped_chunks']} blocchi esclusi"
+                    )
                 
                 # Mostra trascrizione
                 st.text_area(
@@ -213,6 +925,13 @@ if uploaded_file:
                 st.stop()
             
             # Generazione appunti
+            final_notes, notes_by_block = "", []
+            notes_settings = {"notes_mode": notes_mode, "formal_level": formal_level, "use_sections": add_sections}
+            archived_notes = (
+                archived_lecture is not None
+                and archived_lecture["notes"]
+                and all(archived_lecture["metadata"].get(key) == value for key, value in notes_settings.items())
+            )
             if generate_notes and transcription:
                 st.header("✏️ Generazione Appunti")
                 
@@ -223,12 +942,50 @@ if uploaded_file:
                         st.error(f"❌ Errori di validazione: {', '.join(validation_errors)}")
                         st.stop()
                     
+                    reformulation_stats = {}
                     with st.spinner("✍️ Generazione appunti..."):
-                        final_notes, notes_by_block = reformulate_transcription(
-                            transcription,
-                            formal_level=formal_level,
-                            use_sections=add_sections
+                        if archived_notes:
+                            # Stesse impostazioni: appunti e blocchi dall'archivio
+                            final_notes = archived_lecture["notes"]
+                            notes_by_block = [(chunk["text"], chunk["notes"]) for chunk in archived_lecture["chunks"]]
+                            st.caption("♻️ Appunti recuperati dall'archivio")
+                        elif notes_mode == "Gerarchica (riassunto)":
+                            final_notes, notes_by_block, _ = reformulate_hierarchical(
+                                transcription,
+                                formal_level=formal_level,
+                                use_sections=add_sections,
+                                stats=reformulation_stats,
+                                job_deadline=job_deadline_minutes * 60 or None,
+                                hedge=hedge_requests,
+                                progress=tracker
+                            )
+                        else:
+                            final_notes, notes_by_block = reformulate_transcription(
+                                transcription,
+                                formal_level=formal_level,
+                                use_sections=add_sections,
+                                stats=reformulation_stats,
+                                job_deadline=job_deadline_minutes * 60 or None,
+                                hedge=hedge_requests,
+                                progress=tracker
+                            )
+                    if reformulation_stats.get("saved_calls"):
+                        st.caption(
+                            f"⚡ {reformulation_stats['llm_calls']} chiamate al modello su "
+                            f"{reformulation_stats['chunks']} blocchi ({reformulation_stats['saved_calls']} risparmiate)"
                         )
+                    if reformulation_stats.get("deadline_exceeded") or reformulation_stats.get("retries"):
+                        st.caption(
+                            f"⏳ Richieste scadute: {reformulation_stats.get('deadline_exceeded', 0)}, "
+                            f"nuovi tentativi: {reformulation_stats.get('retries', 0)}"
+                        )
+                    if reformulation_stats.get("hedged_requests"):
+                        st.caption(
+                            f"🏁 Richieste duplicate: {reformulation_stats['hedged_requests']} "
+                            f"({reformulation_stats.get('hedge_wins', 0)} più veloci dell'originale)"
+                        )
+                    if reformulation_stats.get("cache_hits"):
+                        st.caption(f"♻️ {reformulation_stats['cache_hits']} risposte riutilizzate dalla cache")
                     
                     if not final_notes or final_notes.strip() == "":
                         st.warning("⚠️ Nessun appunto valido generato. Prova a ridurre la lunghezza dei blocchi o cambiare tono.")
@@ -246,18 +1003,13 @@ if uploaded_file:
                         # Confronto blocchi
                         if compare_blocks and notes_by_block:
                             st.header("🔍 Confronto Blocchi")
-                            
-                            for idx, (original, rewritten) in enumerate(notes_by_block):
-                                with st.expander(f"Blocco {idx+1}"):
-                                    col1, col2 = st.columns(2)
-                                    
-                                    with col1:
-                                        st.markdown("**🎙️ Originale**")
-                                        st.markdown(f"`{original.strip()}`")
-                                    
-                                    with col2:
-                                        st.markdown("**✏️ Riformulato**")
-                                        st.markdown(rewritten.strip())
+                            show_block_view(
+                                notes_by_block,
+                                spans=align_blocks(
+                                    [original for original, _ in notes_by_block], transcription_stats.get("segments")
+                                ),
+                                key=f"compare_{upload_hash[:12]}"
+                            )
                         
                         # Download appunti
                         st.header("💾 Download")
@@ -276,8 +1028,9 @@ if uploaded_file:
                         with col2:
                             try:
                                 pdf_filename_notes = "appunti_riformulati.pdf"
-                                save_pdf(final_notes, title="Appunti Universitari", filename=pdf_filename_notes)
-                                with open(pdf_filename_notes, "rb") as file:
+                                pdf_path_notes = job.path_for(pdf_filename_notes, OUTPUT)
+                                save_pdf(final_notes, title="Appunti Universitari", filename=pdf_path_notes)
+                                with open(pdf_path_notes, "rb") as file:
                                     st.download_button(
                                         "📘 Scarica PDF Appunti", 
                                         file, 
@@ -295,13 +1048,41 @@ if uploaded_file:
             else:
                 st.info("ℹ️ Appunti non riformulati. Scarica solo la trascrizione.")
             
+            # Archivio: trascrizione, appunti per blocco e metadati restano consultabili e ricercabili
+            if archived_lecture is None or (final_notes and not archived_notes):
+                try:
+                    archive_blocks = notes_by_block if final_notes else [
+                        (chunk, "") for chunk in split_chunks(clean_text(transcription))
+                    ]
+                    archive_lecture(
+                        upload_hash,
+                        transcription,
+                        archive_blocks,
+                        segments=transcription_stats.get("segments"),
+                        notes=final_notes,
+                        filename=sanitized_filename,
+                        job_id=job.id,
+                        metadata=dict(
+                            notes_settings if final_notes else {},
+                            duration_s=input_info["duration_ms"] / 1000 if input_info else None,
+                            language=transcription_stats.get("language"),
+                            language_probability=transcription_stats.get("language_probability"),
+                            model_size=archived_lecture["model_size"] if archived_lecture else model_size,
+                            backend=asr_backend,
+                            processing_time=processing_time
+                        )
+                    )
+                except Exception as e:
+                    st.warning(f"⚠️ Impossibile archiviare la lezione: {str(e)}")
+            
             # PDF trascrizione
             st.header("📄 Download Trascrizione")
             
             try:
                 pdf_filename_transcription = "trascrizione.pdf"
-                save_pdf(transcription, title="Trascrizione Lezione", filename=pdf_filename_transcription)
-                with open(pdf_filename_transcription, "rb") as file:
+                pdf_path_transcription = job.path_for(pdf_filename_transcription, OUTPUT)
+                save_pdf(transcription, title="Trascrizione Lezione", filename=pdf_path_transcription)
+                with open(pdf_path_transcription, "rb") as file:
                     st.download_button(
                         "📄 Scarica PDF Trascrizione", 
                         file, 
@@ -318,21 +1099,25 @@ if uploaded_file:
             st.error(f"❌ Errore generale: {str(e)}")
         
         finally:
-            # Cleanup sicuro
+            # Fine job: rimozione degli artefatti temporanei, gli output restano nel workspace
             try:
-                for temp_file in temp_files:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                
-                for temp_dir in temp_dirs:
-                    if os.path.exists(temp_dir):
-                        shutil.rmtree(temp_dir)
+                if footprint_monitor is not None:
+                    record_footprint(job, footprint, footprint_monitor)
+                if job is not None:
+                    job.deactivate()
+                    job.finish()
             except Exception as e:
                 st.warning(f"⚠️ Errore durante pulizia file temporanei: {str(e)}")
     
     except Exception as e:
         st.error(f"❌ Errore di validazione file: {str(e)}")
 
+elif uploaded_files:
+    try:
+        process_batch(uploaded_files)
+    except Exception as e:
+        st.error(f"❌ Errore elaborazione coda: {str(e)}")
+
 else:
     st.info("☝️ Carica un file audio o video per iniziare")
     
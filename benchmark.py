@@ -0,0 +1,261 @@
+import argparse
+import logging
+import time
+import numpy as np
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _timeit(func, repeat=3):
+    """Esegue func più volte e restituisce (miglior tempo, ultimo risultato)"""
+    best = float("inf")
+    result = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def _snr_db(reference, test):
+    """Rapporto segnale/errore in dB tra due segnali della stessa lunghezza"""
+    n = min(len(reference), len(test))
+    reference, test = reference[:n].astype(np.float64), test[:n].astype(np.float64)
+    noise = np.sum((reference - test) ** 2)
+    if noise == 0:
+        return float("inf")
+    return 10 * np.log10(np.sum(reference ** 2) / noise)
+
+def _synthetic_pcm(seconds, sample_rate, channels=2, seed=0):
+    """Segnale di prova: toni sotto i 4 kHz più rumore, PCM int16 multicanale"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 1234.5 * t)
+    data = np.stack([tone + 0.05 * rng.standard_normal(len(t)) for _ in range(channels)], axis=1)
+    return (np.clip(data, -1, 1) * 32767).astype("<i2")
+
+def bench_resample(args):
+    """Confronta il ricampionatore NumPy con set_frame_rate di pydub"""
+    from pydub import AudioSegment
+    from utils.audio_utils import to_mono_16k_segment, TARGET_SAMPLE_RATE
+    from utils.resample_utils import resample_audio
+
+    if args.input:
+        audio = AudioSegment.from_file(args.input)
+        logger.info(f"Input: {args.input} ({len(audio) / 1000:.1f}s, {audio.frame_rate} Hz, {audio.channels} canali)")
+    else:
+        pcm = _synthetic_pcm(args.seconds, args.rate)
+        audio = AudioSegment(pcm.tobytes(), frame_rate=args.rate, sample_width=2, channels=2)
+        logger.info(f"Input sintetico: {args.seconds}s, {args.rate} Hz, stereo")
+
+    duration_s = len(audio) / 1000
+    pydub_time, pydub_out = _timeit(
+        lambda: audio.set_channels(1).set_frame_rate(TARGET_SAMPLE_RATE), args.repeat
+    )
+    numpy_time, numpy_out = _timeit(lambda: to_mono_16k_segment(audio), args.repeat)
+
+    print(f"pydub set_frame_rate : {pydub_time:.3f}s ({duration_s / pydub_time:.0f}x tempo reale)")
+    print(f"NumPy polifase       : {numpy_time:.3f}s ({duration_s / numpy_time:.0f}x tempo reale)")
+    print(f"Speedup              : {pydub_time / numpy_time:.2f}x")
+
+    # Accuratezza rispetto a un ricampionatore di riferimento
+    samples = np.frombuffer(audio.raw_data, dtype=f"<i{audio.sample_width}").reshape(-1, audio.channels)
+    mono = samples.astype(np.float64).mean(axis=1) / float(2 ** (audio.sample_width * 8 - 1))
+    numpy_signal = np.frombuffer(numpy_out.raw_data, dtype="<i2") / 32768.0
+    pydub_signal = np.frombuffer(pydub_out.raw_data, dtype="<i2") / 32768.0
+    try:
+        from scipy.signal import resample_poly
+        reference = resample_poly(mono, TARGET_SAMPLE_RATE, audio.frame_rate)
+        print(f"SNR vs scipy.resample_poly: NumPy {_snr_db(reference, numpy_signal):.1f} dB, "
+              f"pydub {_snr_db(reference, pydub_signal):.1f} dB")
+    except ImportError:
+        logger.warning("scipy non disponibile: confronto con resample_poly saltato")
+
+    # Riferimento analitico: lo stesso tono generato direttamente a 16 kHz
+    rate = audio.frame_rate
+    t_in = np.arange(int(duration_s * rate)) / rate
+    t_out = np.arange(int(duration_s * TARGET_SAMPLE_RATE)) / TARGET_SAMPLE_RATE
+    tone_in = 0.5 * np.sin(2 * np.pi * 1000 * t_in)
+    tone_out = 0.5 * np.sin(2 * np.pi * 1000 * t_out)
+    resampled_tone = resample_audio(tone_in.astype(np.float32), rate, TARGET_SAMPLE_RATE)
+    # Esclude i bordi, dove il filtro vede zero padding
+    margin = TARGET_SAMPLE_RATE // 10
+    print(f"SNR tono 1 kHz vs riferimento analitico: "
+          f"{_snr_db(tone_out[margin:-margin], resampled_tone[margin:-margin]):.1f} dB")
+
+def _load_chunks(path, chunk_duration, max_chunks=None):
+    """Carica l'audio come lista di chunk float32 mono 16 kHz"""
+    from utils.audio_utils import iter_audio_chunks, TARGET_SAMPLE_RATE
+
+    chunks = iter_audio_chunks(path, chunk_duration)
+    if chunks is None:
+        import whisper
+        audio = whisper.load_audio(path)
+        step = int(chunk_duration * TARGET_SAMPLE_RATE)
+        chunks = (audio[i:i + step] for i in range(0, len(audio), step))
+    chunks = [np.array(chunk) for chunk in chunks]
+    return chunks[:max_chunks] if max_chunks else chunks
+
+def bench_batch(args):
+    """Throughput della trascrizione per chunk rispetto a quella batch"""
+    import whisper
+    from utils.audio_utils import TARGET_SAMPLE_RATE
+    from utils.asr_backends import transcribe_batch
+
+    chunks = _load_chunks(args.input, args.chunk_duration, args.max_chunks)
+    audio_seconds = sum(len(chunk) for chunk in chunks) / TARGET_SAMPLE_RATE
+    logger.info(f"{len(chunks)} chunk, {audio_seconds:.0f}s di audio, modello {args.model}")
+    model = whisper.load_model(args.model, device="cpu")
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        model.transcribe(chunk, language=args.language, fp16=False)
+    elapsed = time.perf_counter() - start
+    print(f"per chunk (transcribe) : {elapsed:.1f}s, {audio_seconds / elapsed:.1f}s audio/s")
+
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(chunks), batch_size):
+            transcribe_batch(model, chunks[i:i + batch_size], language=args.language)
+        batch_elapsed = time.perf_counter() - start
+        print(f"batch {batch_size:>2}              : {batch_elapsed:.1f}s, "
+              f"{audio_seconds / batch_elapsed:.1f}s audio/s ({elapsed / batch_elapsed:.2f}x)")
+
+def word_error_rate(reference, hypothesis):
+    """WER: distanza di edit a livello di parola divisa per le parole del riferimento"""
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+def _model_size_mb(model):
+    """Dimensione serializzata dello state_dict (i pesi int8 impacchettati inclusi)"""
+    import io
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / (1024 * 1024)
+
+def bench_quantize(args):
+    """Confronta il modello fp32 con quello quantizzato int8: velocità, memoria e deriva WER"""
+    import whisper
+    from utils.audio_utils import TARGET_SAMPLE_RATE
+    from utils.asr_backends import quantize_whisper_model
+
+    chunks = _load_chunks(args.input, 30, args.max_chunks)
+    audio_seconds = sum(len(chunk) for chunk in chunks) / TARGET_SAMPLE_RATE
+    logger.info(f"{len(chunks)} chunk, {audio_seconds:.0f}s di audio, modello {args.model}")
+
+    def transcribe_all(model):
+        return " ".join(
+            model.transcribe(chunk, language=args.language, fp16=False)["text"].strip() for chunk in chunks
+        )
+
+    model = whisper.load_model(args.model, device="cpu")
+    fp32_mb = _model_size_mb(model)
+    fp32_time, fp32_text = _timeit(lambda: transcribe_all(model), args.repeat)
+
+    quantized = quantize_whisper_model(model)
+    int8_mb = _model_size_mb(quantized)
+    int8_time, int8_text = _timeit(lambda: transcribe_all(quantized), args.repeat)
+
+    print(f"fp32 : {fp32_time:.1f}s ({audio_seconds / fp32_time:.1f}s audio/s), pesi {fp32_mb:.0f} MB")
+    print(f"int8 : {int8_time:.1f}s ({audio_seconds / int8_time:.1f}s audio/s), pesi {int8_mb:.0f} MB")
+    print(f"Speedup {fp32_time / int8_time:.2f}x, memoria risparmiata {fp32_mb - int8_mb:.0f} MB "
+          f"({100 * (1 - int8_mb / fp32_mb):.0f}%)")
+    print(f"Deriva WER int8 vs fp32: {100 * word_error_rate(fp32_text, int8_text):.1f}%")
+    if args.reference:
+        with open(args.reference, encoding="utf-8") as f:
+            reference = f.read()
+        print(f"WER vs riferimento: fp32 {100 * word_error_rate(reference, fp32_text):.1f}%, "
+              f"int8 {100 * word_error_rate(reference, int8_text):.1f}%")
+
+def bench_backends(args):
+    """Confronta i motori ASR sullo stesso audio: throughput e WER rispetto al primo"""
+    from utils.audio_utils import TARGET_SAMPLE_RATE
+    from utils.asr_backends import get_asr_backend
+
+    chunks = _load_chunks(args.input, 30, args.max_chunks)
+    audio_seconds = sum(len(chunk) for chunk in chunks) / TARGET_SAMPLE_RATE
+    logger.info(f"{len(chunks)} chunk, {audio_seconds:.0f}s di audio, modello {args.model}")
+
+    baseline = None
+    for name in args.backends:
+        backend = get_asr_backend(name, model_size=args.model, quantize=args.quantize)
+        elapsed, text = _timeit(
+            lambda: " ".join(backend.transcribe(chunk, language=args.language)["text"].strip() for chunk in chunks),
+            args.repeat
+        )
+        line = f"{name:<15}: {elapsed:.1f}s, {audio_seconds / elapsed:.1f}s audio/s"
+        if baseline is None:
+            baseline = (name, elapsed, text)
+        else:
+            line += (f", {baseline[1] / elapsed:.2f}x vs {baseline[0]}, "
+                     f"WER vs {baseline[0]} {100 * word_error_rate(baseline[2], text):.1f}%")
+        print(line)
+
+def _str_list(value):
+    """Parser argparse per liste di stringhe separate da virgola"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+def _int_list(value):
+    """Parser argparse per liste di interi separate da virgola"""
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main():
+    """Funzione principale"""
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline di trascrizione")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    resample_parser = subparsers.add_parser("resample", help="Ricampionamento NumPy vs pydub")
+    resample_parser.add_argument("--input", help="File audio da usare (default: segnale sintetico)")
+    resample_parser.add_argument("--seconds", type=float, default=600, help="Durata segnale sintetico")
+    resample_parser.add_argument("--rate", type=int, default=48000, help="Frequenza segnale sintetico")
+    resample_parser.add_argument("--repeat", type=int, default=3, help="Ripetizioni per misura")
+    resample_parser.set_defaults(func=bench_resample)
+
+    batch_parser = subparsers.add_parser("batch", help="Trascrizione per chunk vs batch")
+    batch_parser.add_argument("input", help="File audio di riferimento")
+    batch_parser.add_argument("--model", default="base", help="Modello Whisper")
+    batch_parser.add_argument("--language", default="it", help="Lingua della lezione")
+    batch_parser.add_argument("--chunk-duration", type=int, default=30, help="Durata chunk (max 30 s)")
+    batch_parser.add_argument("--batch-sizes", type=_int_list, default=[2, 4, 8], help="Es. 2,4,8")
+    batch_parser.add_argument("--max-chunks", type=int, default=16, help="Numero massimo di chunk")
+    batch_parser.set_defaults(func=bench_batch)
+
+    quantize_parser = subparsers.add_parser("quantize", help="Modello fp32 vs int8 dinamico")
+    quantize_parser.add_argument("input", help="Clip audio di riferimento")
+    quantize_parser.add_argument("--reference", help="Trascrizione di riferimento (.txt) per il WER assoluto")
+    quantize_parser.add_argument("--model", default="medium", help="Modello Whisper")
+    quantize_parser.add_argument("--language", default="it", help="Lingua della lezione")
+    quantize_parser.add_argument("--max-chunks", type=int, default=4, help="Numero massimo di chunk da 30 s")
+    quantize_parser.add_argument("--repeat", type=int, default=1, help="Ripetizioni per misura")
+    quantize_parser.set_defaults(func=bench_quantize)
+
+    backends_parser = subparsers.add_parser("backends", help="Confronto tra motori ASR")
+    backends_parser.add_argument("input", help="Clip audio di riferimento")
+    backends_parser.add_argument("--backends", type=_str_list, default=["whisper", "faster-whisper"],
+                                 help="Es. whisper,faster-whisper")
+    backends_parser.add_argument("--model", default="medium", help="Modello Whisper")
+    backends_parser.add_argument("--quantize", action="store_true", help="Usa int8 per entrambi i motori")
+    backends_parser.add_argument("--language", default="it", help="Lingua della lezione")
+    backends_parser.add_argument("--max-chunks", type=int, default=4, help="Numero massimo di chunk da 30 s")
+    backends_parser.add_argument("--repeat", type=int, default=1, help="Ripetizioni per misura")
+    backends_parser.set_defaults(func=bench_backends)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
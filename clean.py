@@ -1,97 +1,59 @@
-import os
-import shutil
-import tempfile
+import argparse
 import logging
-from pathlib import Path
+from utils.workspace_utils import (
+    WORKSPACE_DIR, WORKSPACE_QUOTA_BYTES, STALE_JOB_SECONDS,
+    list_jobs, workspace_usage, reclaim_stale_jobs, enforce_quota, purge_workspace
+)
+from utils.admission_utils import disk_free_bytes, calibration_factors, read_calibration_log
+from utils.cache_utils import LLM_CACHE_DIR, COMPACT_GARBAGE_RATIO, cache_stats, compact_cache
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def cleanup_temp_files():
-    """Pulisce tutti i file temporanei in modo sicuro"""
-    cleaned_files = 0
-    cleaned_dirs = 0
-    
+def _mb(size_bytes):
+    return f"{size_bytes / 1024 ** 2:.1f} MB"
+
+def cleanup_temp_files(purge=False, include_active=False, max_age=STALE_JOB_SECONDS):
+    """
+    Manutenzione del workspace: recupera i job abbandonati e gli scratch vecchi,
+    applica la quota (eviction LRU dei job conclusi) e, con purge, rimuove tutti i job conclusi.
+    Restituisce i byte liberati.
+    """
     try:
-        # File temporanei da rimuovere
-        temp_patterns = [
-            "temp_*.wav",
-            "temp_*.mp3", 
-            "temp_*.m4a",
-            "temp_*.mp4",
-            "chunk_*.wav",
-            "*.txt",
-            "appunti_*.pdf",
-            "trascrizione.pdf"
-        ]
-        
-        # Directory temporanee da rimuovere
-        temp_dirs = [
-            "temp_chunks",
-            "temp",
-            "audio_chunks_*",
-            "audio_temp_*",
-            "lesson_notes_*"
-        ]
-        
-        # Pulisci file temporanei
-        for pattern in temp_patterns:
-            try:
-                for file_path in Path(".").glob(pattern):
-                    if file_path.is_file():
-                        try:
-                            file_path.unlink()
-                            cleaned_files += 1
-                            logger.info(f"Rimosso file: {file_path}")
-                        except Exception as e:
-                            logger.warning(f"Errore rimozione {file_path}: {e}")
-            except Exception as e:
-                logger.warning(f"Errore pattern {pattern}: {e}")
-        
-        # Pulisci directory temporanee
-        for dir_pattern in temp_dirs:
-            try:
-                for dir_path in Path(".").glob(dir_pattern):
-                    if dir_path.is_dir():
-                        try:
-                            shutil.rmtree(dir_path)
-                            cleaned_dirs += 1
-                            logger.info(f"Rimossa directory: {dir_path}")
-                        except Exception as e:
-                            logger.warning(f"Errore rimozione directory {dir_path}: {e}")
-            except Exception as e:
-                logger.warning(f"Errore pattern directory {dir_pattern}: {e}")
-        
-        # Pulisci anche dalla directory tempfile di sistema
-        try:
-            temp_dir = tempfile.gettempdir()
-            for item in os.listdir(temp_dir):
-                if item.startswith(("lesson_notes_", "audio_chunks_", "audio_temp_")):
-                    item_path = os.path.join(temp_dir, item)
-                    try:
-                        if os.path.isfile(item_path):
-                            os.remove(item_path)
-                            cleaned_files += 1
-                        elif os.path.isdir(item_path):
-                            shutil.rmtree(item_path)
-                            cleaned_dirs += 1
-                    except Exception as e:
-                        logger.warning(f"Errore pulizia tempfile {item_path}: {e}")
-        except Exception as e:
-            logger.warning(f"Errore pulizia directory tempfile: {e}")
-        
-        logger.info(f"🧹 Pulizia completata: {cleaned_files} file e {cleaned_dirs} directory rimossi")
-        
+        freed = reclaim_stale_jobs(max_age=max_age)
+        if purge:
+            freed += purge_workspace(include_active=include_active, max_age=max_age)
+        else:
+            freed += enforce_quota()
+        freed += compact_cache(min_garbage_ratio=COMPACT_GARBAGE_RATIO)
+        logger.info(f"🧹 Pulizia completata: {_mb(freed)} liberati")
+        return freed
     except Exception as e:
         logger.error(f"❌ Errore durante pulizia: {e}")
+        return 0
+
+def print_workspace():
+    """Elenca i job del workspace con stato e dimensione"""
+    usage = workspace_usage()
+    print(f"📂 Workspace: {WORKSPACE_DIR}")
+    print(f"   Occupato: {_mb(usage['total_bytes'])} su {_mb(WORKSPACE_QUOTA_BYTES)} "
+          f"(attivi {_mb(usage['active_bytes'])}, conclusi {_mb(usage['finished_bytes'])}, "
+          f"scratch {_mb(usage['scratch_bytes'])})")
+    for job in list_jobs():
+        print(f"   {job['job_id']:<45} {job['status']:<9} {_mb(job['size_bytes']):>10}")
+    disk_factor, ram_factor = calibration_factors()
+    print(f"📐 Calibrazione ammissione su {len(read_calibration_log())} job: "
+          f"disco x{disk_factor:.2f}, RAM x{ram_factor:.2f}")
+    stats = cache_stats()
+    print(f"🗜️ Cache risposte ({LLM_CACHE_DIR}): {stats['records']} voci, {_mb(stats['data_bytes'])} su disco "
+          f"({_mb(stats['raw_bytes'])} non compressi, rapporto {stats['compression_ratio']:.1f}x, "
+          f"{stats['garbage_ratio']:.0%} sostituite)")
 
 def check_disk_space():
-    """Verifica spazio disco disponibile"""
+    """Verifica spazio disco disponibile sul disco del workspace"""
     try:
-        import shutil
-        total, used, free = shutil.disk_usage(".")
-        free_gb = free // (1024**3)
+        free_gb = disk_free_bytes() // (1024**3)
         logger.info(f"💾 Spazio disco disponibile: {free_gb} GB")
         return free_gb
     except Exception as e:
@@ -99,14 +61,26 @@ def check_disk_space():
         return None
 
 if __name__ == "__main__":
-    print("🧹 Avvio pulizia file temporanei...")
-    
-    # Verifica spazio disco
-    free_space = check_disk_space()
-    if free_space is not None and free_space < 1:
-        print(f"⚠️ Attenzione: spazio disco limitato ({free_space} GB)")
-    
-    # Esegui pulizia
-    cleanup_temp_files()
+    parser = argparse.ArgumentParser(description="Manutenzione del workspace dei job")
+    parser.add_argument("--list", action="store_true", help="Mostra i job e l'occupazione del workspace")
+    parser.add_argument("--purge", action="store_true", help="Rimuove tutti i job conclusi")
+    parser.add_argument("--include-active", action="store_true", help="Con --purge rimuove anche i job attivi")
+    parser.add_argument("--max-age-hours", type=float, default=STALE_JOB_SECONDS / 3600,
+                        help="Età oltre la quale scratch e directory temporanee orfane vengono rimossi")
+    args = parser.parse_args()
     
-    print("✅ Pulizia completata!")
+    if args.list:
+        print_workspace()
+    else:
+        print("🧹 Avvio pulizia file temporanei...")
+        
+        # Verifica spazio disco
+        free_space = check_disk_space()
+        if free_space is not None and free_space < 1:
+            print(f"⚠️ Attenzione: spazio disco limitato ({free_space} GB)")
+        
+        # Esegui pulizia
+        cleanup_temp_files(purge=args.purge, include_active=args.include_active,
+                           max_age=args.max_age_hours * 3600)
+        
+        print("✅ Pulizia completata!")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Trascrizione dal vivo: segue un WAV in registrazione, uno stream decodificato da FFmpeg o PCM 16 bit
+da stdin e trascrive ogni finestra appena completa, aggiungendo testo e appunti ai file di output
+durante la lezione.
+
+Esempi:
+    python live_transcribe.py registrazione.wav --output lezione.txt --notes appunti.txt
+    arecord -f S16_LE -r 16000 -c 1 -t raw | python live_transcribe.py - --output lezione.txt
+    python live_transcribe.py rtmp://server/lezione --notes appunti.txt
+"""
+
+import argparse
+import logging
+import sys
+
+from utils.asr_backends import get_asr_backend, get_available_backends, DEFAULT_ASR_BACKEND
+from utils.audio_utils import TARGET_SAMPLE_RATE
+from utils.archive_utils import archive_lecture, format_timestamp
+from utils.live_utils import (
+    LiveTranscriber, LiveNotes, open_live_source, LIVE_CHUNK_SECONDS, LIVE_IDLE_TIMEOUT, LIVE_POLL_SECONDS
+)
+from utils.reformulate_utils import check_ollama_available
+from utils.whisper_utils import get_available_whisper_models
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _append(path, text):
+    """Aggiunge testo al file e lo scrive subito su disco (leggibile durante la lezione)"""
+    if path and text:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text + "\n\n")
+            f.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Trascrizione incrementale di una registrazione in corso")
+    parser.add_argument("source", help="WAV in crescita da seguire, altro file o URL decodificato da FFmpeg, "
+                        "oppure - per PCM 16 bit grezzo da stdin")
+    parser.add_argument("--output", help="File a cui aggiungere la trascrizione finestra per finestra")
+    parser.add_argument("--notes", help="File a cui aggiungere gli appunti (richiede Ollama)")
+    parser.add_argument("--model", default="small", choices=get_available_whisper_models(),
+                        help="Modello Whisper (deve decodificare più veloce del tempo reale)")
+    parser.add_argument("--backend", default=DEFAULT_ASR_BACKEND, choices=get_available_backends(),
+                        help="Motore di trascrizione")
+    parser.add_argument("--quantize", action="store_true", help="Modello quantizzato int8 (CPU)")
+    parser.add_argument("--language", default="auto", help="Lingua della lezione (auto = rilevata una volta)")
+    parser.add_argument("--chunk", type=float, default=LIVE_CHUNK_SECONDS,
+                        help="Secondi per finestra: limite della latenza parlato-testo")
+    parser.add_argument("--no-guard", action="store_true", help="Disattiva il filtro allucinazioni")
+    parser.add_argument("--formal-level", default="Medio", choices=["Medio", "Alto", "Molto Alto"],
+                        help="Livello di formalità degli appunti")
+    parser.add_argument("--sections", action="store_true", help="Sottosezioni negli appunti")
+    parser.add_argument("--rate", type=int, default=TARGET_SAMPLE_RATE, help="Sample rate del PCM da stdin")
+    parser.add_argument("--channels", type=int, default=1, help="Canali del PCM da stdin")
+    parser.add_argument("--idle-timeout", type=float, default=LIVE_IDLE_TIMEOUT,
+                        help="Secondi senza dati nuovi dopo i quali il WAV è considerato concluso")
+    parser.add_argument("--archive", action="store_true", help="Salva la lezione nell'archivio a fine registrazione")
+    args = parser.parse_args()
+
+    if args.notes:
+        ollama_ok, ollama_msg = check_ollama_available()
+        if not ollama_ok:
+            parser.error(f"Appunti non disponibili: {ollama_msg}")
+
+    print(f"🧠 Caricamento modello {args.model} ({args.backend})...")
+    asr = get_asr_backend(args.backend, model_size=args.model, quantize=args.quantize).load()
+
+    def show_text(entry):
+        if entry["text"]:
+            print(f"[{format_timestamp(entry['start'])}] {entry['text']}  (+{entry['lag']:.1f}s)")
+            _append(args.output, entry["text"])
+        if notes is not None:
+            notes.add_text(entry["text"])
+
+    def show_notes(block, text):
+        if text:
+            print(f"✏️ Appunti aggiornati ({len(text)} caratteri)")
+            _append(args.notes, text)
+
+    notes = LiveNotes(args.formal_level, args.sections, on_notes=show_notes) if args.notes else None
+    transcriber = LiveTranscriber(asr, language=args.language, chunk_duration=args.chunk,
+                                  guard=not args.no_guard, on_text=show_text)
+    source = open_live_source(args.source, sample_rate=args.rate, channels=args.channels,
+                              poll_interval=LIVE_POLL_SECONDS, idle_timeout=args.idle_timeout,
+                              stdin=sys.stdin.buffer)
+
+    print(f"🎙️ In ascolto: finestre da {args.chunk:g}s (Ctrl+C per terminare)")
+    try:
+        for sample_rate, samples in source:
+            transcriber.feed(sample_rate, samples)
+    except KeyboardInterrupt:
+        print("\n⏹️ Interrotto: trascrivo l'audio rimasto")
+    transcriber.flush()
+    final_notes = notes.close() if notes is not None else ""
+
+    duration = transcriber.duration
+    if duration:
+        print(f"✅ {format_timestamp(duration)} di audio, {len(transcriber.entries)} finestre, "
+              f"RTF {transcriber.processing_time / duration:.2f}, ritardo massimo {transcriber.max_lag:.1f}s")
+    if args.archive and transcriber.text:
+        lecture_id = archive_lecture(
+            transcriber.digest.hexdigest(),
+            transcriber.text,
+            notes.blocks if notes is not None else [(entry["text"], "") for entry in transcriber.segments],
+            segments=transcriber.segments,
+            notes=final_notes,
+            filename=None if args.source == "-" else args.source,
+            metadata={
+                "duration_s": duration,
+                "language": transcriber.language,
+                "language_probability": transcriber.language_probability,
+                "model_size": args.model,
+                "backend": args.backend,
+                "formal_level": args.formal_level,
+                "use_sections": args.sections,
+                "live": True,
+            }
+        )
+        print(f"🗄️ Lezione archiviata (id {lecture_id})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test di carico della riformulazione: misura throughput e latenze di coda di
+reformulate_transcription (o di singole call_ollama) a diversi livelli di concorrenza dei client.
+Con --mock avvia in-process il server simulato di mock_ollama.py.
+"""
+
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_ollama
+from utils import cache_utils, reformulate_utils
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_SYNTHETIC_WORDS = (
+    "allora oggi vediamo la struttura dei dati e come si comporta l'algoritmo quando l'input cresce "
+    "questo è importante perché la complessità dipende dalla dimensione del problema e dalle ipotesi "
+    "che facciamo sul modello di calcolo e sulla memoria disponibile durante l'esecuzione"
+).split()
+
+def percentile(values, p):
+    """Percentile p (0-100) con interpolazione lineare"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def synthetic_transcript(paragraphs, seed):
+    """Trascrizione sintetica: paragrafi diversi per ogni job, così la cache non interviene"""
+    rng = random.Random(seed)
+    return "\n\n".join(
+        " ".join(rng.choice(_SYNTHETIC_WORDS) for _ in range(rng.randint(80, 160))) + "."
+        for _ in range(paragraphs)
+    )
+
+def _run_level(concurrency, total, task):
+    """Esegue total task con concurrency client; restituisce (durate, risultati, tempo totale)"""
+    durations = []
+    results = []
+    lock = threading.Lock()
+
+    def client(index):
+        start = time.perf_counter()
+        result = task(index)
+        elapsed = time.perf_counter() - start
+        with lock:
+            durations.append(elapsed)
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(total)))
+    return durations, results, time.perf_counter() - start
+
+def _print_row(concurrency, durations, wall, units, unit_name, failures):
+    print(
+        f"{concurrency:>5} | {len(durations) / wall:>8.2f} job/s | {units / wall:>8.2f} {unit_name}/s | "
+        f"p50 {percentile(durations, 50):>6.2f}s | p95 {percentile(durations, 95):>6.2f}s | "
+        f"p99 {percentile(durations, 99):>6.2f}s | max {max(durations):>6.2f}s | errori {failures}"
+    )
+
+def load_reformulate(args):
+    """Job completi di riformulazione: ogni client riformula una trascrizione diversa"""
+    print(f"{'conc.':>5} | {'throughput':>15} | {'chunk':>15} | latenza job")
+    for concurrency in args.concurrency:
+        def task(index):
+            stats = {}
+            text = synthetic_transcript(args.paragraphs, seed=f"{concurrency}-{index}-{time.time_ns()}")
+            notes, _ = reformulate_utils.reformulate_transcription(
+                text, stats=stats, job_deadline=args.job_deadline, hedge=args.hedge
+            )
+            return bool(notes), stats.get("llm_calls", 0)
+
+        durations, results, wall = _run_level(concurrency, args.jobs * concurrency, task)
+        calls = sum(llm_calls for _, llm_calls in results)
+        failures = sum(1 for ok, _ in results if not ok)
+        _print_row(concurrency, durations, wall, calls, "chunk", failures)
+
+def load_calls(args):
+    """Singole chiamate call_ollama: latenza di richiesta senza pianificazione né cache"""
+    print(f"{'conc.':>5} | {'throughput':>15} | {'caratteri':>15} | latenza richiesta")
+    for concurrency in args.concurrency:
+        def task(index):
+            prompt = synthetic_transcript(1, seed=f"{concurrency}-{index}-{time.time_ns()}")
+            return reformulate_utils.call_ollama(prompt, max_tokens=args.max_tokens, hedge=args.hedge)
+
+        durations, results, wall = _run_level(concurrency, args.jobs * concurrency, task)
+        characters = sum(len(result) for result in results if result)
+        failures = sum(1 for result in results if not result)
+        _print_row(concurrency, durations, wall, characters, "car", failures)
+
+def _int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico della riformulazione con Ollama")
+    parser.add_argument("mode", choices=["reformulate", "calls"], nargs="?", default="reformulate",
+                        help="Job completi di riformulazione o singole chiamate")
+    parser.add_argument("--url", default=os.environ.get("OLLAMA_BASE_URL"),
+                        help="Server Ollama (default: OLLAMA_BASE_URL o localhost)")
+    parser.add_argument("--mock", action="store_true", help="Avvia il server simulato in-process")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 2, 4, 8], help="Es. 1,2,4,8")
+    parser.add_argument("--jobs", type=int, default=3, help="Job (o chiamate) per client a ogni livello")
+    parser.add_argument("--paragraphs", type=int, default=6, help="Paragrafi per trascrizione sintetica")
+    parser.add_argument("--max-tokens", type=int, default=800, help="Token massimi per chiamata (modalità calls)")
+    parser.add_argument("--job-deadline", type=float, help="Scadenza di ogni job in secondi")
+    parser.add_argument("--hedge", action="store_true", help="Richieste duplicate per le chiamate lente")
+    mock_group = parser.add_argument_group("server simulato (--mock)")
+    mock_ollama.add_config_arguments(mock_group)
+    args = parser.parse_args()
+
+    server = None
+    if args.mock:
+        server, args.url = mock_ollama.serve_in_thread(mock_ollama.config_from_args(args))
+        print(f"🤖 Mock Ollama su {args.url}")
+    if args.url:
+        reformulate_utils.OLLAMA_BASE_URL = args.url
+    reformulate_utils.OLLAMA_MODEL = args.model
+    # I log per chunk della riformulazione coprirebbero i risultati
+    logging.getLogger(reformulate_utils.__name__).setLevel(logging.ERROR)
+    # Cache temporanea: le risposte del test non restano nella cache dell'applicazione
+    cache_utils.LLM_CACHE_DIR = tempfile.mkdtemp(prefix="load_test_cache_")
+
+    try:
+        if args.mode == "calls":
+            load_calls(args)
+        else:
+            load_reformulate(args)
+    finally:
+        stats = cache_utils.cache_stats()
+        print(f"🗜️ Cache: {stats['records']} risposte, compressione {stats['compression_ratio']:.1f}x, "
+              f"scrittura {stats['write_mb_s']:.1f} MB/s, lettura {stats['read_mb_s']:.1f} MB/s")
+        cache_utils.close_cache()
+        shutil.rmtree(cache_utils.LLM_CACHE_DIR, ignore_errors=True)
+        if server is not None:
+            server.shutdown()
+            print(f"📊 Server simulato: {server.RequestHandlerClass.config.stats}")
+
+if __name__ == "__main__":
+    main()
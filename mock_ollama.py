@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Server sostitutivo di Ollama per test e benchmark della riformulazione senza un modello reale.
+Implementa /api/tags e /api/generate (in streaming e non) con latenza, velocità di generazione,
+errori e concorrenza configurabili.
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_PORT = 11435
+DEFAULT_MODEL = "mistral:7b"
+
+# Parole per le risposte generate (testo plausibile, lunghezza controllata)
+_WORDS = (
+    "il concetto principale della lezione riguarda la definizione formale del problema "
+    "e le sue applicazioni nel contesto teorico e sperimentale con particolare attenzione "
+    "ai metodi di analisi alle ipotesi iniziali e ai risultati ottenuti"
+).split()
+
+class MockConfig:
+    """Parametri del server: latenza, velocità, errori e concorrenza"""
+
+    def __init__(self, model=DEFAULT_MODEL, latency="lognormal", latency_mean=0.5, latency_sigma=0.5,
+                 token_rate=40.0, tokens=200, error_rate=0.0, drop_rate=0.0, num_parallel=1,
+                 max_queue=16, seed=None):
+        self.model = model
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.num_parallel = num_parallel
+        self.max_queue = max_queue
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        # Come Ollama: num_parallel richieste in esecuzione, le altre in coda fino a max_queue
+        self.slots = threading.BoundedSemaphore(max(1, num_parallel))
+        self.queue_lock = threading.Lock()
+        self.waiting = 0
+        self.stats = {"requests": 0, "errors": 0, "drops": 0, "rejected": 0, "tokens": 0}
+
+    def first_token_delay(self):
+        """Tempo al primo token secondo la distribuzione scelta"""
+        with self.random_lock:
+            if self.latency == "fixed":
+                return self.latency_mean
+            if self.latency == "uniform":
+                return self.random.uniform(0, 2 * self.latency_mean)
+            # Lognormale con la media richiesta: coda lunga come le latenze reali
+            mu = math.log(max(self.latency_mean, 1e-6)) - self.latency_sigma ** 2 / 2
+            return self.random.lognormvariate(mu, self.latency_sigma)
+
+    def chance(self, probability):
+        with self.random_lock:
+            return self.random.random() < probability
+
+    def drop_position(self, count):
+        """Token a cui interrompere la risposta, None se la risposta va completata"""
+        if not count or not self.chance(self.drop_rate):
+            return None
+        with self.random_lock:
+            return self.random.randrange(count)
+
+    def count(self, key, amount=1):
+        with self.queue_lock:
+            self.stats[key] += amount
+
+def _response_tokens(prompt, count):
+    """Token della risposta: parole fisse seguite da parole del prompt"""
+    prompt_words = [word for word in prompt.split() if word.isalpha()][:50]
+    words = _WORDS + prompt_words
+    return [("" if i == 0 else " ") + words[i % len(words)] for i in range(count)]
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Gestore delle richieste: stessa forma delle risposte di Ollama"""
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json(200, {"models": [{"name": self.config.model, "model": self.config.model}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        config = self.config
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return
+        if request.get("model") != config.model:
+            self._send_json(404, {"error": f"model '{request.get('model')}' not found"})
+            return
+        config.count("requests")
+
+        # Coda piena: rifiuto immediato come Ollama con OLLAMA_MAX_QUEUE
+        with config.queue_lock:
+            if config.waiting >= config.max_queue + config.num_parallel:
+                config.stats["rejected"] += 1
+                rejected = True
+            else:
+                config.waiting += 1
+                rejected = False
+        if rejected:
+            self._send_json(503, {"error": "server busy, please try again. maximum pending requests exceeded"})
+            return
+
+        try:
+            with config.slots:
+                if config.chance(config.error_rate):
+                    config.count("errors")
+                    self._send_json(500, {"error": "mock: errore interno simulato"})
+                    return
+                self._generate(request)
+        finally:
+            with config.queue_lock:
+                config.waiting -= 1
+
+    def _generate(self, request):
+        config = self.config
+        options = request.get("options") or {}
+        count = min(config.tokens, int(options.get("num_predict") or config.tokens))
+        tokens = _response_tokens(request.get("prompt", ""), count)
+        started = time.monotonic()
+        time.sleep(config.first_token_delay())
+        token_time = 1.0 / config.token_rate if config.token_rate > 0 else 0.0
+        drop_at = config.drop_position(count)
+
+        if not request.get("stream", True):
+            time.sleep(token_time * count)
+            if drop_at is not None:
+                config.count("drops")
+                self.close_connection = True
+                return
+            config.count("tokens", count)
+            self._send_json(200, {
+                "model": config.model,
+                "response": "".join(tokens),
+                "done": True,
+                "eval_count": count,
+                "total_duration": int((time.monotonic() - started) * 1e9),
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i == drop_at:
+                    # Connessione interrotta a metà risposta
+                    config.count("drops")
+                    self.close_connection = True
+                    return
+                self._send_chunk({"model": config.model, "response": token, "done": False})
+                config.count("tokens")
+                time.sleep(token_time)
+            self._send_chunk({
+                "model": config.model,
+                "response": "",
+                "done": True,
+                "eval_count": count,
+                "total_duration": int((time.monotonic() - started) * 1e9),
+            })
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # Il client ha chiuso la connessione (scadenza o richiesta duplicata)
+            self.close_connection = True
+
+class MockOllamaServer(ThreadingHTTPServer):
+    """Server multi-thread che ignora le connessioni chiuse dai client"""
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+def make_server(config, host="127.0.0.1", port=DEFAULT_PORT):
+    """Crea il server con la configurazione data (port=0 sceglie una porta libera)"""
+    handler = type("ConfiguredMockOllamaHandler", (MockOllamaHandler,), {"config": config})
+    server = MockOllamaServer((host, port), handler)
+    return server
+
+def serve_in_thread(config, host="127.0.0.1", port=0):
+    """Avvia il server in un thread in background; restituisce (server, URL base)"""
+    server = make_server(config, host, port)
+    thread = threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+def add_config_arguments(parser):
+    """Opzioni del server condivise con load_test.py"""
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Nome del modello esposto")
+    parser.add_argument("--latency", choices=["fixed", "uniform", "lognormal"], default="lognormal",
+                        help="Distribuzione del tempo al primo token")
+    parser.add_argument("--latency-mean", type=float, default=0.5, help="Tempo medio al primo token (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Dispersione della lognormale")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="Token generati al secondo")
+    parser.add_argument("--tokens", type=int, default=200, help="Token per risposta (max num_predict)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilità di errore HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Probabilità di interruzione a metà risposta")
+    parser.add_argument("--num-parallel", type=int, default=1, help="Richieste eseguite in parallelo")
+    parser.add_argument("--max-queue", type=int, default=16, help="Richieste in attesa prima del rifiuto (503)")
+    parser.add_argument("--seed", type=int, help="Seme per risultati riproducibili")
+
+def config_from_args(args):
+    return MockConfig(
+        model=args.model, latency=args.latency, latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma, token_rate=args.token_rate, tokens=args.tokens,
+        error_rate=args.error_rate, drop_rate=args.drop_rate, num_parallel=args.num_parallel,
+        max_queue=args.max_queue, seed=args.seed,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Ollama simulato per test e benchmark")
+    parser.add_argument("--host", default="127.0.0.1", help="Indirizzo di ascolto")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Porta di ascolto")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    server = make_server(config, args.host, args.port)
+    print(f"🤖 Mock Ollama su http://{args.host}:{args.port} (modello {args.model})")
+    print(f"   Usa: OLLAMA_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 Statistiche: {config.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,8 @@ def check_dependencies():
     ]
     
     optional_packages = [
-        "soundfile"
+        "soundfile",
+        "faster_whisper"
     ]
     
     missing_packages = []
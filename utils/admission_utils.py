@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import shutil
+import statistics
+import threading
+import logging
+from utils.workspace_utils import (
+    WORKSPACE_DIR, WORKSPACE_QUOTA_BYTES, directory_size, workspace_usage, evict_lru
+)
+from utils.audio_utils import TARGET_SAMPLE_RATE, PREVIEW_MAX_SECONDS, PREVIEW_BITRATE
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Esiti dell'ammissione
+ADMIT = "admit"
+DEFER = "defer"
+REFUSE = "refuse"
+
+# Margini lasciati liberi al sistema oltre al picco previsto del job
+DISK_HEADROOM_BYTES = 512 * 1024 ** 2
+RAM_HEADROOM_BYTES = 512 * 1024 ** 2
+
+# Attesa massima di un job rinviato prima di rinunciare
+ADMISSION_WAIT_SECONDS = float(os.environ.get("ADMISSION_WAIT_SECONDS", "300"))
+ADMISSION_POLL_SECONDS = 5.0
+
+# Formato di lavoro della pipeline: PCM mono 16 kHz a 16 bit; anteprima MP3 a bitrate fisso
+SAMPLE_BYTES = 2
+PREVIEW_BYTES_PER_SECOND = int(PREVIEW_BITRATE.rstrip("k")) * 1000 // 8
+OUTPUT_ALLOWANCE_BYTES = 4 * 1024 ** 2
+
+# Parametri dei modelli Whisper e larghezza dei layer (stima delle attivazioni)
+MODEL_PARAMETERS = {"tiny": 39e6, "base": 74e6, "small": 244e6, "medium": 769e6, "large": 1550e6}
+MODEL_WIDTH = {"tiny": 384, "base": 512, "small": 768, "medium": 1024, "large": 1280}
+
+# Byte per parametro al picco di caricamento: la quantizzazione int8 di openai-whisper
+# parte dal modello fp32, quindi per un momento convivono entrambe le copie
+MODEL_BYTES_PER_PARAMETER = {
+    ("whisper", False): 4.0,
+    ("whisper", True): 5.0,
+    ("faster-whisper", False): 4.0,
+    ("faster-whisper", True): 1.0,
+}
+MODEL_RUNTIME_OVERHEAD = 1.25
+
+# Attivazioni dell'encoder per finestra da 30 s (1500 posizioni, buffer di attention e MLP)
+ENCODER_POSITIONS = 1500
+ACTIVATION_BUFFERS = 48
+
+# Log di calibrazione: previsto vs misurato per ogni job concluso
+CALIBRATION_LOG = os.path.join(WORKSPACE_DIR, "admission_log.jsonl")
+CALIBRATION_WINDOW = 50
+CALIBRATION_MIN_SAMPLES = 5
+CALIBRATION_BOUNDS = (0.5, 4.0)
+
+# Picchi riservati dai job ammessi e non ancora conclusi: job_id -> stima
+_RESERVATIONS = {}
+_ADMISSION_LOCK = threading.Lock()
+_calibration_cache = {"mtime": None, "factors": None}
+
+def _gb(size_bytes):
+    return f"{size_bytes / 1024 ** 3:.2f} GB"
+
+def disk_free_bytes(path=None):
+    """Byte liberi sul disco del workspace"""
+    path = path or WORKSPACE_DIR
+    # Il workspace potrebbe non esistere ancora: misura la prima directory esistente
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+def memory_info():
+    """(RAM disponibile, RAM totale) in byte; None se non misurabile"""
+    try:
+        values = {}
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                values[name] = int(rest.split()[0]) * 1024
+        return values["MemAvailable"], values["MemTotal"]
+    except (OSError, KeyError, ValueError, IndexError):
+        pass
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return os.sysconf("SC_AVPHYS_PAGES") * page_size, os.sysconf("SC_PHYS_PAGES") * page_size
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def current_rss():
+    """Memoria residente del processo in byte (picco del processo se la corrente non è disponibile)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in KB su Linux e in byte su macOS
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    except (ImportError, OSError):
+        return None
+
+def model_memory_bytes(model_size, backend="whisper", quantize=False):
+    """Picco di memoria per caricare un modello"""
+    parameters = MODEL_PARAMETERS.get(model_size, MODEL_PARAMETERS["large"])
+    per_parameter = MODEL_BYTES_PER_PARAMETER.get((backend, bool(quantize)), 4.0)
+    return int(parameters * per_parameter * MODEL_RUNTIME_OVERHEAD)
+
+def estimate_job_footprint(info, input_bytes, model_size="medium", backend="whisper", quantize=False,
+                           draft_model_size=None, batch_windows=1, normalized=True, loaded_models=()):
+    """
+    Stima il picco di disco temporaneo e di RAM di un job dai metadati del probe
+    (durata, sample rate, canali) e dal modello scelto.
+    normalized=False descrive la pipeline senza FFmpeg (decodifica pydub e chunk WAV su disco);
+    loaded_models elenca le dimensioni già in memoria, che non occupano RAM aggiuntiva.
+    Le stime sono corrette dai fattori di calibrazione del log. Restituisce un dict.
+    """
+    duration = max(0.0, info["duration_ms"] / 1000)
+    source_rate = info.get("sample_rate") or TARGET_SAMPLE_RATE
+    channels = info.get("channels") or 1
+    work_audio_bytes = int(duration * TARGET_SAMPLE_RATE * SAMPLE_BYTES)
+    source_pcm_bytes = int(duration * source_rate * channels * SAMPLE_BYTES)
+
+    # Disco: upload, anteprima, WAV normalizzato (o segmenti paralleli, stessa dimensione
+    # complessiva) e, senza FFmpeg, i chunk WAV alla frequenza originale
+    disk = input_bytes + int(min(duration, PREVIEW_MAX_SECONDS) * PREVIEW_BYTES_PER_SECOND)
+    disk += work_audio_bytes if normalized else source_pcm_bytes
+    disk += OUTPUT_ALLOWANCE_BYTES
+
+    # RAM: modelli da caricare, attivazioni del batch e audio decodificato in memoria
+    ram = 0
+    for size in filter(None, {model_size, draft_model_size}):
+        if size not in loaded_models:
+            ram += model_memory_bytes(size, backend, quantize)
+    width = MODEL_WIDTH.get(model_size, MODEL_WIDTH["large"])
+    ram += max(1, batch_windows) * ENCODER_POSITIONS * width * 4 * ACTIVATION_BUFFERS
+    if not normalized:
+        # pydub decodifica l'intero file e whisper.load_audio lo riconverte in float32
+        ram += source_pcm_bytes + int(duration * TARGET_SAMPLE_RATE * 4)
+
+    disk_factor, ram_factor = calibration_factors()
+    return {
+        "duration_s": round(duration, 1),
+        "sample_rate": source_rate,
+        "channels": channels,
+        "input_bytes": int(input_bytes),
+        "model_size": model_size,
+        "backend": backend,
+        "quantize": bool(quantize),
+        "draft_model_size": draft_model_size,
+        "batch_windows": batch_windows,
+        "normalized": bool(normalized),
+        "raw_disk_bytes": int(disk),
+        "raw_ram_bytes": int(ram),
+        "disk_bytes": int(disk * disk_factor),
+        "ram_bytes": int(ram * ram_factor),
+    }
+
+def _others(job_id):
+    with _ADMISSION_LOCK:
+        return {other: estimate for other, estimate in _RESERVATIONS.items() if other != job_id}
+
+def _outstanding_disk(job_paths):
+    """Disco che i job ammessi devono ancora occupare per raggiungere il picco previsto"""
+    total = 0
+    for path, estimate in job_paths:
+        used = directory_size(path) if os.path.isdir(path) else 0
+        total += max(0, estimate["disk_bytes"] - used)
+    return total
+
+def admit_job(job, estimate):
+    """
+    Decide se il job entra ora: (ADMIT | DEFER | REFUSE, messaggio).
+    REFUSE se il picco non starebbe nemmeno a risorse libere (quota, disco, RAM totale);
+    DEFER se starà quando i job in corso avranno finito. Se serve disco, rimuove i job
+    conclusi meno usati di recente. Un job ammesso riserva il suo picco fino a release_admission.
+    """
+    others = _others(job.id)
+    needed_disk = max(0, estimate["disk_bytes"] - directory_size(job.path))
+    usage = workspace_usage()
+
+    if estimate["disk_bytes"] > WORKSPACE_QUOTA_BYTES:
+        return REFUSE, (f"Il job richiede circa {_gb(estimate['disk_bytes'])} di spazio temporaneo, "
+                        f"oltre la quota del workspace ({_gb(WORKSPACE_QUOTA_BYTES)})")
+
+    # Disco: spazio libero più i job conclusi rimovibili, meno quanto riservato dagli altri job
+    free = disk_free_bytes()
+    others_disk = sum(estimate_other["disk_bytes"] for estimate_other in others.values())
+    outstanding = _outstanding_disk(
+        (os.path.join(os.path.dirname(job.path), other), estimate_other)
+        for other, estimate_other in others.items()
+    )
+    if needed_disk > free + usage["finished_bytes"] + others_disk - DISK_HEADROOM_BYTES:
+        return REFUSE, (f"Spazio disco insufficiente: servono circa {_gb(needed_disk)}, "
+                        f"disponibili {_gb(free)}")
+    if needed_disk > free + usage["finished_bytes"] - outstanding - DISK_HEADROOM_BYTES:
+        return DEFER, f"Spazio disco occupato da altri job: servono circa {_gb(needed_disk)}"
+    if usage["active_bytes"] + outstanding + needed_disk > WORKSPACE_QUOTA_BYTES:
+        return DEFER, "Quota del workspace occupata dai job in corso"
+
+    # RAM: disponibile ora meno i picchi riservati dagli altri job (stima prudente)
+    memory = memory_info()
+    if memory is not None:
+        available, total = memory
+        others_ram = sum(estimate_other["ram_bytes"] for estimate_other in others.values())
+        if estimate["ram_bytes"] > total - RAM_HEADROOM_BYTES:
+            return REFUSE, (f"Memoria insufficiente: il modello {estimate['model_size']} richiede circa "
+                            f"{_gb(estimate['ram_bytes'])}, RAM totale {_gb(total)}")
+        if estimate["ram_bytes"] > available + others_ram - RAM_HEADROOM_BYTES:
+            return REFUSE, (f"Memoria insufficiente: servono circa {_gb(estimate['ram_bytes'])}, "
+                            f"disponibili {_gb(available)}")
+        if estimate["ram_bytes"] > available - others_ram - RAM_HEADROOM_BYTES:
+            return DEFER, f"Memoria occupata da altri job: servono circa {_gb(estimate['ram_bytes'])}"
+    else:
+        logger.warning("RAM disponibile non misurabile: ammissione solo in base al disco")
+
+    shortfall = needed_disk + outstanding + DISK_HEADROOM_BYTES - free
+    if shortfall > 0:
+        evict_lru(shortfall)
+
+    with _ADMISSION_LOCK:
+        _RESERVATIONS[job.id] = estimate
+    logger.info(f"Job {job.id} ammesso: disco {_gb(estimate['disk_bytes'])}, RAM {_gb(estimate['ram_bytes'])}")
+    return ADMIT, "Risorse disponibili"
+
+def wait_for_admission(job, estimate, timeout=ADMISSION_WAIT_SECONDS, poll=ADMISSION_POLL_SECONDS,
+                       on_wait=None):
+    """
+    Ammissione con attesa: un job rinviato riprova ogni poll secondi fino a timeout.
+    on_wait(messaggio, secondi trascorsi) viene chiamata a ogni rinvio.
+    Restituisce l'ultimo (esito, messaggio); dopo il timeout un rinvio resta DEFER.
+    """
+    start = time.monotonic()
+    while True:
+        status, message = admit_job(job, estimate)
+        elapsed = time.monotonic() - start
+        if status != DEFER or elapsed >= timeout:
+            return status, message
+        if on_wait is not None:
+            on_wait(message, elapsed)
+        time.sleep(min(poll, max(0.0, timeout - elapsed)))
+
+def release_admission(job_id):
+    """Libera la riserva del job (a fine job)"""
+    with _ADMISSION_LOCK:
+        _RESERVATIONS.pop(job_id, None)
+
+class FootprintMonitor:
+    """
+    Misura durante il job il picco di disco della directory del job e il picco di RAM
+    del processo rispetto all'inizio, campionando in un thread in background.
+    """
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self.peak_disk_bytes = 0
+        self.peak_ram_bytes = 0
+        self._baseline_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        if os.path.isdir(self.job.path):
+            self.peak_disk_bytes = max(self.peak_disk_bytes, directory_size(self.job.path))
+        rss = current_rss()
+        if rss is not None and self._baseline_rss is not None:
+            self.peak_ram_bytes = max(self.peak_ram_bytes, rss - self._baseline_rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self._baseline_rss = current_rss()
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name=f"footprint-{self.job.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+        return self.peak_disk_bytes, self.peak_ram_bytes
+
+def record_footprint(job, estimate, monitor, log_path=None):
+    """
+    Conclude la misura del job: libera la riserva e aggiunge al log di calibrazione
+    previsto e misurato. I job eseguiti in parallelo ad altri sono marcati concurrent
+    (la RAM del processo è condivisa) e non entrano nella calibrazione della RAM.
+    """
+    concurrent = bool(_others(job.id))
+    release_admission(job.id)
+    actual_disk, actual_ram = monitor.stop()
+    record = dict(
+        estimate,
+        job_id=job.id,
+        time=time.time(),
+        actual_disk_bytes=int(actual_disk),
+        actual_ram_bytes=int(actual_ram),
+        concurrent=concurrent,
+    )
+    log_path = log_path or CALIBRATION_LOG
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        with _ADMISSION_LOCK:
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        logger.warning(f"Impossibile aggiornare il log di calibrazione: {e}")
+    logger.info(
+        f"Job {job.id}: disco previsto {_gb(estimate['disk_bytes'])} / misurato {_gb(actual_disk)}, "
+        f"RAM prevista {_gb(estimate['ram_bytes'])} / misurata {_gb(actual_ram)}"
+    )
+    return record
+
+def read_calibration_log(log_path=None, limit=CALIBRATION_WINDOW):
+    """Ultimi limit record del log di calibrazione"""
+    log_path = log_path or CALIBRATION_LOG
+    records = []
+    try:
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        return []
+    return records[-limit:]
+
+def _median_ratio(records, actual_key, raw_key):
+    ratios = [record[actual_key] / record[raw_key] for record in records
+              if record.get(raw_key) and record.get(actual_key)]
+    if len(ratios) < CALIBRATION_MIN_SAMPLES:
+        return 1.0
+    low, high = CALIBRATION_BOUNDS
+    return min(high, max(low, statistics.median(ratios)))
+
+def calibration_factors(log_path=None):
+    """
+    Fattori (disco, RAM) da applicare alle stime grezze: mediana di misurato/previsto
+    sugli ultimi job, 1.0 finché i campioni sono pochi. In cache finché il log non cambia.
+    """
+    log_path = log_path or CALIBRATION_LOG
+    try:
+        mtime = os.stat(log_path).st_mtime_ns
+    except OSError:
+        return 1.0, 1.0
+    with _ADMISSION_LOCK:
+        if _calibration_cache["mtime"] == mtime and _calibration_cache["factors"] is not None:
+            return _calibration_cache["factors"]
+    records = read_calibration_log(log_path)
+    factors = (
+        _median_ratio(records, "actual_disk_bytes", "raw_disk_bytes"),
+        _median_ratio([record for record in records if not record.get("concurrent")],
+                      "actual_ram_bytes", "raw_ram_bytes"),
+    )
+    with _ADMISSION_LOCK:
+        _calibration_cache["mtime"] = mtime
+        _calibration_cache["factors"] = factors
+    return factors
+
+def check_upload_space(size_bytes):
+    """
+    Verifica prima del salvataggio che l'upload stia sul disco del workspace,
+    liberando se serve i job conclusi meno usati di recente. Restituisce (ok, messaggio).
+    """
+    try:
+        shortfall = size_bytes + DISK_HEADROOM_BYTES - disk_free_bytes()
+        if shortfall > 0:
+            evict_lru(shortfall)
+            shortfall = size_bytes + DISK_HEADROOM_BYTES - disk_free_bytes()
+        if shortfall > 0:
+            return False, f"Spazio disco insufficiente per il file caricato ({_gb(size_bytes)})"
+        return True, "Spazio disponibile"
+    except OSError as e:
+        logger.warning(f"Impossibile verificare lo spazio disco: {e}")
+        return True, "Spazio non verificabile"
@@ -0,0 +1,294 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import logging
+from contextlib import closing
+from utils.reformulate_utils import clean_text
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Archivio persistente delle lezioni (fuori dal workspace: non è soggetto a quota né pulizia)
+ARCHIVE_DB = os.environ.get(
+    "ARCHIVE_DB", os.path.join(os.path.expanduser("~"), ".lesson_notes", "archive.db")
+)
+
+# Parole iniziali di un blocco usate per ritrovarlo nei segmenti con timestamp
+ALIGN_WORDS = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lectures (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT,
+    audio_hash TEXT NOT NULL,
+    filename TEXT,
+    created REAL NOT NULL,
+    duration_s REAL,
+    language TEXT,
+    model_size TEXT,
+    transcript TEXT NOT NULL,
+    notes TEXT NOT NULL DEFAULT '',
+    metadata TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS lectures_audio_hash ON lectures (audio_hash, created);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    lecture_id INTEGER NOT NULL REFERENCES lectures (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    start_s REAL,
+    end_s REAL,
+    text TEXT NOT NULL,
+    notes TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS chunks_lecture ON chunks (lecture_id, position);
+"""
+
+# Indice full-text sincronizzato con chunks tramite trigger (tabella FTS5 a contenuto esterno)
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5 (
+    text, notes, content='chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text, notes) VALUES (new.id, new.text, new.notes);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text, notes) VALUES ('delete', old.id, old.text, old.notes);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text, notes) VALUES ('delete', old.id, old.text, old.notes);
+    INSERT INTO chunks_fts (rowid, text, notes) VALUES (new.id, new.text, new.notes);
+END;
+"""
+
+# Database già inizializzati: percorso -> FTS5 disponibile
+_INITIALIZED = {}
+_INIT_LOCK = threading.Lock()
+
+def _connect(db_path=None):
+    """Connessione al database (una per operazione: sqlite3 non condivide connessioni tra thread)"""
+    db_path = db_path or ARCHIVE_DB
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _INIT_LOCK:
+        if db_path not in _INITIALIZED:
+            # WAL: le ricerche non si bloccano durante il salvataggio di una lezione
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+            try:
+                conn.executescript(_FTS_SCHEMA)
+                _INITIALIZED[db_path] = True
+            except sqlite3.OperationalError as e:
+                # SQLite compilato senza FTS5: ricerca con LIKE, più lenta
+                logger.warning(f"FTS5 non disponibile, ricerca senza indice: {e}")
+                _INITIALIZED[db_path] = False
+    return conn
+
+def fts_available(db_path=None):
+    """True se l'archivio usa l'indice FTS5"""
+    with closing(_connect(db_path)):
+        return _INITIALIZED[db_path or ARCHIVE_DB]
+
+def format_timestamp(seconds):
+    """Secondi in m:ss o h:mm:ss"""
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+def _words(text):
+    # Stessa pulizia della riformulazione: i blocchi derivano dal testo pulito
+    return re.findall(r"\w+", clean_text(text).lower())
+
+def _find_sequence(words, needle, start, window):
+    """Prima posizione da start (entro window parole) in cui compare needle"""
+    if not needle:
+        return None
+    stop = min(len(words) - len(needle) + 1, start + window)
+    for i in range(start, max(start, stop)):
+        if words[i:i + len(needle)] == needle:
+            return i
+    return None
+
+def align_blocks(blocks, segments):
+    """
+    Intervallo (inizio, fine) in secondi di ogni blocco di testo, ritrovando le sue prime parole
+    nei segmenti con timestamp della trascrizione. (None, None) se non ci sono segmenti.
+    """
+    word_times = []
+    for segment in segments or []:
+        for word in _words(segment.get("text", "")):
+            word_times.append((word, segment["start"], segment["end"]))
+    if not word_times:
+        return [(None, None)] * len(blocks)
+
+    words = [word for word, _, _ in word_times]
+    spans = []
+    cursor = 0
+    for block in blocks:
+        block_words = _words(block)
+        window = 2 * len(block_words) + 200
+        position = None
+        for size in (ALIGN_WORDS, 1):
+            position = _find_sequence(words, block_words[:size], cursor, window)
+            if position is not None:
+                break
+        if position is None:
+            # Blocco non ritrovato: continua dal punto raggiunto
+            position = min(cursor, len(words) - 1)
+        end = min(len(words) - 1, position + max(0, len(block_words) - 1))
+        spans.append((word_times[position][1], word_times[end][2]))
+        cursor = min(end + 1, len(words) - 1)
+    return spans
+
+def archive_lecture(audio_hash, transcript, blocks, segments=None, notes="", filename=None, job_id=None,
+                    metadata=None, db_path=None):
+    """
+    Salva una lezione: trascrizione, appunti, blocchi (testo originale, appunti del blocco)
+    con i loro timestamp e i metadati del job. Una lezione già archiviata per lo stesso audio
+    viene sostituita (stesso id), così la ricerca non restituisce blocchi doppi.
+    Restituisce l'id della lezione.
+    """
+    metadata = dict(metadata or {})
+    spans = align_blocks([text for text, _ in blocks], segments)
+    values = (job_id, audio_hash, filename, time.time(), metadata.get("duration_s"), metadata.get("language"),
+              metadata.get("model_size"), transcript, notes or "", json.dumps(metadata))
+    with closing(_connect(db_path)) as conn, conn:
+        existing = [
+            row["id"] for row in conn.execute(
+                "SELECT id FROM lectures WHERE audio_hash = ? ORDER BY created DESC", (audio_hash,)
+            )
+        ]
+        if existing:
+            lecture_id = existing[0]
+            conn.execute(
+                "UPDATE lectures SET job_id = ?, audio_hash = ?, filename = ?, created = ?, duration_s = ?, "
+                "language = ?, model_size = ?, transcript = ?, notes = ?, metadata = ? WHERE id = ?",
+                values + (lecture_id,)
+            )
+            # I trigger rimuovono dall'indice full-text i blocchi sostituiti
+            conn.execute("DELETE FROM chunks WHERE lecture_id = ?", (lecture_id,))
+            # Duplicati salvati dalle versioni precedenti (i blocchi seguono con ON DELETE CASCADE)
+            conn.executemany("DELETE FROM lectures WHERE id = ?", [(older,) for older in existing[1:]])
+        else:
+            cursor = conn.execute(
+                "INSERT INTO lectures (job_id, audio_hash, filename, created, duration_s, language, model_size, "
+                "transcript, notes, metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                values
+            )
+            lecture_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO chunks (lecture_id, position, start_s, end_s, text, notes) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (lecture_id, position, start, end, text, note or "")
+                for position, ((text, note), (start, end)) in enumerate(zip(blocks, spans))
+            ]
+        )
+    logger.info(f"Lezione archiviata {lecture_id} ({len(blocks)} blocchi, sha256 {audio_hash[:12]})")
+    return lecture_id
+
+def _lecture_from_row(conn, row):
+    lecture = dict(row)
+    lecture["metadata"] = json.loads(lecture["metadata"] or "{}")
+    lecture["chunks"] = [
+        dict(chunk) for chunk in conn.execute(
+            "SELECT id, position, start_s, end_s, text, notes FROM chunks WHERE lecture_id = ? ORDER BY position",
+            (lecture["id"],)
+        )
+    ]
+    return lecture
+
+def get_lecture(lecture_id, db_path=None):
+    """Lezione con i suoi blocchi, None se non esiste"""
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute("SELECT * FROM lectures WHERE id = ?", (lecture_id,)).fetchone()
+        return _lecture_from_row(conn, row) if row else None
+
+def find_lecture_by_hash(audio_hash, db_path=None):
+    """Ultima lezione archiviata per lo stesso audio (sha256 dell'upload), None se assente"""
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT * FROM lectures WHERE audio_hash = ? ORDER BY created DESC LIMIT 1", (audio_hash,)
+        ).fetchone()
+        return _lecture_from_row(conn, row) if row else None
+
+def list_lectures(limit=50, db_path=None):
+    """Lezioni più recenti (senza blocchi)"""
+    with closing(_connect(db_path)) as conn:
+        return [
+            dict(row) for row in conn.execute(
+                "SELECT id, filename, created, duration_s, language, model_size, audio_hash, "
+                "(SELECT COUNT(*) FROM chunks WHERE lecture_id = lectures.id) AS chunks "
+                "FROM lectures ORDER BY created DESC LIMIT ?", (limit,)
+            )
+        ]
+
+def delete_lecture(lecture_id, db_path=None):
+    """Rimuove una lezione e i suoi blocchi (anche dall'indice)"""
+    with closing(_connect(db_path)) as conn, conn:
+        return conn.execute("DELETE FROM lectures WHERE id = ?", (lecture_id,)).rowcount > 0
+
+def _fts_query(query):
+    """
+    Query utente in sintassi FTS5 sicura: ogni parola tra virgolette (tutte richieste),
+    l'ultima anche come prefisso per la ricerca durante la digitazione.
+    """
+    tokens = re.findall(r"\w+", query or "")
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def _like_snippet(text, tokens, width=60):
+    lower = text.lower()
+    position = min((lower.find(token.lower()) for token in tokens if token.lower() in lower), default=0)
+    start = max(0, position - width)
+    snippet = text[start:position + width * 2]
+    return ("…" if start else "") + snippet + ("…" if position + width * 2 < len(text) else "")
+
+def search_archive(query, limit=20, db_path=None):
+    """
+    Ricerca full-text nei blocchi (testo e appunti) di tutte le lezioni.
+    Restituisce dict con lezione, posizione e timestamp del blocco e uno snippet con
+    i termini evidenziati, ordinati per rilevanza (bm25).
+    """
+    match = _fts_query(query)
+    if match is None:
+        return []
+    with closing(_connect(db_path)) as conn:
+        if _INITIALIZED[db_path or ARCHIVE_DB]:
+            rows = conn.execute(
+                "SELECT c.id AS chunk_id, c.lecture_id, c.position, c.start_s, c.end_s, "
+                "l.filename, l.created, snippet(chunks_fts, -1, '**', '**', '…', 16) AS snippet "
+                "FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid "
+                "JOIN lectures l ON l.id = c.lecture_id "
+                "WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+                (match, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        tokens = re.findall(r"\w+", query)
+        conditions = " AND ".join("(c.text LIKE ? OR c.notes LIKE ?)" for _ in tokens)
+        params = [value for token in tokens for value in (f"%{token}%", f"%{token}%")]
+        rows = conn.execute(
+            "SELECT c.id AS chunk_id, c.lecture_id, c.position, c.start_s, c.end_s, c.text, "
+            "l.filename, l.created FROM chunks c JOIN lectures l ON l.id = c.lecture_id "
+            f"WHERE {conditions} ORDER BY l.created DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["snippet"] = _like_snippet(result.pop("text"), tokens)
+            results.append(result)
+        return results
@@ -0,0 +1,278 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+import torch
+import whisper
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+
+# Motore ASR predefinito (configurabile da variabile d'ambiente)
+DEFAULT_ASR_BACKEND = os.environ.get("ASR_BACKEND", "whisper")
+
+# Registro dei modelli già caricati: (dimensione, quantizzato) -> (modello, lock di inferenza).
+# Il modello è condiviso da tutte le sessioni: whisper.decode registra hook della KV-cache
+# sui moduli del decoder, quindi due decodifiche contemporanee sullo stesso modello si mescolano
+_MODEL_REGISTRY = {}
+_MODEL_REGISTRY_LOCK = threading.Lock()
+
+def _replace_whisper_linear(module):
+    """Sostituisce i Linear di Whisper con nn.Linear standard (quantize_dynamic riconosce solo questi)"""
+    for name, child in module.named_children():
+        if isinstance(child, whisper.model.Linear):
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.weight = child.weight
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            _replace_whisper_linear(child)
+
+def quantize_whisper_model(model):
+    """Quantizzazione dinamica int8 dei layer Linear per inferenza su CPU"""
+    model = model.cpu().float().eval()
+    _replace_whisper_linear(model)
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def load_whisper_model(model_size="medium", quantize=False):
+    """
+    Carica il modello Whisper una sola volta per processo.
+    Con quantize=True il modello è caricato su CPU e quantizzato int8 (pesi Linear).
+    """
+    return _registered_model(model_size, quantize)[0]
+
+def whisper_model_lock(model_size="medium", quantize=False):
+    """Lock da tenere durante l'inferenza sul modello condiviso (una decodifica alla volta)"""
+    return _registered_model(model_size, quantize)[1]
+
+def _registered_model(model_size, quantize):
+    key = (model_size, bool(quantize))
+    with _MODEL_REGISTRY_LOCK:
+        entry = _MODEL_REGISTRY.get(key)
+        if entry is None:
+            if quantize:
+                model = quantize_whisper_model(whisper.load_model(model_size, device="cpu"))
+            else:
+                model = whisper.load_model(model_size)
+            entry = (model, threading.Lock())
+            _MODEL_REGISTRY[key] = entry
+    return entry
+
+def batch_log_mel_spectrogram(windows, n_mels=80, device="cpu"):
+    """
+    Log-mel di N finestre da 30 s in un unico passaggio vettorizzato.
+    Equivalente a whisper.log_mel_spectrogram per finestra (anche il clamp dinamico è per finestra).
+    Restituisce un tensore (N, n_mels, 3000).
+    """
+    n_samples = whisper.audio.N_SAMPLES
+    batch = np.zeros((len(windows), n_samples), dtype=np.float32)
+    for i, window in enumerate(windows):
+        length = min(len(window), n_samples)
+        batch[i, :length] = window[:length]
+
+    audio = torch.from_numpy(batch).to(device)
+    hann = torch.hann_window(whisper.audio.N_FFT).to(device)
+    stft = torch.stft(audio, whisper.audio.N_FFT, whisper.audio.HOP_LENGTH, window=hann, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+    mel_spec = whisper.audio.mel_filters(device, n_mels) @ magnitudes
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+def transcribe_batch(model, windows, language="it"):
+    """
+    Trascrive più finestre (max 30 s ciascuna) con un solo passaggio dell'encoder
+    sul batch e decodifica congiunta, come whisper.decode con mel batch.
+    Restituisce la lista dei DecodingResult nello stesso ordine.
+    """
+    if not windows:
+        return []
+    mel = batch_log_mel_spectrogram(windows, n_mels=model.dims.n_mels, device=model.device)
+    options = whisper.DecodingOptions(language=language, fp16=False)
+    return whisper.decode(model, mel, options)
+
+class ASRBackend(ABC):
+    """
+    Interfaccia comune dei motori di trascrizione.
+    transcribe restituisce un dict con "text", "language" e "segments"
+    (lista di dict con start, end, text, no_speech_prob, avg_logprob, compression_ratio);
+    on_progress(secondi), se il motore decodifica per segmenti, riceve i secondi di audio man mano.
+    """
+    name = ""
+    supports_batch = False
+
+    def __init__(self, model_size="medium", quantize=False):
+        self.model_size = model_size
+        self.quantize = quantize
+        self.model = None
+        self._load_lock = threading.Lock()
+
+    @abstractmethod
+    def load(self):
+        """Carica il modello (una sola volta) e restituisce il motore"""
+
+    @abstractmethod
+    def transcribe(self, audio, language="it", on_progress=None, **options):
+        """Trascrive un array float32 mono 16 kHz (o un percorso file)"""
+
+    def transcribe_batch(self, windows, language="it"):
+        """Trascrive più finestre; di default una alla volta"""
+        return [self.transcribe(window, language=language) for window in windows]
+
+    @abstractmethod
+    def detect_language(self, windows):
+        """Lingua più probabile su più finestre audio: restituisce (codice, probabilità media)"""
+
+def _average_language_probs(probs_per_window):
+    """Media delle distribuzioni di probabilità per lingua e scelta della più probabile"""
+    totals = {}
+    for probs in probs_per_window:
+        for language, prob in probs.items():
+            totals[language] = totals.get(language, 0.0) + float(prob)
+    if not totals:
+        return None, 0.0
+    language = max(totals, key=totals.get)
+    return language, totals[language] / len(probs_per_window)
+
+class WhisperBackend(ASRBackend):
+    """Motore openai-whisper (PyTorch), con batch e quantizzazione int8 opzionale"""
+    name = "whisper"
+    supports_batch = True
+
+    def load(self):
+        with self._load_lock:
+            if self.model is None:
+                self._inference_lock = whisper_model_lock(self.model_size, quantize=self.quantize)
+                self.model = load_whisper_model(self.model_size, quantize=self.quantize)
+        return self
+
+    def transcribe(self, audio, language="it", on_progress=None, **options):
+        # openai-whisper restituisce tutti i segmenti insieme: l'avanzamento è per chunk
+        self.load()
+        with self._inference_lock:
+            result = self.model.transcribe(audio, language=language, fp16=False, **options)
+        segments = [
+            {
+                "start": float(segment["start"]),
+                "end": float(segment["end"]),
+                "text": segment["text"],
+                "no_speech_prob": float(segment.get("no_speech_prob", 0.0)),
+                "avg_logprob": float(segment.get("avg_logprob", 0.0)),
+                "compression_ratio": float(segment.get("compression_ratio", 0.0)),
+            }
+            for segment in result.get("segments", [])
+        ]
+        return {"text": result.get("text", ""), "language": result.get("language", language), "segments": segments}
+
+    def transcribe_batch(self, windows, language="it"):
+        self.load()
+        with self._inference_lock:
+            results = transcribe_batch(self.model, windows, language=language)
+        outputs = []
+        for window, result in zip(windows, results):
+            # whisper.decode non restituisce segmenti: l'intera finestra è un segmento
+            segment = {
+                "start": 0.0,
+                "end": len(window) / whisper.audio.SAMPLE_RATE,
+                "text": result.text,
+                "no_speech_prob": float(result.no_speech_prob),
+                "avg_logprob": float(result.avg_logprob),
+                "compression_ratio": float(result.compression_ratio),
+            }
+            outputs.append({"text": result.text, "language": result.language, "segments": [segment]})
+        return outputs
+
+    def detect_language(self, windows):
+        model = self.load().model
+        mel = batch_log_mel_spectrogram(windows, n_mels=model.dims.n_mels, device=model.device)
+        with self._inference_lock:
+            _, probs = whisper.detect_language(model, mel)
+        return _average_language_probs(probs)
+
+class FasterWhisperBackend(ASRBackend):
+    """Motore faster-whisper (CTranslate2), ottimizzato per CPU"""
+    name = "faster-whisper"
+
+    def load(self):
+        if not FASTER_WHISPER_AVAILABLE:
+            raise RuntimeError("faster-whisper non installato. Esegui: pip install faster-whisper")
+        # Due sessioni che caricano insieme lo stesso motore costruirebbero due modelli
+        with self._load_lock:
+            if self.model is None:
+                compute_type = "int8" if self.quantize else "default"
+                self.model = WhisperModel(self.model_size, device="cpu", compute_type=compute_type)
+        return self
+
+    def transcribe(self, audio, language="it", on_progress=None, **options):
+        # Ricerca greedy come la chiamata a openai-whisper, per confronti omogenei
+        options.setdefault("beam_size", 1)
+        segments, info = self.load().model.transcribe(audio, language=language, **options)
+        decoded = []
+        # I segmenti sono decodificati man mano che il generatore viene consumato
+        for segment in segments:
+            decoded.append({
+                "start": float(segment.start),
+                "end": float(segment.end),
+                "text": segment.text,
+                "no_speech_prob": float(segment.no_speech_prob),
+                "avg_logprob": float(segment.avg_logprob),
+                "compression_ratio": float(segment.compression_ratio),
+            })
+            if on_progress is not None:
+                previous_end = decoded[-2]["end"] if len(decoded) > 1 else 0.0
+                on_progress(max(0.0, decoded[-1]["end"] - previous_end))
+        segments = decoded
+        text = "".join(segment["text"] for segment in segments)
+        return {"text": text, "language": info.language, "segments": segments}
+
+    def detect_language(self, windows):
+        model = self.load().model
+        probs_per_window = []
+        for window in windows:
+            # Le informazioni sulla lingua sono calcolate subito; i segmenti (lazy) non vengono decodificati
+            _, info = model.transcribe(window, language=None, beam_size=1)
+            all_probs = getattr(info, "all_language_probs", None)
+            probs_per_window.append(dict(all_probs) if all_probs else {info.language: info.language_probability})
+        return _average_language_probs(probs_per_window)
+
+# Motori disponibili: nome -> classe
+ASR_BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+# Istanze già caricate: (motore, dimensione, quantizzato) -> backend
+_BACKEND_CACHE = {}
+_BACKEND_CACHE_LOCK = threading.Lock()
+
+def get_available_backends():
+    """Restituisce i motori ASR utilizzabili in questo ambiente"""
+    backends = [WhisperBackend.name]
+    if FASTER_WHISPER_AVAILABLE:
+        backends.append(FasterWhisperBackend.name)
+    return backends
+
+def get_asr_backend(name=None, model_size="medium", quantize=False):
+    """Restituisce il motore ASR richiesto con il modello già caricato"""
+    name = name or DEFAULT_ASR_BACKEND
+    if name not in ASR_BACKENDS:
+        raise ValueError(f"Motore ASR non valido. Scegli tra: {list(ASR_BACKENDS)}")
+    key = (name, model_size, bool(quantize))
+    with _BACKEND_CACHE_LOCK:
+        backend = _BACKEND_CACHE.get(key)
+        if backend is None:
+            backend = ASR_BACKENDS[name](model_size=model_size, quantize=quantize)
+            _BACKEND_CACHE[key] = backend
+    return backend.load()
+
+def is_model_loaded(name=None, model_size="medium", quantize=False):
+    """True se il modello è già in memoria nel processo (il job non dovrà caricarlo)"""
+    name = name or DEFAULT_ASR_BACKEND
+    if name == WhisperBackend.name:
+        with _MODEL_REGISTRY_LOCK:
+            return (model_size, bool(quantize)) in _MODEL_REGISTRY
+    with _BACKEND_CACHE_LOCK:
+        backend = _BACKEND_CACHE.get((name, model_size, bool(quantize)))
+    return backend is not None and backend.model is not None
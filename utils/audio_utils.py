@@ -1,11 +1,17 @@
 import os
+import json
 import time
 import wave
 import subprocess
-import tempfile
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from pydub import AudioSegment
 from pydub.exceptions import CouldntDecodeError
+from utils.resample_utils import resample_audio, resample_pcm_blocks, float_to_pcm16
+from utils.wav_utils import open_wav_memmap, pcm_to_float32
+from utils.workspace_utils import make_temp_dir
 try:
     import soundfile as sf
     SOUNDFILE_AVAILABLE = True
@@ -13,35 +19,127 @@ except ImportError:
     SOUNDFILE_AVAILABLE = False
     print("⚠️ soundfile non disponibile, usando validazione alternativa")
 
+# Cache dei probe: (percorso assoluto, mtime_ns, dimensione) -> metadati
+_PROBE_CACHE = {}
+_PROBE_CACHE_LOCK = threading.Lock()
+
+# Mappa subtype soundfile -> nome codec FFmpeg
+_SOUNDFILE_CODECS = {
+    "PCM_16": "pcm_s16le",
+    "PCM_24": "pcm_s24le",
+    "PCM_32": "pcm_s32le",
+    "PCM_U8": "pcm_u8",
+    "FLOAT": "pcm_f32le",
+    "DOUBLE": "pcm_f64le",
+    "MPEG_LAYER_III": "mp3",
+    "VORBIS": "vorbis",
+    "OPUS": "opus",
+}
+
+def check_ffprobe_available():
+    """Verifica se FFprobe è disponibile"""
+    try:
+        result = subprocess.run(['ffprobe', '-version'],
+                                capture_output=True, text=True, timeout=5)
+        return result.returncode == 0
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return False
+
+def _probe_soundfile(audio_path):
+    """Legge i metadati dall'header tramite soundfile (nessuna decodifica)"""
+    info = sf.info(audio_path)
+    if info.samplerate <= 0:
+        return None
+    return {
+        "duration_ms": int(round(info.frames * 1000 / info.samplerate)),
+        "sample_rate": int(info.samplerate),
+        "channels": int(info.channels),
+        "codec": _SOUNDFILE_CODECS.get(info.subtype, str(info.subtype).lower()),
+        "format": str(info.format).lower(),
+    }
+
+def _probe_ffprobe(audio_path):
+    """Legge i metadati del container tramite ffprobe (nessuna decodifica)"""
+    result = subprocess.run([
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name,sample_rate,channels,duration:format=format_name,duration',
+        '-of', 'json', audio_path
+    ], capture_output=True, text=True, timeout=30)
+    if result.returncode != 0:
+        return None
+    data = json.loads(result.stdout or "{}")
+    streams = data.get("streams") or []
+    if not streams:
+        return None
+    stream = streams[0]
+    container = data.get("format") or {}
+    # La durata dello stream può mancare (es. alcuni M4A): usa quella del container
+    duration = stream.get("duration") or container.get("duration")
+    if duration in (None, "N/A"):
+        return None
+    return {
+        "duration_ms": int(round(float(duration) * 1000)),
+        "sample_rate": int(stream.get("sample_rate") or 0),
+        "channels": int(stream.get("channels") or 0),
+        "codec": stream.get("codec_name", ""),
+        "format": container.get("format_name", ""),
+    }
+
+def _probe_pydub(audio_path):
+    """Fallback senza soundfile né ffprobe: decodifica completa con pydub"""
+    audio = AudioSegment.from_file(audio_path)
+    return {
+        "duration_ms": len(audio),
+        "sample_rate": audio.frame_rate,
+        "channels": audio.channels,
+        "codec": f"pcm_s{audio.sample_width * 8}le",
+        "format": os.path.splitext(audio_path)[1].lstrip(".").lower(),
+    }
+
+def probe_audio(audio_path):
+    """
+    Legge durata (ms), sample rate, canali e codec dagli header del file.
+    Il risultato è in cache per percorso e mtime. Restituisce None se il file non è leggibile.
+    """
+    try:
+        stat = os.stat(audio_path)
+    except OSError:
+        return None
+    if stat.st_size == 0:
+        return None
+
+    key = (os.path.abspath(audio_path), stat.st_mtime_ns, stat.st_size)
+    with _PROBE_CACHE_LOCK:
+        if key in _PROBE_CACHE:
+            cached = _PROBE_CACHE[key]
+            return dict(cached) if cached else None
+
+    info = None
+    probers = []
+    if SOUNDFILE_AVAILABLE:
+        probers.append(_probe_soundfile)
+    if check_ffprobe_available():
+        probers.append(_probe_ffprobe)
+    else:
+        probers.append(_probe_pydub)
+
+    for prober in probers:
+        try:
+            info = prober(audio_path)
+        except Exception:
+            info = None
+        if info:
+            break
+
+    with _PROBE_CACHE_LOCK:
+        _PROBE_CACHE[key] = info
+    return dict(info) if info else None
+
 def validate_audio_file(audio_path):
     """Valida che il file audio sia valido e leggibile"""
     try:
-        if not os.path.exists(audio_path):
-            return False
-        
-        # Verifica dimensione file
-        if os.path.getsize(audio_path) == 0:
-            return False
-        
-        # Se soundfile è disponibile, usa per validazione avanzata
-        if SOUNDFILE_AVAILABLE:
-            try:
-                with sf.SoundFile(audio_path) as f:
-                    if f.frames == 0:
-                        return False
-                return True
-            except Exception:
-                return False
-        else:
-            # Validazione alternativa senza soundfile
-            try:
-                # Prova a leggere con pydub
-                audio = AudioSegment.from_file(audio_path)
-                if len(audio) == 0:
-                    return False
-                return True
-            except Exception:
-                return False
+        info = probe_audio(audio_path)
+        return info is not None and info["duration_ms"] > 0
     except Exception:
         return False
 
@@ -65,6 +163,27 @@ def check_ffmpeg_available():
     except (subprocess.TimeoutExpired, FileNotFoundError):
         return False
 
+# Formato normalizzato usato da tutta la pipeline (quello atteso da Whisper)
+TARGET_SAMPLE_RATE = 16000
+TARGET_CHANNELS = 1
+TARGET_CODEC = "pcm_s16le"
+
+def _normalize_ffmpeg_args():
+    """Argomenti FFmpeg per ottenere PCM mono 16 kHz"""
+    return ['-vn', '-ac', str(TARGET_CHANNELS), '-ar', str(TARGET_SAMPLE_RATE), '-acodec', TARGET_CODEC]
+
+def is_normalized_audio(audio_path):
+    """Verifica se il file è già un WAV PCM 16 bit mono 16 kHz"""
+    info = probe_audio(audio_path)
+    if not info:
+        return False
+    return (
+        info["codec"] == TARGET_CODEC
+        and info["sample_rate"] == TARGET_SAMPLE_RATE
+        and info["channels"] == TARGET_CHANNELS
+        and "wav" in info["format"]
+    )
+
 def extract_audio(video_path, audio_path):
     """Estrae audio da video con gestione errori robusta"""
     try:
@@ -77,11 +196,11 @@ def extract_audio(video_path, audio_path):
         # Rimuovi file output se esiste
         if os.path.exists(audio_path):
             os.remove(audio_path)
-        # Esegui estrazione con timeout
-        result = subprocess.run([
-            'ffmpeg', '-y', '-i', video_path,
-            '-vn', '-acodec', 'pcm_s16le', '-ar', '16000', audio_path
-        ], capture_output=True, text=True, timeout=300, check=True)
+        # Esegui estrazione con timeout (un solo passaggio, direttamente mono 16 kHz)
+        result = subprocess.run(
+            ['ffmpeg', '-y', '-i', video_path] + _normalize_ffmpeg_args() + [audio_path],
+            capture_output=True, text=True, timeout=300, check=True
+        )
         # Verifica file output
         if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
             return False, "Estrazione audio fallita - file output vuoto"
@@ -93,6 +212,229 @@ def extract_audio(video_path, audio_path):
     except Exception as e:
         return False, f"Errore estrazione audio: {str(e)}"
 
+def normalize_audio(input_path, audio_path):
+    """
+    Stadio di ingest unico per audio e video: produce un WAV PCM mono 16 kHz
+    con un solo passaggio FFmpeg. Se l'input è già in quel formato non lo ricodifica.
+    Restituisce (successo, messaggio, percorso del file normalizzato).
+    """
+    if is_normalized_audio(input_path):
+        return True, "Audio già normalizzato", input_path
+    success, message = extract_audio(input_path, audio_path)
+    return success, message, audio_path if success else None
+
+# Anteprima nel browser: proxy mono a basso bitrate dei primi minuti invece del file originale
+PREVIEW_MAX_SECONDS = 600
+PREVIEW_BITRATE = "32k"
+PREVIEW_MAX_FALLBACK_BYTES = 20 * 1024 * 1024
+
+def make_preview_audio(input_path, preview_path, max_seconds=PREVIEW_MAX_SECONDS, bitrate=PREVIEW_BITRATE):
+    """
+    Crea un'anteprima MP3 mono a basso bitrate dei primi max_seconds secondi
+    (10 minuti a 32 kbps sono circa 2.4 MB, qualunque sia la dimensione dell'originale).
+    Restituisce (successo, messaggio).
+    """
+    try:
+        if not check_ffmpeg_available():
+            return False, "FFmpeg non trovato"
+        subprocess.run(
+            ['ffmpeg', '-y', '-v', 'error', '-t', str(max_seconds), '-i', input_path,
+             '-vn', '-ac', '1', '-ar', '22050', '-b:a', bitrate, '-f', 'mp3', preview_path],
+            capture_output=True, text=True, timeout=120, check=True
+        )
+        if not os.path.exists(preview_path) or os.path.getsize(preview_path) == 0:
+            return False, "Anteprima vuota"
+        return True, "Anteprima creata"
+    except subprocess.TimeoutExpired:
+        return False, "Timeout durante la creazione dell'anteprima"
+    except subprocess.CalledProcessError as e:
+        return False, f"Errore FFmpeg: {e.stderr}"
+    except Exception as e:
+        return False, f"Errore anteprima: {str(e)}"
+
+def stream_normalized_pcm(input_path, block_seconds=30):
+    """
+    Decodifica l'input in PCM mono 16 kHz tramite FFmpeg senza scrivere su disco.
+    Restituisce blocchi int16 di block_seconds secondi (l'ultimo può essere più corto).
+    """
+    if not check_ffmpeg_available():
+        raise RuntimeError("FFmpeg non trovato. Installa FFmpeg per lo streaming audio.")
+    block_bytes = int(block_seconds * TARGET_SAMPLE_RATE) * 2
+    process = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', input_path]
+        + _normalize_ffmpeg_args() + ['-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            # Scarta un eventuale byte spaiato a fine stream
+            data = data[:len(data) - (len(data) % 2)]
+            yield np.frombuffer(data, dtype="<i2")
+        process.wait(timeout=30)
+        if process.returncode != 0:
+            raise RuntimeError(f"Errore FFmpeg: {process.stderr.read().decode(errors='replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+# Estrazione parallela per registrazioni lunghe
+PARALLEL_EXTRACTION_MIN_SECONDS = 20 * 60
+SEGMENT_TARGET_SECONDS = 300
+DEFAULT_EXTRACTION_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+def extract_audio_range(input_path, audio_path, start_s, duration_s):
+    """Estrae un intervallo temporale (seek con -ss/-t) in PCM mono 16 kHz"""
+    try:
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        # -ss prima di -i: seek sul container, decodifica solo l'intervallo richiesto
+        subprocess.run(
+            ['ffmpeg', '-y', '-nostdin', '-v', 'error', '-threads', '1',
+             '-ss', f"{start_s:.3f}", '-t', f"{duration_s:.3f}", '-i', input_path]
+            + _normalize_ffmpeg_args() + [audio_path],
+            capture_output=True, text=True, timeout=300, check=True
+        )
+        if not os.path.exists(audio_path) or os.path.getsize(audio_path) == 0:
+            return False, f"Segmento {start_s:.0f}s vuoto"
+        return True, "Estrazione completata"
+    except subprocess.TimeoutExpired:
+        return False, f"Timeout estrazione segmento {start_s:.0f}s"
+    except subprocess.CalledProcessError as e:
+        return False, f"Errore FFmpeg: {e.stderr}"
+    except Exception as e:
+        return False, f"Errore estrazione segmento: {str(e)}"
+
+def extract_audio_segments(input_path, output_dir, segment_duration=SEGMENT_TARGET_SECONDS,
+                           max_workers=DEFAULT_EXTRACTION_WORKERS):
+    """
+    Estrae l'audio in segmenti con più processi FFmpeg in parallelo, ognuno con il proprio seek.
+    Generatore: restituisce (indice, inizio in secondi, percorso) in ordine, appena ogni segmento
+    è pronto, così la trascrizione può partire mentre i successivi sono ancora in decodifica.
+    Un segmento fallito viene riestratto una volta da solo; se fallisce ancora il percorso è None
+    e il chiamante decide come proseguire (gli altri segmenti restano validi).
+    """
+    if not check_ffmpeg_available():
+        raise RuntimeError("FFmpeg non trovato. Installa FFmpeg per l'estrazione parallela.")
+    info = probe_audio(input_path)
+    if not info or info["duration_ms"] <= 0:
+        raise ValueError(f"Impossibile determinare la durata di {input_path}")
+    if segment_duration <= 0:
+        raise ValueError("Durata segmento deve essere positiva")
+
+    duration_s = info["duration_ms"] / 1000
+    ranges = []
+    start = 0.0
+    while start < duration_s:
+        ranges.append((len(ranges), start, min(segment_duration, duration_s - start)))
+        start += segment_duration
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    futures = []
+    try:
+        for index, start_s, length_s in ranges:
+            path = os.path.join(output_dir, f"segment_{index:03d}.wav")
+            futures.append((index, start_s, path, executor.submit(
+                extract_audio_range, input_path, path, start_s, length_s
+            )))
+        for index, start_s, path, future in futures:
+            success, message = future.result()
+            if not success:
+                # Secondo tentativo senza concorrenza (es. timeout sotto carico)
+                print(f"⚠️ Segmento {index + 1} non estratto ({message}), nuovo tentativo")
+                success, message = extract_audio_range(input_path, path, start_s, ranges[index][2])
+            if not success:
+                print(f"❌ Segmento {index + 1} ({start_s:.0f}s) non estraibile: {message}")
+                path = None
+            yield index, start_s, path
+    finally:
+        # Se il consumatore si ferma prima, non avviare i segmenti ancora in coda
+        # (annullati a mano: cancel_futures di shutdown richiede Python 3.9)
+        for _, _, _, future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def to_mono_16k_segment(audio):
+    """Downmix e ricampionamento NumPy di un AudioSegment (sostituisce set_frame_rate di pydub)"""
+    if audio.sample_width in (2, 4):
+        # Vista diretta sui byte PCM, senza copia
+        samples = np.frombuffer(audio.raw_data, dtype=f"<i{audio.sample_width}")
+    else:
+        samples = np.array(audio.get_array_of_samples())
+    samples = samples.reshape(-1, audio.channels)
+    resampled = resample_audio(samples, audio.frame_rate, TARGET_SAMPLE_RATE)
+    return AudioSegment(
+        float_to_pcm16(resampled).tobytes(),
+        frame_rate=TARGET_SAMPLE_RATE,
+        sample_width=2,
+        channels=TARGET_CHANNELS
+    )
+
+def _rechunk(blocks, chunk_samples):
+    """Raggruppa blocchi di lunghezza arbitraria in chunk di chunk_samples campioni"""
+    pending = []
+    pending_len = 0
+    for block in blocks:
+        while len(block):
+            take = min(chunk_samples - pending_len, len(block))
+            pending.append(block[:take])
+            pending_len += take
+            block = block[take:]
+            if pending_len == chunk_samples:
+                yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+                pending, pending_len = [], 0
+    if pending_len:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+def iter_pcm16_chunks(audio_path, chunk_duration=30):
+    """
+    Restituisce chunk PCM int16 mono 16 kHz letti da un WAV tramite memory map.
+    Se il WAV è già normalizzato i chunk sono viste sul file (nessuna copia);
+    altrimenti viene ricampionato a blocchi. None se il file non è un WAV mappabile.
+    """
+    reader = open_wav_memmap(audio_path)
+    if reader is None or reader.frames == 0:
+        return None
+    chunk_samples = int(chunk_duration * TARGET_SAMPLE_RATE)
+
+    def generate():
+        try:
+            if (reader.sample_rate == TARGET_SAMPLE_RATE and reader.channels == TARGET_CHANNELS
+                    and reader.dtype == np.dtype("<i2")):
+                for _, _, view in reader.iter_chunks(chunk_samples):
+                    yield view
+            else:
+                blocks = resample_pcm_blocks(reader.samples, reader.sample_rate, TARGET_SAMPLE_RATE)
+                for chunk in _rechunk(blocks, chunk_samples):
+                    yield float_to_pcm16(chunk)
+        finally:
+            reader.close()
+
+    return generate()
+
+def iter_audio_chunks(audio_path, chunk_duration=30):
+    """
+    Chunk float32 pronti per Whisper, senza scrivere file intermedi.
+    Restituisce None se il file non è un WAV mappabile (usare split_audio).
+    """
+    chunks = iter_pcm16_chunks(audio_path, chunk_duration)
+    if chunks is None:
+        return None
+    return (pcm_to_float32(chunk) for chunk in chunks)
+
+def _write_pcm16_wav(path, samples, sample_rate=TARGET_SAMPLE_RATE):
+    """Scrive PCM int16 mono su WAV direttamente dal buffer (anche viste memmap)"""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.ascontiguousarray(samples, dtype="<i2"))
+
 def split_audio(audio_path, chunk_duration=30):
     """Divide audio in chunks con gestione errori"""
     temp_chunks = []
@@ -101,7 +443,24 @@ def split_audio(audio_path, chunk_duration=30):
         if not validate_audio_file(audio_path):
             raise ValueError("File audio non valido")
         # Crea directory temporanea
-        temp_dir = tempfile.mkdtemp(prefix="audio_chunks_")
+        temp_dir = make_temp_dir("audio_chunks_")
+        chunk_paths = []
+        
+        # WAV PCM: slicing tramite memory map, senza caricare tutto il file con pydub
+        pcm_chunks = iter_pcm16_chunks(audio_path, chunk_duration)
+        if pcm_chunks is not None:
+            for i, chunk in enumerate(pcm_chunks):
+                if len(chunk) == 0:
+                    continue
+                path = os.path.join(temp_dir, f"chunk_{i:02d}.wav")
+                temp_chunks.append(path)
+                _write_pcm16_wav(path, chunk)
+                if os.path.getsize(path) > 0:
+                    chunk_paths.append(path)
+            if not chunk_paths:
+                raise ValueError("Nessun chunk valido generato")
+            return chunk_paths
+        
         # Carica audio
         try:
             audio = AudioSegment.from_wav(audio_path)
@@ -110,18 +469,18 @@ def split_audio(audio_path, chunk_duration=30):
             audio = AudioSegment.from_file(audio_path)
         if len(audio) == 0:
             raise ValueError("File audio vuoto")
-        # Converti in WAV se necessario
-        if audio.frame_rate != 16000:
-            audio = audio.set_frame_rate(16000)
+        # Converti in mono 16 kHz se necessario (già fatto se l'input è normalizzato)
+        if audio.channels != TARGET_CHANNELS or audio.frame_rate != TARGET_SAMPLE_RATE:
+            audio = to_mono_16k_segment(audio)
         ms_per_chunk = chunk_duration * 1000
         chunks = [audio[i:i + ms_per_chunk] for i in range(0, len(audio), ms_per_chunk)]
         # Esporta chunks
-        chunk_paths = []
         for i, chunk in enumerate(chunks):
             if len(chunk) == 0:
                 continue
             path = os.path.join(temp_dir, f"chunk_{i:02d}.wav")
-            chunk.export(path, format="wav", parameters=["-ar", "16000"])
+            # Export WAV diretto (senza parametri pydub non invoca FFmpeg)
+            chunk.export(path, format="wav")
             # Verifica chunk esportato
             if os.path.exists(path) and os.path.getsize(path) > 0:
                 chunk_paths.append(path)
@@ -143,7 +502,7 @@ def load_audio_file(file_data, filename=None):
     """Carica file audio con gestione sicura"""
     try:
         # Crea directory temporanea sicura
-        temp_dir = tempfile.mkdtemp(prefix="audio_temp_")
+        temp_dir = make_temp_dir("audio_temp_")
         if filename is None:
             filename = os.path.join(temp_dir, "temp_audio.wav")
         # Assicurati che sia un file WAV
@@ -0,0 +1,137 @@
+import os
+import time
+import zipfile
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# File preparati in anticipo (salvataggio e decodifica) mentre il precedente è in trascrizione
+BATCH_PREFETCH = max(0, int(os.environ.get("BATCH_PREFETCH", "1")))
+# Attesa massima tra due aggiornamenti dell'interfaccia mentre un file è in preparazione
+BATCH_POLL_SECONDS = 0.5
+
+# Stati di un file in coda
+QUEUED = "queued"
+PREPARING = "preparing"
+READY = "ready"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+class BatchItem:
+    """
+    File della coda: stato, avanzamento (0-1), messaggio e output da includere nello zip.
+    Gli attributi sono scritti dal thread che lavora sul file e letti dall'interfaccia.
+    """
+
+    def __init__(self, name, source=None, job=None):
+        self.name = name
+        self.source = source
+        self.job = job
+        self.status = QUEUED
+        self.message = ""
+        self.progress = 0.0
+        self.outputs = []
+        self.data = {}
+        self.started = None
+        self.finished = None
+
+    def set_status(self, status, message=""):
+        self.status = status
+        self.message = message
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.monotonic()) - self.started
+
+def _prepare_item(prepare, item):
+    item.set_status(PREPARING)
+    try:
+        prepare(item)
+        if item.status == PREPARING:
+            item.set_status(READY)
+    except Exception as e:
+        logger.error(f"Errore preparazione {item.name}: {e}")
+        item.set_status(FAILED, str(e))
+
+def run_queue(items, prepare, process, prefetch=BATCH_PREFETCH, on_wait=None, poll=BATCH_POLL_SECONDS):
+    """
+    Elabora la coda in pipeline: prepare(item) gira in un thread di ingest fino a prefetch file
+    in anticipo, process(item) nel thread chiamante, un file alla volta (il modello caricato è
+    condiviso e l'interfaccia si aggiorna dal thread dello script).
+    Un errore su un file lo segna come fallito e la coda prosegue.
+    on_wait() è chiamata nel thread chiamante mentre si attende la preparazione di un file.
+    Se la coda si interrompe (anche per BaseException, es. rerun di Streamlit) le preparazioni
+    non ancora iniziate vengono annullate e si attende solo quella in corso.
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-ingest") as executor:
+        futures = {}
+
+        def schedule(index):
+            if index < len(items) and index not in futures:
+                futures[index] = executor.submit(_prepare_item, prepare, items[index])
+
+        try:
+            for index in range(min(len(items), prefetch + 1)):
+                schedule(index)
+            for index, item in enumerate(items):
+                schedule(index)
+                while not futures[index].done():
+                    wait([futures[index]], timeout=poll)
+                    if on_wait is not None:
+                        on_wait()
+                # Mentre questo file viene elaborato si preparano i successivi (prefetch file in anticipo)
+                schedule(index + prefetch)
+                if item.status == FAILED:
+                    continue
+                item.started = time.monotonic()
+                item.set_status(PROCESSING)
+                try:
+                    process(item)
+                    item.progress = 1.0
+                    item.set_status(DONE, item.message)
+                except Exception as e:
+                    logger.error(f"Errore elaborazione {item.name}: {e}")
+                    item.set_status(FAILED, str(e))
+                finally:
+                    item.finished = time.monotonic()
+        finally:
+            # Preparazioni non ancora iniziate annullate a mano (cancel_futures richiede Python 3.9);
+            # l'uscita dal with attende quella in corso
+            for future in futures.values():
+                future.cancel()
+    return items
+
+def output_stem(name, used):
+    """Cartella unica nello zip per un file (due 'lezione.mp3' diventano lezione e lezione_2)"""
+    stem = os.path.splitext(os.path.basename(name))[0] or "lezione"
+    candidate, suffix = stem, 2
+    while candidate in used:
+        candidate = f"{stem}_{suffix}"
+        suffix += 1
+    used.add(candidate)
+    return candidate
+
+def write_zip(entries, zip_path):
+    """
+    Scrive gli output (nome nello zip, percorso) in un archivio zip.
+    I PDF sono già compressi e vengono memorizzati senza ricompressione.
+    Restituisce i byte dello zip.
+    """
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in entries:
+            compression = zipfile.ZIP_STORED if arcname.lower().endswith(".pdf") else zipfile.ZIP_DEFLATED
+            archive.write(path, arcname, compress_type=compression)
+    return os.path.getsize(zip_path)
+
+def queue_summary(items):
+    """Conteggio dei file per stato"""
+    summary = {}
+    for item in items:
+        summary[item.status] = summary.get(item.status, 0) + 1
+    return summary
@@ -0,0 +1,87 @@
+import os
+import json
+import hashlib
+import tempfile
+import logging
+from utils.store_utils import open_store
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cache su disco indirizzata per contenuto, in un archivio append-only compresso a blocchi
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lesson_llm_cache"))
+CACHE_STORE_NAME = "responses.lrs"
+# Quota di risposte sostituite oltre la quale la manutenzione compatta l'archivio
+COMPACT_GARBAGE_RATIO = 0.3
+
+def cache_key(*parts):
+    """Chiave sha256 del contenuto: stesse parti, stessa chiave"""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        # Lunghezza come prefisso: ("ab", "c") e ("a", "bc") non collidono
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+def _store(cache_dir=None):
+    return open_store(os.path.join(cache_dir or LLM_CACHE_DIR, CACHE_STORE_NAME))
+
+def _legacy_entry_path(key, cache_dir=None):
+    # Formato precedente: un file JSON per chiave
+    return os.path.join(cache_dir or LLM_CACHE_DIR, key[:2], f"{key}.json")
+
+def cache_get(key, cache_dir=None):
+    """Valore in cache per la chiave, None se assente o illeggibile"""
+    try:
+        data = _store(cache_dir).get(key)
+        if data is not None:
+            return json.loads(data.decode("utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Voce di cache illeggibile {key[:12]}: {e}")
+        return None
+
+    # Voce del formato precedente: migrata nell'archivio alla prima lettura
+    legacy_path = _legacy_entry_path(key, cache_dir)
+    try:
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            value = json.load(f).get("value")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Voce di cache illeggibile {key[:12]}: {e}")
+        return None
+    if cache_put(key, value, cache_dir):
+        try:
+            os.remove(legacy_path)
+        except OSError:
+            pass
+    return value
+
+def cache_put(key, value, cache_dir=None):
+    """Aggiunge il valore all'archivio della cache (scritto a blocchi compressi)"""
+    try:
+        _store(cache_dir).put(key, json.dumps(value, ensure_ascii=False))
+        return True
+    except (OSError, ValueError) as e:
+        logger.warning(f"Impossibile scrivere la cache {key[:12]}: {e}")
+        return False
+
+def cache_stats(cache_dir=None):
+    """Record, occupazione, rapporto di compressione e velocità di lettura/scrittura della cache"""
+    return _store(cache_dir).file_stats()
+
+def compact_cache(cache_dir=None, min_garbage_ratio=0.0):
+    """
+    Elimina dall'archivio le risposte sostituite se sono almeno min_garbage_ratio dei dati;
+    restituisce i byte liberati.
+    """
+    store = _store(cache_dir)
+    if store.file_stats()["garbage_ratio"] < min_garbage_ratio:
+        return 0
+    return store.compact()
+
+def close_cache(cache_dir=None):
+    """Scrive le risposte in attesa e chiude l'archivio della cache"""
+    _store(cache_dir).close()
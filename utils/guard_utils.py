@@ -0,0 +1,159 @@
+import re
+import numpy as np
+
+# Chunk sotto questa energia RMS (circa -46 dBFS) non vengono nemmeno decodificati
+SILENCE_RMS_THRESHOLD = 0.005
+
+# Stessa regola di Whisper per i segmenti senza parlato
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+
+# Oltre questo rapporto di compressione il testo è quasi certamente un ciclo di ripetizioni
+COMPRESSION_RATIO_THRESHOLD = 2.4
+
+# Un n-gramma (fino a MAX_NGRAM parole) ripetuto più di MAX_REPEATS volte di fila è un ciclo
+MAX_REPEATS = 4
+MAX_NGRAM = 8
+
+# Ridecodifica dei soli chunk in cui il filtro trova cicli: niente fallback di temperatura
+# e niente condizionamento sul testo precedente, che è ciò che alimenta il ciclo.
+# Gli altri chunk usano le opzioni predefinite di Whisper
+GUARD_DECODE_OPTIONS = {
+    "temperature": 0.0,
+    "condition_on_previous_text": False,
+}
+
+_WORD_RE = re.compile(r"\S+")
+_PUNCT_RE = re.compile(r"[^\w]+")
+
+def new_guard_stats():
+    """Contatori degli interventi del filtro"""
+    return {
+        "silent_chunks": 0,
+        "no_speech_segments": 0,
+        "truncated_segments": 0,
+        "repetitive_segments": 0,
+        "dropped_chunks": 0,
+        "redecoded_chunks": 0,
+    }
+
+def _count(stats, key):
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + 1
+
+def is_silent_chunk(audio, threshold=SILENCE_RMS_THRESHOLD):
+    """True se il chunk (float32 in [-1, 1]) non contiene energia sufficiente per del parlato"""
+    if len(audio) == 0:
+        return True
+    # Un campione ogni 4 basta per la stima dell'energia
+    sample = np.asarray(audio[::4], dtype=np.float32)
+    return float(np.sqrt(np.mean(np.square(sample)))) < threshold
+
+def find_repetition(text, max_repeats=MAX_REPEATS, max_ngram=MAX_NGRAM):
+    """
+    Cerca un n-gramma ripetuto più di max_repeats volte consecutive (ignorando maiuscole e punteggiatura).
+    Restituisce la posizione nel testo subito dopo la prima occorrenza, None se non ci sono cicli.
+    """
+    spans = [match.span() for match in _WORD_RE.finditer(text)]
+    words = [_PUNCT_RE.sub("", text[start:end].lower()) for start, end in spans]
+    total = len(words)
+    for i in range(total):
+        for n in range(1, max_ngram + 1):
+            if i + n * (max_repeats + 1) > total:
+                break
+            gram = words[i:i + n]
+            if not any(gram):
+                continue
+            repeats = 1
+            j = i + n
+            while words[j:j + n] == gram:
+                repeats += 1
+                j += n
+            if repeats > max_repeats:
+                return spans[i + n - 1][1]
+    return None
+
+def truncate_repetition(text, max_repeats=MAX_REPEATS, max_ngram=MAX_NGRAM):
+    """Tronca il testo alla prima occorrenza del ciclo; restituisce (testo, troncato)"""
+    cut = find_repetition(text, max_repeats, max_ngram)
+    if cut is None:
+        return text, False
+    return text[:cut], True
+
+def _is_no_speech(segment):
+    return (
+        segment.get("no_speech_prob", 0.0) > NO_SPEECH_THRESHOLD
+        and segment.get("avg_logprob", 0.0) < LOGPROB_THRESHOLD
+    )
+
+def _collapse_repeated_segments(segments, stats=None):
+    """Cicli su più segmenti ("Grazie." in ogni segmento): di una serie troppo lunga resta il primo"""
+    collapsed = []
+    run = []
+    for segment in segments + [None]:
+        key = _PUNCT_RE.sub("", segment["text"].lower()) if segment else None
+        if run and key == _PUNCT_RE.sub("", run[0]["text"].lower()):
+            run.append(segment)
+            continue
+        if len(run) > MAX_REPEATS:
+            _count(stats, "truncated_segments")
+            run = run[:1]
+        collapsed.extend(run)
+        run = [segment] if segment else []
+    return collapsed
+
+def guard_result(result, stats=None):
+    """
+    Filtra il risultato di un chunk (formato ASRBackend): scarta i segmenti senza parlato,
+    tronca i cicli di ripetizione, scarta i segmenti ripetitivi senza un ciclo riconoscibile
+    e le ripetizioni dello stesso segmento. Restituisce il risultato filtrato o None se non resta testo.
+    """
+    kept = []
+    for segment in result.get("segments") or []:
+        if _is_no_speech(segment):
+            _count(stats, "no_speech_segments")
+            continue
+        text, truncated = truncate_repetition(segment["text"])
+        if truncated:
+            _count(stats, "truncated_segments")
+        elif segment.get("compression_ratio", 0.0) > COMPRESSION_RATIO_THRESHOLD:
+            _count(stats, "repetitive_segments")
+            continue
+        kept.append(dict(segment, text=text))
+    kept = _collapse_repeated_segments(kept, stats)
+
+    if result.get("segments"):
+        text = "".join(segment["text"] for segment in kept)
+    else:
+        text, truncated = truncate_repetition(result.get("text", ""))
+        if truncated:
+            _count(stats, "truncated_segments")
+
+    if not text.strip():
+        _count(stats, "dropped_chunks")
+        return None
+    return dict(result, text=text, segments=kept)
+
+def guard_transcription(result, redecode, stats=None):
+    """
+    Filtra il risultato di un chunk decodificato con le opzioni predefinite. Se il filtro trova
+    cicli di ripetizione il chunk viene ridecodificato una volta con redecode(**GUARD_DECODE_OPTIONS)
+    e filtrato di nuovo; se la ridecodifica fallisce o non lascia testo resta il primo risultato filtrato.
+    Restituisce il risultato filtrato o None se non resta testo.
+    """
+    first_stats = new_guard_stats()
+    guarded = guard_result(result, first_stats)
+    if first_stats["truncated_segments"] or first_stats["repetitive_segments"]:
+        retry_stats = new_guard_stats()
+        try:
+            retry = guard_result(redecode(**GUARD_DECODE_OPTIONS), retry_stats)
+        except Exception as e:
+            print(f"⚠️ Ridecodifica del chunk fallita: {e}")
+            retry = None
+        if retry is not None:
+            guarded, first_stats = retry, retry_stats
+        _count(stats, "redecoded_chunks")
+    if stats is not None:
+        for key, value in first_stats.items():
+            stats[key] = stats.get(key, 0) + value
+    return guarded
@@ -0,0 +1,284 @@
+import os
+import time
+import hashlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils.audio_utils import TARGET_SAMPLE_RATE, stream_normalized_pcm
+from utils.wav_utils import read_wav_header, wav_dtype, WavFormatError
+from utils.resample_utils import resample_audio
+from utils.guard_utils import is_silent_chunk, guard_transcription, new_guard_stats
+from utils.reformulate_utils import reformulate_transcription
+
+# Finestra trascritta appena completa: la latenza parlato-testo è circa questa più il tempo di decodifica
+LIVE_CHUNK_SECONDS = 15
+# Intervallo di controllo della crescita del file e durata dei blocchi letti dallo stream
+LIVE_POLL_SECONDS = 0.5
+LIVE_BLOCK_SECONDS = 1.0
+# Senza nuovi dati per questo tempo la registrazione è considerata conclusa
+LIVE_IDLE_TIMEOUT = 30.0
+# Coda minima trascritta alla chiusura (sotto questa durata Whisper produce quasi solo allucinazioni)
+MIN_FLUSH_SECONDS = 1.0
+# Caratteri finali della trascrizione passati come prompt alla finestra successiva
+LIVE_PROMPT_CHARS = 200
+# Testo accumulato prima di generare gli appunti di un blocco (come split_chunks)
+LIVE_NOTES_CHARS = 1500
+
+def tail_wav(path, poll_interval=LIVE_POLL_SECONDS, idle_timeout=LIVE_IDLE_TIMEOUT, stop_event=None,
+             block_seconds=LIVE_BLOCK_SECONDS):
+    """
+    Segue un WAV in crescita (registratore in corso) e restituisce (sample rate, frame) dei dati nuovi.
+    L'header viene riletto a ogni controllo: funziona sia con dimensione provvisoria (0 o 0xFFFFFFFF)
+    sia con header aggiornato periodicamente. Termina dopo idle_timeout secondi senza dati nuovi
+    o quando stop_event è impostato.
+    """
+    position = 0
+    last_growth = time.monotonic()
+    header = None
+    while stop_event is None or not stop_event.is_set():
+        try:
+            header = read_wav_header(path)
+            dtype = wav_dtype(header)
+        except (OSError, WavFormatError):
+            # File non ancora creato o header incompleto
+            header = None
+        if header is not None:
+            channels = header["channels"]
+            frame_bytes = dtype.itemsize * channels
+            frames = header["data_size"] // frame_bytes
+            max_frames = max(1, int(block_seconds * header["sample_rate"]))
+            if frames > position:
+                with open(path, "rb") as f:
+                    while position < frames:
+                        count = min(max_frames, frames - position)
+                        f.seek(header["data_offset"] + position * frame_bytes)
+                        data = f.read(count * frame_bytes)
+                        count = len(data) // frame_bytes
+                        if count == 0:
+                            break
+                        samples = np.frombuffer(data[:count * frame_bytes], dtype=dtype)
+                        if channels > 1:
+                            samples = samples.reshape(-1, channels)
+                        position += count
+                        yield header["sample_rate"], samples
+                last_growth = time.monotonic()
+                continue
+        if time.monotonic() - last_growth >= idle_timeout:
+            print(f"⏹️ Nessun dato nuovo da {idle_timeout:.0f}s: registrazione conclusa")
+            return
+        time.sleep(poll_interval)
+
+def read_pcm_stream(stream, sample_rate=TARGET_SAMPLE_RATE, channels=1, dtype="<i2",
+                    block_seconds=LIVE_BLOCK_SECONDS):
+    """
+    Legge PCM grezzo (es. stdin da arecord o ffmpeg -f s16le) a blocchi di block_seconds
+    e restituisce (sample rate, frame) fino alla fine dello stream.
+    """
+    dtype = np.dtype(dtype)
+    frame_bytes = dtype.itemsize * channels
+    block_bytes = max(1, int(block_seconds * sample_rate)) * frame_bytes
+    pending = b""
+    while True:
+        data = stream.read(block_bytes)
+        if not data:
+            break
+        pending += data
+        usable = len(pending) - len(pending) % frame_bytes
+        if usable:
+            samples = np.frombuffer(pending[:usable], dtype=dtype)
+            pending = pending[usable:]
+            yield sample_rate, samples.reshape(-1, channels) if channels > 1 else samples
+
+class LiveTranscriber:
+    """
+    Trascrizione incrementale di un flusso audio: i frame arrivano a blocchi con feed() e ogni
+    finestra completa di chunk_duration secondi viene trascritta subito, con la parte finale del
+    testo già trascritto come prompt (continuità di termini, nomi e punteggiatura tra le finestre).
+    on_text(voce) riceve ogni finestra trascritta: indice, inizio e fine in secondi, testo e ritardo
+    tra l'arrivo dell'ultimo campione della finestra e il testo.
+    """
+
+    def __init__(self, asr, language="it", chunk_duration=LIVE_CHUNK_SECONDS, guard=True, on_text=None,
+                 prompt_chars=LIVE_PROMPT_CHARS):
+        self.asr = asr
+        self.language = None if language in (None, "auto") else language
+        self.language_probability = None
+        self.chunk_duration = chunk_duration
+        self.guard = guard
+        self.on_text = on_text
+        self.prompt_chars = prompt_chars
+        self.guard_stats = new_guard_stats()
+        self.entries = []
+        self.sample_rate = None
+        self.blocks = []
+        self.buffered = 0
+        self.offset = 0.0
+        self.processing_time = 0.0
+        self.max_lag = 0.0
+        # Hash dell'audio ricevuto: chiave della lezione nell'archivio come per gli upload
+        self.digest = hashlib.sha256()
+
+    @property
+    def text(self):
+        return "\n\n".join(entry["text"] for entry in self.entries if entry["text"])
+
+    @property
+    def segments(self):
+        """Finestre trascritte come segmenti con tempi assoluti (per l'archivio)"""
+        return [
+            {"start": entry["start"], "end": entry["end"], "text": entry["text"]}
+            for entry in self.entries if entry["text"]
+        ]
+
+    @property
+    def duration(self):
+        """Secondi di audio trascritti finora"""
+        return self.offset
+
+    def _prompt(self):
+        """Ultimi caratteri del testo, tagliati a inizio parola"""
+        text = " ".join(self.text.split())[-self.prompt_chars:]
+        if len(text) == self.prompt_chars and " " in text:
+            text = text.split(" ", 1)[1]
+        return text or None
+
+    def feed(self, sample_rate, samples):
+        """Aggiunge frame al buffer e trascrive le finestre completate"""
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+        elif sample_rate != self.sample_rate:
+            raise ValueError(f"Frequenza cambiata durante lo stream: {self.sample_rate} -> {sample_rate}")
+        arrived = time.monotonic()
+        self.digest.update(samples.tobytes())
+        self.blocks.append(samples)
+        self.buffered += len(samples)
+        window = int(self.chunk_duration * self.sample_rate)
+        while self.buffered >= window:
+            self._transcribe_window(self._take(window), arrived)
+
+    def flush(self):
+        """Trascrive l'audio rimasto nel buffer a fine stream"""
+        if self.sample_rate and self.buffered >= MIN_FLUSH_SECONDS * self.sample_rate:
+            self._transcribe_window(self._take(self.buffered), time.monotonic())
+        self.blocks, self.buffered = [], 0
+        return self.text
+
+    def _take(self, count):
+        data = np.concatenate(self.blocks) if len(self.blocks) > 1 else self.blocks[0]
+        self.blocks = [data[count:]] if len(data) > count else []
+        self.buffered = len(data) - count if len(data) > count else 0
+        return data[:count]
+
+    def _transcribe_window(self, frames, arrived):
+        start = self.offset
+        self.offset += len(frames) / self.sample_rate
+        audio = resample_audio(frames, self.sample_rate, TARGET_SAMPLE_RATE)
+        began = time.monotonic()
+        text = ""
+        if self.guard and is_silent_chunk(audio):
+            self.guard_stats["silent_chunks"] += 1
+        else:
+            if self.language is None:
+                # Lingua rilevata una volta sulla prima finestra di parlato e usata per le successive
+                detected, probability = self.asr.detect_language([audio])
+                if detected:
+                    self.language, self.language_probability = detected, probability
+                    print(f"🌐 Lingua rilevata: {detected} ({probability:.0%})")
+            options = {}
+            prompt = self._prompt()
+            if prompt:
+                options["initial_prompt"] = prompt
+            try:
+                result = self.asr.transcribe(audio, language=self.language, **options)
+                if self.guard:
+                    # Ridecodifica senza prompt: il contesto precedente può alimentare il ciclo
+                    result = guard_transcription(
+                        result,
+                        lambda **retry: self.asr.transcribe(audio, language=self.language, **retry),
+                        self.guard_stats
+                    )
+                text = result.get("text", "").strip() if result else ""
+            except Exception as e:
+                print(f"❌ Errore trascrizione finestra {len(self.entries) + 1}: {e}")
+        now = time.monotonic()
+        self.processing_time += now - began
+        lag = now - arrived
+        self.max_lag = max(self.max_lag, lag)
+        entry = {"index": len(self.entries), "start": start, "end": self.offset, "text": text, "lag": lag}
+        self.entries.append(entry)
+        if now - began > self.chunk_duration:
+            # Decodifica più lenta del tempo reale: il ritardo cresce a ogni finestra
+            print(f"⚠️ Finestra trascritta in {now - began:.1f}s (> {self.chunk_duration}s): usa un modello più piccolo")
+        if self.on_text:
+            self.on_text(entry)
+        return entry
+
+class LiveNotes:
+    """
+    Appunti incrementali: il testo trascritto si accumula e ogni LIVE_NOTES_CHARS caratteri
+    (tagliati a fine frase) il blocco viene riformulato in un thread separato, così la trascrizione
+    non attende il modello. on_notes(testo del blocco, appunti) riceve i blocchi in ordine.
+    """
+
+    def __init__(self, formal_level="Medio", use_sections=False, block_chars=LIVE_NOTES_CHARS, on_notes=None):
+        self.formal_level = formal_level
+        self.use_sections = use_sections
+        self.block_chars = block_chars
+        self.on_notes = on_notes
+        self.pending_text = ""
+        self.futures = []
+        self.blocks = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="live-notes")
+
+    def add_text(self, text):
+        """Aggiunge testo trascritto; avvia gli appunti dei blocchi completati"""
+        if text:
+            self.pending_text = f"{self.pending_text} {text}".strip()
+        while len(self.pending_text) >= self.block_chars:
+            # Taglio all'ultima fine frase del blocco (o al limite se non ce n'è una)
+            cut = max(self.pending_text.rfind(mark, 0, self.block_chars) for mark in (". ", "? ", "! "))
+            cut = cut + 1 if cut > self.block_chars // 2 else self.block_chars
+            self._submit(self.pending_text[:cut].strip())
+            self.pending_text = self.pending_text[cut:].strip()
+        self.drain()
+
+    def _submit(self, block):
+        self.futures.append((block, self.executor.submit(
+            reformulate_transcription, block, formal_level=self.formal_level, use_sections=self.use_sections
+        )))
+
+    def drain(self, wait=False):
+        """Consegna in ordine gli appunti dei blocchi completati (wait=True attende tutti)"""
+        while self.futures and (wait or self.futures[0][1].done()):
+            block, future = self.futures.pop(0)
+            try:
+                notes, _ = future.result()
+            except Exception as e:
+                print(f"❌ Errore appunti: {e}")
+                notes = ""
+            self.blocks.append((block, notes))
+            if self.on_notes:
+                self.on_notes(block, notes)
+
+    def close(self):
+        """Riformula il testo rimasto e attende tutti i blocchi"""
+        if self.pending_text.strip():
+            self._submit(self.pending_text.strip())
+            self.pending_text = ""
+        self.drain(wait=True)
+        self.executor.shutdown()
+        return "\n\n".join(notes for _, notes in self.blocks if notes)
+
+def open_live_source(source, sample_rate=TARGET_SAMPLE_RATE, channels=1, poll_interval=LIVE_POLL_SECONDS,
+                     idle_timeout=LIVE_IDLE_TIMEOUT, stdin=None):
+    """
+    Sorgente live: "-" legge PCM 16 bit grezzo da stdin, un WAV viene seguito mentre cresce,
+    ogni altro file o URL (MP3, M4A, video, rtmp://...) è decodificato da FFmpeg in streaming
+    in PCM mono 16 kHz, senza file intermedi. Restituisce un generatore di (sample rate, frame).
+    """
+    if source == "-":
+        return read_pcm_stream(stdin, sample_rate=sample_rate, channels=channels)
+    if not source.lower().endswith(".wav"):
+        return ((TARGET_SAMPLE_RATE, block) for block in stream_normalized_pcm(source, LIVE_BLOCK_SECONDS))
+    if not os.path.exists(source):
+        print(f"⏳ In attesa che {source} venga creato...")
+    return tail_wav(source, poll_interval=poll_interval, idle_timeout=idle_timeout)
@@ -0,0 +1,264 @@
+import time
+import threading
+from collections import deque
+
+# Finestra della velocità mobile (unità al secondo misurate negli ultimi secondi)
+ROLLING_WINDOW_SECONDS = 30.0
+# Intervallo minimo tra due aggiornamenti dell'interfaccia
+DEFAULT_UPDATE_INTERVAL = 0.5
+# Campioni della velocità: al massimo uno ogni tanti secondi (advance resta economico nei cicli stretti)
+SAMPLE_INTERVAL = 0.1
+
+# Fasi del job e unità di avanzamento
+TRANSCRIPTION_STAGE = "transcription"
+NOTES_STAGE = "notes"
+AUDIO_UNIT = "s"
+TOKEN_UNIT = "token"
+
+# Stima dei token di appunti per secondo di audio, prima che il piano dei blocchi sia noto
+NOTES_TOKENS_PER_AUDIO_SECOND = 3.0
+# Caratteri per token nelle stime dei token attesi da un blocco di testo
+CHARS_PER_TOKEN = 4
+
+# Ultima velocità misurata per fase nel processo: stima l'ETA delle fasi non ancora iniziate
+_RATE_HISTORY = {}
+_RATE_HISTORY_LOCK = threading.Lock()
+
+def format_duration(seconds):
+    """Durata leggibile (es. 45s, 3m20s, 1h05m); -- se sconosciuta"""
+    if seconds is None:
+        return "--"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
+
+def estimate_tokens(text):
+    """Token attesi per riscrivere un testo di pari lunghezza"""
+    return max(1, len(text or "") // CHARS_PER_TOKEN)
+
+class _Stage:
+    def __init__(self, name, total, unit):
+        self.name = name
+        self.total = float(total or 0)
+        self.unit = unit
+        self.done = 0.0
+        # Unità misurate (lavoro reale): le unità saltate (cache, silenzio) non entrano nella velocità
+        self.measured = 0.0
+        self.started = None
+        self.finished = None
+        self.samples = deque()
+
+    def rate(self, now):
+        """Velocità mobile in unità misurate al secondo, None se non ancora stimabile"""
+        while len(self.samples) > 2 and now - self.samples[1][0] > ROLLING_WINDOW_SECONDS:
+            self.samples.popleft()
+        if len(self.samples) >= 2:
+            (t0, m0), (t1, m1) = self.samples[0], self.samples[-1]
+            if t1 - t0 >= 1.0 and m1 > m0:
+                return (m1 - m0) / (t1 - t0)
+        if self.started is not None and self.measured > 0:
+            elapsed = (self.finished or now) - self.started
+            if elapsed > 0:
+                return self.measured / elapsed
+        return None
+
+class ProgressItem:
+    """
+    Unità di lavoro di una fase con una stima (es. i token attesi da un blocco):
+    l'avanzamento reale viene contato man mano e alla chiusura la differenza con la stima
+    viene riconciliata, così la fase arriva al 100% anche se la stima era sbagliata.
+    """
+
+    def __init__(self, tracker, stage, estimate):
+        self.tracker = tracker
+        self.stage = stage
+        self.estimate = estimate
+        self.done = 0
+
+    def advance(self, amount=1):
+        # Oltre la stima l'avanzamento allunga il totale della fase
+        overflow = max(0, self.done + amount - max(self.estimate, self.done))
+        self.done += amount
+        if overflow:
+            self.tracker.add_total(self.stage, overflow)
+        self.tracker.advance(self.stage, amount)
+
+    def poll(self):
+        self.tracker.poll()
+
+    def close(self, measured=False):
+        """Porta l'unità alla sua stima (lavoro non misurato: cache, errore, testo invariato)"""
+        if self.done < self.estimate:
+            self.tracker.advance(self.stage, self.estimate - self.done, measured=measured)
+            self.done = self.estimate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class ProgressTracker:
+    """
+    Avanzamento di un job a fasi (es. secondi di audio trascritti, token di appunti generati):
+    velocità mobile per fase, fattore tempo reale (RTF), ETA della fase e complessiva.
+    advance è thread-safe e costa poco; on_update(snapshot) è chiamata al massimo ogni
+    update_interval secondi e solo nel thread che ha creato il tracker (sicuro per Streamlit):
+    gli avanzamenti dagli altri thread vengono mostrati al successivo poll o advance di quel thread.
+    """
+
+    def __init__(self, on_update=None, update_interval=DEFAULT_UPDATE_INTERVAL):
+        self.on_update = on_update
+        self.update_interval = update_interval
+        self.stages = {}
+        self.order = []
+        self.current = None
+        self.created = time.monotonic()
+        self._lock = threading.Lock()
+        self._owner = threading.get_ident()
+        self._last_update = 0.0
+        self._dirty = False
+
+    def plan(self, name, total, unit):
+        """Dichiara una fase futura con il suo totale stimato (serve all'ETA complessiva)"""
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = _Stage(name, total, unit)
+                self.order.append(name)
+            else:
+                self.stages[name].total = float(total or 0)
+                self.stages[name].unit = unit
+        return self
+
+    def start_stage(self, name, total=None, unit=None):
+        """Inizia una fase (pianificata o nuova); total None mantiene la stima del piano"""
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = _Stage(name, total, unit)
+                self.stages[name] = stage
+                self.order.append(name)
+            if total is not None:
+                stage.total = float(total)
+            if unit is not None:
+                stage.unit = unit
+            stage.started = time.monotonic()
+            stage.samples.append((stage.started, stage.measured))
+            self.current = name
+        self._notify(force=True)
+
+    def set_total(self, name, total):
+        with self._lock:
+            if name in self.stages:
+                self.stages[name].total = float(total)
+
+    def add_total(self, name, amount):
+        with self._lock:
+            if name in self.stages:
+                self.stages[name].total += amount
+
+    def advance(self, name, amount=1, measured=True):
+        """Aggiunge lavoro completato alla fase; measured=False per il lavoro saltato"""
+        now = time.monotonic()
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                return
+            stage.done += amount
+            if measured:
+                stage.measured += amount
+            if not stage.samples or now - stage.samples[-1][0] >= SAMPLE_INTERVAL:
+                stage.samples.append((now, stage.measured))
+            self._dirty = True
+        self._notify()
+
+    def item(self, name, estimate):
+        """Unità di lavoro con stima da riconciliare (vedi ProgressItem)"""
+        return ProgressItem(self, name, estimate)
+
+    def finish_stage(self, name):
+        now = time.monotonic()
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                return
+            stage.finished = now
+            # Fase conclusa: eventuali stime in eccesso o in difetto non contano più
+            stage.total = stage.done = max(stage.total, stage.done)
+            rate = stage.rate(now)
+            if rate:
+                with _RATE_HISTORY_LOCK:
+                    _RATE_HISTORY[(name, stage.unit)] = rate
+        self._notify(force=True)
+
+    def poll(self):
+        """Mostra gli avanzamenti arrivati da altri thread (da chiamare nei cicli di attesa)"""
+        if self._dirty:
+            self._notify()
+
+    def _stage_eta(self, stage, now):
+        remaining = max(0.0, stage.total - stage.done)
+        if stage.finished is not None or remaining == 0:
+            return 0.0
+        rate = stage.rate(now)
+        if rate is None:
+            with _RATE_HISTORY_LOCK:
+                rate = _RATE_HISTORY.get((stage.name, stage.unit))
+        return remaining / rate if rate else None
+
+    def snapshot(self):
+        """Stato corrente: fase, avanzamento, velocità, RTF ed ETA (fase e complessiva)"""
+        now = time.monotonic()
+        with self._lock:
+            stage = self.stages.get(self.current)
+            etas = [self._stage_eta(self.stages[name], now) for name in self.order]
+            eta = None if any(value is None for value in etas) else sum(etas)
+            snapshot = {
+                "stage": self.current,
+                "elapsed": now - self.created,
+                "eta": eta,
+                "stages": {
+                    name: {
+                        "done": self.stages[name].done,
+                        "total": self.stages[name].total,
+                        "unit": self.stages[name].unit,
+                        "finished": self.stages[name].finished is not None,
+                    }
+                    for name in self.order
+                },
+            }
+            if stage is not None:
+                rate = stage.rate(now)
+                snapshot.update({
+                    "done": stage.done,
+                    "total": stage.total,
+                    "unit": stage.unit,
+                    "fraction": min(1.0, stage.done / stage.total) if stage.total else 0.0,
+                    "rate": rate,
+                    # Secondi di elaborazione per unità: per l'audio è il fattore tempo reale
+                    "rtf": 1 / rate if rate else None,
+                    "stage_eta": self._stage_eta(stage, now),
+                })
+        # Avanzamento complessivo in tempo: trascorso su trascorso più rimanente
+        if eta is not None:
+            snapshot["overall_fraction"] = snapshot["elapsed"] / (snapshot["elapsed"] + eta) if eta else 1.0
+        else:
+            fractions = [min(1.0, s["done"] / s["total"]) if s["total"] else 0.0 for s in snapshot["stages"].values()]
+            snapshot["overall_fraction"] = sum(fractions) / len(fractions) if fractions else 0.0
+        return snapshot
+
+    def _notify(self, force=False):
+        if self.on_update is None or threading.get_ident() != self._owner:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_update < self.update_interval:
+            return
+        self._last_update = now
+        self._dirty = False
+        self.on_update(self.snapshot())
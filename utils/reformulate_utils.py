@@ -1,17 +1,56 @@
+import os
 import requests
 import json
 import re
 import time
+import random
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.cache_utils import cache_key, cache_get, cache_put
+from utils.progress_utils import NOTES_STAGE, TOKEN_UNIT, estimate_tokens
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configurazione Ollama
-OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = "mistral:7b"
 
+# Scadenze e tentativi: la scadenza è verificata durante lo streaming, non a risposta ricevuta
+REQUEST_TIMEOUT = 60
+CONNECT_TIMEOUT = 5
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 8.0
+
+# Richieste duplicate (hedging): ritardo fisso finché non ci sono abbastanza latenze misurate
+HEDGE_AFTER_SECONDS = 20.0
+HEDGE_MIN_SAMPLES = 5
+_RECENT_LATENCIES = deque(maxlen=50)
+
+# Pianificazione dei chunk: sotto MIN_CHUNK_CHARS un chunk viene unito al vicino,
+# sotto MIN_MEANINGFUL_WORDS parole significative non vale una chiamata al modello
+MIN_CHUNK_CHARS = 300
+MIN_MEANINGFUL_WORDS = 5
+_MEANINGFUL_WORD_RE = re.compile(r"[^\W\d_]{3,}")
+
+# Modalità gerarchica: chiamate parallele al modello e appunti uniti a gruppi di REDUCE_FAN_IN
+LLM_MAX_WORKERS = int(os.environ.get("LLM_MAX_WORKERS", "2"))
+REDUCE_FAN_IN = 4
+REDUCE_NUM_CTX = 8192
+
+# Protegge i contatori condivisi tra i thread della modalità gerarchica
+_STATS_LOCK = threading.Lock()
+
+# Token massimi per chiamata: appunti di un blocco e riassunti
+CHUNK_MAX_TOKENS = 800
+REDUCE_MAX_TOKENS = 1000
+# Attesa massima tra due aggiornamenti dell'avanzamento mentre i worker lavorano
+PROGRESS_POLL_SECONDS = 0.5
+
 def check_ollama_available():
     """Verifica se Ollama è disponibile e il modello è caricato"""
     try:
@@ -34,41 +73,227 @@ def check_ollama_available():
     except Exception as e:
         return False, f"Errore verifica Ollama: {str(e)}"
 
-def call_ollama(prompt, max_tokens=1000, temperature=0.7):
-    """Chiama Ollama API per la generazione del testo"""
+class OllamaDeadlineExceeded(Exception):
+    """Eccezione per richieste Ollama oltre la scadenza"""
+    pass
+
+class _RetryableError(Exception):
+    """Errore transitorio (connessione, 5xx, 429): la richiesta può essere ripetuta"""
+    pass
+
+def _bump(stats, key, amount=1):
+    if stats is not None:
+        with _STATS_LOCK:
+            stats[key] = stats.get(key, 0) + amount
+
+def hedge_delay():
+    """Ritardo prima della richiesta duplicata: p90 delle latenze recenti (o il valore fisso)"""
+    with _STATS_LOCK:
+        latencies = sorted(_RECENT_LATENCIES)
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return HEDGE_AFTER_SECONDS
+    return latencies[int(0.9 * (len(latencies) - 1))]
+
+def _close_attempt(attempt):
+    """Interrompe un tentativo in corso chiudendo la sua connessione"""
+    attempt["cancelled"].set()
+    response = attempt.get("response")
+    if response is not None:
+        try:
+            response.close()
+        except Exception:
+            pass
+
+def _stream_generate(payload, deadline, attempt, progress=None):
+    """
+    Richiesta in streaming: il testo arriva riga per riga e la scadenza è verificata a ogni riga.
+    Un timer chiude la connessione alla scadenza anche se il server non invia nulla.
+    progress riceve un avanzamento per ogni token ricevuto.
+    Restituisce il testo, None se il tentativo è stato annullato.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise OllamaDeadlineExceeded()
     try:
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "num_predict": max_tokens,
-                "top_p": 0.9,
-                "top_k": 40
-            }
-        }
-        
         response = requests.post(
             f"{OLLAMA_BASE_URL}/api/generate",
             json=payload,
-            timeout=120  # 2 minuti timeout
+            stream=True,
+            timeout=(min(CONNECT_TIMEOUT, remaining), remaining)
         )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get("response", "").strip()
-        else:
+    except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+        raise _RetryableError(str(e))
+    except requests.exceptions.ReadTimeout:
+        raise OllamaDeadlineExceeded()
+    
+    attempt["response"] = response
+    watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), response.close)
+    watchdog.daemon = True
+    watchdog.start()
+    try:
+        if response.status_code == 429 or response.status_code >= 500:
+            raise _RetryableError(f"{response.status_code} - {response.text[:200]}")
+        if response.status_code != 200:
             logger.error(f"Errore API Ollama: {response.status_code} - {response.text}")
             return None
-            
-    except requests.exceptions.Timeout:
-        logger.error("Timeout chiamata Ollama")
+        
+        parts = []
+        for line in response.iter_lines(chunk_size=None):
+            if attempt["cancelled"].is_set():
+                return None
+            if time.monotonic() > deadline:
+                raise OllamaDeadlineExceeded()
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise _RetryableError(data["error"])
+            parts.append(data.get("response", ""))
+            if progress is not None and data.get("response"):
+                progress.advance(1)
+            if data.get("done"):
+                return "".join(parts).strip()
+        # Flusso interrotto prima di "done": chiusura per scadenza, annullamento o errore di rete
+        if attempt["cancelled"].is_set():
+            return None
+        if time.monotonic() >= deadline:
+            raise OllamaDeadlineExceeded()
+        raise _RetryableError("Risposta in streaming incompleta")
+    except (requests.exceptions.RequestException, AttributeError, ValueError) as e:
+        # La chiusura dal timer o dalla richiesta duplicata interrompe la lettura
+        if attempt["cancelled"].is_set():
+            return None
+        if time.monotonic() >= deadline:
+            raise OllamaDeadlineExceeded()
+        raise _RetryableError(str(e))
+    finally:
+        watchdog.cancel()
+        response.close()
+
+def _generate_with_retries(payload, deadline, attempt, stats=None, progress=None):
+    """Ripete la richiesta sugli errori transitori con backoff esponenziale, entro la scadenza"""
+    for retry in range(MAX_RETRIES + 1):
+        try:
+            return _stream_generate(payload, deadline, attempt, progress)
+        except _RetryableError as e:
+            if attempt["cancelled"].is_set():
+                return None
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** retry) * random.uniform(0.5, 1.0)
+            if retry == MAX_RETRIES or time.monotonic() + delay >= deadline:
+                logger.error(f"Errore chiamata Ollama (tentativi esauriti): {e}")
+                return None
+            logger.warning(f"Errore transitorio Ollama, nuovo tentativo tra {delay:.1f}s: {e}")
+            _bump(stats, "retries")
+            if attempt["cancelled"].wait(delay):
+                return None
+    return None
+
+def call_ollama(prompt, max_tokens=1000, temperature=0.7, num_ctx=None, deadline=None, hedge=False, stats=None,
+                progress=None):
+    """
+    Chiama Ollama API per la generazione del testo, in streaming.
+    deadline è l'istante limite (time.monotonic()); di default REQUEST_TIMEOUT secondi da ora.
+    Con hedge=True, se la risposta tarda oltre hedge_delay() parte una richiesta duplicata
+    e vince la prima che termina (l'altra viene chiusa).
+    progress (es. ProgressItem) riceve i token man mano che arrivano.
+    Restituisce None in caso di errore o scadenza.
+    """
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": True,
+        "options": {
+            "temperature": temperature,
+            "num_predict": max_tokens,
+            "top_p": 0.9,
+            "top_k": 40
+        }
+    }
+    if num_ctx:
+        payload["options"]["num_ctx"] = num_ctx
+    
+    request_deadline = time.monotonic() + REQUEST_TIMEOUT
+    deadline = min(deadline, request_deadline) if deadline else request_deadline
+    start_time = time.monotonic()
+    attempts = [{"cancelled": threading.Event()}]
+    
+    try:
+        if not hedge:
+            result = _generate_with_retries(payload, deadline, attempts[0], stats, progress)
+        else:
+            # Tentativo principale e, se in ritardo, un duplicato: vince il primo risultato valido
+            executor = ThreadPoolExecutor(max_workers=2)
+            try:
+                futures = {executor.submit(_generate_with_retries, payload, deadline, attempts[0], stats, progress): 0}
+                result = None
+                delay = min(hedge_delay(), max(0.0, deadline - time.monotonic()))
+                done, _ = wait(futures, timeout=delay)
+                if not done:
+                    attempts.append({"cancelled": threading.Event()})
+                    # I token del duplicato non contano: l'avanzamento segue la richiesta principale
+                    futures[executor.submit(_generate_with_retries, payload, deadline, attempts[1], stats)] = 1
+                    _bump(stats, "hedged_requests")
+                    logger.info(f"Richiesta lenta dopo {delay:.1f}s: invio richiesta duplicata")
+                pending = set(futures)
+                while pending and not result:
+                    done, pending = wait(pending, timeout=PROGRESS_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                    if progress is not None:
+                        progress.poll()
+                    for future in done:
+                        try:
+                            result = future.result()
+                        except OllamaDeadlineExceeded:
+                            result = None
+                        except Exception as e:
+                            # Un tentativo fallito non interrompe l'altro ancora in corso
+                            logger.warning(f"Tentativo {futures[future] + 1} fallito: {e}")
+                            result = None
+                        if result:
+                            if futures[future] == 1:
+                                _bump(stats, "hedge_wins")
+                            break
+            finally:
+                # Chiude i tentativi ancora in corso senza attenderli:
+                # una connessione ancora in apertura termina da sola alla scadenza
+                for attempt in attempts:
+                    _close_attempt(attempt)
+                executor.shutdown(wait=False)
+            if not result and time.monotonic() >= deadline:
+                raise OllamaDeadlineExceeded()
+        
+        if result:
+            with _STATS_LOCK:
+                _RECENT_LATENCIES.append(time.monotonic() - start_time)
+        return result
+        
+    except OllamaDeadlineExceeded:
+        logger.error(f"Timeout chiamata Ollama dopo {time.monotonic() - start_time:.1f}s")
+        _bump(stats, "deadline_exceeded")
         return None
     except Exception as e:
         logger.error(f"Errore chiamata Ollama: {e}")
         return None
 
+def call_ollama_cached(prompt, max_tokens=1000, temperature=0.7, num_ctx=None, cache_stats=None,
+                       deadline=None, hedge=False, progress=None):
+    """
+    call_ollama con cache su disco indirizzata per contenuto (modello, prompt e opzioni).
+    Le risposte mancanti non vengono salvate.
+    """
+    key = cache_key(OLLAMA_MODEL, prompt, max_tokens, temperature, num_ctx)
+    cached = cache_get(key)
+    _bump(cache_stats, "cache_hits" if cached is not None else "cache_misses")
+    if cached is not None:
+        return cached
+    
+    result = call_ollama(
+        prompt, max_tokens=max_tokens, temperature=temperature, num_ctx=num_ctx,
+        deadline=deadline, hedge=hedge, stats=cache_stats, progress=progress
+    )
+    if result:
+        cache_put(key, result)
+    return result
+
 def clean_text(text):
     """Pulisce il testo da elementi del parlato"""
     if not text or not isinstance(text, str):
@@ -138,76 +363,204 @@ def split_chunks(text, max_chars=1500):
     
     return chunks
 
-def reformulate_transcription(text, formal_level="Medio", use_sections=False):
+def is_trivial_chunk(chunk):
+    """True se il chunk non ha contenuto sufficiente per essere riformulato"""
+    return len(_MEANINGFUL_WORD_RE.findall(chunk or "")) < MIN_MEANINGFUL_WORDS
+
+def plan_reformulation(chunks, max_chars=1500, min_chars=MIN_CHUNK_CHARS):
     """
-    Riformula la trascrizione in appunti scritti usando Ollama Mistral:7b
+    Pianifica le chiamate al modello prima di inviarle: unisce i chunk troppo corti al vicino
+    (senza superare max_chars) e marca come da non riformulare quelli senza contenuto.
+    Restituisce una lista di (testo, richiede_llm).
     """
+    merged = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        if merged and (len(merged[-1]) < min_chars or len(chunk) < min_chars) \
+                and len(merged[-1]) + len(chunk) + 2 <= max_chars:
+            merged[-1] = f"{merged[-1]}\n\n{chunk}"
+        else:
+            merged.append(chunk)
+    return [(chunk, not is_trivial_chunk(chunk)) for chunk in merged]
+
+def _reformulation_prompt(chunk, formal_level, use_sections):
+    """Prompt Mistral per la riformulazione di un chunk"""
+    return f"""<s>[INST] Converti questo testo parlato in appunti universitari formali (livello {formal_level.lower()}).
+
+Istruzioni:
+- Mantieni tutto il contenuto importante
+- Rimuovi elementi del parlato (ehm, mmm, tipo, cioè)
+- Organizza in paragrafi chiari e strutturati
+{f"- Aggiungi titoletti esplicativi per ogni sezione" if use_sections else ""}
+- Usa un linguaggio formale e accademico
+- Mantieni la coerenza logica
+
+Testo da convertire:
+{chunk} [/INST]</s>"""
+
+def _chunk_token_estimate(chunk):
+    return min(CHUNK_MAX_TOKENS, estimate_tokens(chunk))
+
+def _progress_item(progress, estimate):
+    """Unità di avanzamento della fase appunti (None senza tracker)"""
+    return progress.item(NOTES_STAGE, estimate) if progress is not None else None
+
+def _close_item(item):
+    if item is not None:
+        item.close()
+
+def _reformulate_chunk(i, chunk, formal_level, use_sections, cache_stats=None, deadline=None, hedge=False,
+                       progress=None, use_cache=False):
+    """
+    Riformula un chunk entro la scadenza del job; in caso di errore restituisce un segnaposto.
+    Con use_cache=True la risposta (campionata a temperatura 0.7) viene letta e salvata nella cache su disco.
+    """
+    item = _progress_item(progress, _chunk_token_estimate(chunk))
+    try:
+        # Job già oltre la scadenza: nessuna chiamata
+        if deadline and time.monotonic() >= deadline:
+            logger.warning(f"Scadenza del job raggiunta, chunk {i+1} non riformulato")
+            return f"[Chunk {i+1}: Timeout]"
+        
+        # Esegui riformulazione con Ollama (scadenza verificata durante lo streaming)
+        prompt = _reformulation_prompt(chunk, formal_level, use_sections)
+        if use_cache:
+            generated_text = call_ollama_cached(
+                prompt, max_tokens=CHUNK_MAX_TOKENS, temperature=0.7, cache_stats=cache_stats, deadline=deadline,
+                hedge=hedge, progress=item
+            )
+        else:
+            generated_text = call_ollama(
+                prompt, max_tokens=CHUNK_MAX_TOKENS, temperature=0.7, deadline=deadline,
+                hedge=hedge, stats=cache_stats, progress=item
+            )
+        
+        # Valida output
+        if not generated_text and deadline and time.monotonic() >= deadline:
+            logger.warning(f"Timeout per chunk {i+1}")
+            generated_text = f"[Chunk {i+1}: Timeout]"
+        elif not generated_text or len(generated_text) < 20:
+            logger.warning(f"Output troppo corto per chunk {i+1}")
+            generated_text = f"[Chunk {i+1}: Output non valido]"
+        
+        return generated_text
+        
+    except Exception as e:
+        logger.error(f"Errore riformulazione chunk {i+1}: {e}")
+        return f"[Chunk {i+1}: Errore di elaborazione]"
+    finally:
+        # Risposta in cache, scaduta o più corta del previsto: la fase avanza della stima
+        _close_item(item)
+
+def _prepare_plan(text, stats=None):
+    """Verifica Ollama, pulisce e divide il testo, pianifica le chiamate; [] se non c'è nulla da fare"""
+    # Verifica Ollama
+    ollama_available, error_msg = check_ollama_available()
+    if not ollama_available:
+        logger.error(f"Ollama non disponibile: {error_msg}")
+        return []
+    
+    # Pulisci il testo
+    cleaned = clean_text(text)
+    if not cleaned:
+        return []
+    
+    # Dividi in chunks
+    chunks = split_chunks(cleaned)
+    if not chunks:
+        return []
+    
+    # Unisce i chunk troppo corti e salta quelli senza contenuto
+    plan = plan_reformulation(chunks)
+    llm_calls = sum(1 for _, needs_llm in plan if needs_llm)
+    if stats is not None:
+        stats.update({
+            "chunks": len(chunks),
+            "planned_blocks": len(plan),
+            "llm_calls": llm_calls,
+            "passthrough": len(plan) - llm_calls,
+            "saved_calls": len(chunks) - llm_calls,
+        })
+    logger.info(f"Chunk: {len(chunks)}, chiamate al modello: {llm_calls} ({len(chunks) - llm_calls} risparmiate)")
+    return plan
+
+def _plan_token_estimates(plan):
+    """Token attesi per blocco del piano: i blocchi invariati contano la loro lunghezza"""
+    return [_chunk_token_estimate(chunk) if needs_llm else estimate_tokens(chunk) for chunk, needs_llm in plan]
+
+def _reduce_token_estimate(note_estimates, fan_in):
+    """Token attesi dalle unioni gerarchiche dati i token degli appunti per blocco"""
+    total = 0
+    current = list(note_estimates)
+    while len(current) > 1:
+        groups = [current[i:i + fan_in] for i in range(0, len(current), fan_in)]
+        current = [
+            min(REDUCE_MAX_TOKENS, sum(group) // 2) if len(group) > 1 else group[0] for group in groups
+        ]
+        total += sum(value for value, group in zip(current, groups) if len(group) > 1)
+    return total
+
+def _map_ordered(executor, fn, items, progress=None):
+    """
+    Come executor.map, ma durante l'attesa il thread chiamante aggiorna l'avanzamento
+    (le callback dell'interfaccia girano solo nel thread che ha creato il tracker).
+    """
+    futures = [executor.submit(fn, item) for item in items]
+    pending = set(futures)
+    while pending:
+        _, pending = wait(pending, timeout=PROGRESS_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        if progress is not None:
+            progress.poll()
+    return [future.result() for future in futures]
+
+def reformulate_transcription(text, formal_level="Medio", use_sections=False, stats=None,
+                              job_deadline=None, hedge=False, progress=None):
+    """
+    Riformula la trascrizione in appunti scritti usando Ollama Mistral:7b.
+    job_deadline (secondi) limita la durata dell'intero job: i chunk oltre la scadenza
+    diventano segnaposto. Con hedge=True le richieste lente vengono duplicate.
+    Se stats è un dict viene popolato con chunk, chiamate al modello e chiamate risparmiate.
+    progress (ProgressTracker) riceve i token generati nella fase NOTES_STAGE.
+    """
+    deadline = time.monotonic() + job_deadline if job_deadline else None
     if not text or not isinstance(text, str):
         return "", []
     
     try:
-        # Verifica Ollama
-        ollama_available, error_msg = check_ollama_available()
-        if not ollama_available:
-            logger.error(f"Ollama non disponibile: {error_msg}")
-            return "", []
-        
-        # Pulisci il testo
-        cleaned = clean_text(text)
-        if not cleaned:
-            return "", []
-        
         # Valida livello di formalità
         valid_levels = ["Medio", "Alto", "Molto Alto"]
         if formal_level not in valid_levels:
             formal_level = "Medio"
         
-        # Dividi in chunks
-        chunks = split_chunks(cleaned)
-        if not chunks:
+        plan = _prepare_plan(text, stats)
+        if not plan:
             return "", []
         
+        estimates = _plan_token_estimates(plan)
+        if progress is not None:
+            progress.start_stage(NOTES_STAGE, total=sum(estimates), unit=TOKEN_UNIT)
+        
         notes_by_block = []
         final_notes = []
         
-        for i, chunk in enumerate(chunks):
-            try:
-                # Crea prompt per Mistral
-                prompt = f"""<s>[INST] Converti questo testo parlato in appunti universitari formali (livello {formal_level.lower()}).
-
-Istruzioni:
-- Mantieni tutto il contenuto importante
-- Rimuovi elementi del parlato (ehm, mmm, tipo, cioè)
-- Organizza in paragrafi chiari e strutturati
-{f"- Aggiungi titoletti esplicativi per ogni sezione" if use_sections else ""}
-- Usa un linguaggio formale e accademico
-- Mantieni la coerenza logica
-
-Testo da convertire:
-{chunk} [/INST]</s>"""
-                
-                # Esegui riformulazione con Ollama
-                start_time = time.time()
-                generated_text = call_ollama(prompt, max_tokens=800, temperature=0.7)
-                
-                # Valida output
-                if not generated_text or len(generated_text) < 20:
-                    logger.warning(f"Output troppo corto per chunk {i+1}")
-                    generated_text = f"[Chunk {i+1}: Output non valido]"
-                
-                # Verifica timeout
-                if time.time() - start_time > 60:  # 60 secondi timeout
-                    logger.warning(f"Timeout per chunk {i+1}")
-                    generated_text = f"[Chunk {i+1}: Timeout]"
-                
-                notes_by_block.append((chunk, generated_text))
-                final_notes.append(generated_text)
-                
-            except Exception as e:
-                logger.error(f"Errore riformulazione chunk {i+1}: {e}")
-                error_text = f"[Chunk {i+1}: Errore di elaborazione]"
-                notes_by_block.append((chunk, error_text))
-                final_notes.append(error_text)
+        for i, (chunk, needs_llm) in enumerate(plan):
+            if not needs_llm:
+                # Nessun contenuto da riformulare: il testo passa invariato
+                notes_by_block.append((chunk, chunk))
+                final_notes.append(chunk)
+                if progress is not None:
+                    progress.advance(NOTES_STAGE, estimates[i], measured=False)
+                continue
+            generated_text = _reformulate_chunk(
+                i, chunk, formal_level, use_sections, stats, deadline, hedge, progress
+            )
+            notes_by_block.append((chunk, generated_text))
+            final_notes.append(generated_text)
+        
+        if progress is not None:
+            progress.finish_stage(NOTES_STAGE)
         
         # Combina risultati
         final_text = "\n\n".join(final_notes)
@@ -223,6 +576,137 @@ Testo da convertire:
         logger.error(f"Errore generale riformulazione: {e}")
         return "", []
 
+def _reduce_prompt(notes, formal_level, final):
+    """Prompt Mistral per unire appunti consecutivi in un riassunto"""
+    target = "un unico riassunto dell'intera lezione" if final else "un unico riassunto di sezione"
+    joined = "\n\n---\n\n".join(notes)
+    return f"""<s>[INST] Unisci questi appunti universitari consecutivi in {target} (livello {formal_level.lower()}).
+
+Istruzioni:
+- Mantieni concetti chiave, definizioni ed esempi importanti
+- Elimina le ripetizioni tra un blocco e l'altro
+- Rispetta l'ordine degli argomenti
+- Usa un linguaggio formale e accademico
+
+Appunti da unire:
+{joined} [/INST]</s>"""
+
+def _reduce_group(index, notes, formal_level, final, cache_stats=None, deadline=None, hedge=False,
+                  progress=None):
+    """Unisce un gruppo di appunti; un gruppo di un solo elemento passa invariato"""
+    if len(notes) == 1:
+        return "\n\n".join(notes)
+    item = _progress_item(progress, min(REDUCE_MAX_TOKENS, sum(estimate_tokens(note) for note in notes) // 2))
+    try:
+        if deadline and time.monotonic() >= deadline:
+            return "\n\n".join(notes)
+        merged = call_ollama_cached(
+            _reduce_prompt(notes, formal_level, final),
+            max_tokens=REDUCE_MAX_TOKENS, temperature=0.3, num_ctx=REDUCE_NUM_CTX, cache_stats=cache_stats,
+            deadline=deadline, hedge=hedge, progress=item
+        )
+    except Exception as e:
+        logger.error(f"Errore unione gruppo {index+1}: {e}")
+        merged = None
+    finally:
+        _close_item(item)
+    if not merged or len(merged) < 20:
+        # Senza riassunto resta l'unione degli appunti: il livello superiore resta calcolabile
+        logger.warning(f"Riassunto non valido per gruppo {index+1}, uso gli appunti originali")
+        return "\n\n".join(notes)
+    return merged
+
+def reformulate_hierarchical(text, formal_level="Medio", use_sections=False, stats=None,
+                             fan_in=REDUCE_FAN_IN, max_workers=LLM_MAX_WORKERS, job_deadline=None, hedge=False,
+                             progress=None):
+    """
+    Riformulazione gerarchica map-reduce per lezioni lunghe: i chunk sono riformulati in parallelo
+    (map), poi gli appunti adiacenti vengono uniti a gruppi di fan_in in riassunti di sezione
+    e infine nel riassunto della lezione (reduce).
+    Ogni chiamata è in cache per contenuto: se cambia un chunk si rigenera solo il suo ramo.
+    Restituisce (documento, notes_by_block, livelli), dove livelli[0] sono gli appunti per chunk
+    e livelli[-1] contiene il riassunto della lezione.
+    job_deadline, hedge e progress come in reformulate_transcription.
+    """
+    deadline = time.monotonic() + job_deadline if job_deadline else None
+    if not text or not isinstance(text, str):
+        return "", [], []
+    
+    try:
+        valid_levels = ["Medio", "Alto", "Molto Alto"]
+        if formal_level not in valid_levels:
+            formal_level = "Medio"
+        fan_in = max(2, int(fan_in))
+        
+        plan = _prepare_plan(text, stats)
+        if not plan:
+            return "", [], []
+        
+        estimates = _plan_token_estimates(plan)
+        if progress is not None:
+            # Il totale include le unioni previste; ogni unione riconcilia la sua stima alla chiusura
+            progress.start_stage(
+                NOTES_STAGE, total=sum(estimates) + _reduce_token_estimate(estimates, fan_in), unit=TOKEN_UNIT
+            )
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # Map: riformulazione dei chunk in parallelo (l'ordine viene mantenuto)
+            def map_chunk(item):
+                i, (chunk, needs_llm) = item
+                if not needs_llm:
+                    if progress is not None:
+                        progress.advance(NOTES_STAGE, estimates[i], measured=False)
+                    return chunk
+                return _reformulate_chunk(
+                    i, chunk, formal_level, use_sections, stats, deadline, hedge, progress, use_cache=True
+                )
+            
+            notes = _map_ordered(executor, map_chunk, enumerate(plan), progress)
+            notes_by_block = [(chunk, note) for (chunk, _), note in zip(plan, notes)]
+            
+            # Reduce: unione di appunti adiacenti fino a un solo riassunto
+            # (i segnaposto di errore non entrano nei riassunti)
+            levels = [notes]
+            current = [note for note in notes if not note.startswith("[Chunk ")]
+            reduce_calls = 0
+            while len(current) > 1:
+                groups = [current[i:i + fan_in] for i in range(0, len(current), fan_in)]
+                final = len(groups) == 1
+                reduce_calls += sum(1 for group in groups if len(group) > 1)
+                current = _map_ordered(
+                    executor,
+                    lambda item: _reduce_group(
+                        item[0], item[1], formal_level, final, stats, deadline, hedge, progress
+                    ),
+                    enumerate(groups),
+                    progress
+                )
+                levels.append(current)
+        
+        if progress is not None:
+            progress.finish_stage(NOTES_STAGE)
+        
+        if stats is not None:
+            stats["reduce_calls"] = reduce_calls
+            stats["levels"] = len(levels)
+        
+        summary = current[0] if current else ""
+        sections = levels[-2] if len(levels) > 2 else []
+        parts = ["RIASSUNTO DELLA LEZIONE", summary]
+        for i, section in enumerate(sections):
+            parts.extend([f"SEZIONE {i+1}", section])
+        final_text = "\n\n".join(part for part in parts if part)
+        
+        if len(summary.strip()) < 50:
+            logger.warning("Riassunto finale troppo corto")
+            return "", notes_by_block, levels
+        
+        return final_text, notes_by_block, levels
+        
+    except Exception as e:
+        logger.error(f"Errore generale riformulazione gerarchica: {e}")
+        return "", [], []
+
 def validate_reformulation_input(text, formal_level, use_sections):
     """Valida i parametri di input per la riformulazione"""
     errors = []
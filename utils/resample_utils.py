@@ -0,0 +1,135 @@
+import math
+import threading
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Parametri del filtro anti-aliasing (sinc finestrato con Kaiser, come resample_poly)
+FILTER_ZEROS = 10
+KAISER_BETA = 5.0
+DEFAULT_BLOCK_SIZE = 32768
+
+# Cache dei filtri polifase: (up, down) -> (matrice polifase, ritardo)
+_FILTER_CACHE = {}
+_FILTER_CACHE_LOCK = threading.Lock()
+
+def resample_ratio(orig_rate, target_rate):
+    """Restituisce il rapporto ridotto (up, down) tra le due frequenze"""
+    orig_rate, target_rate = int(orig_rate), int(target_rate)
+    if orig_rate <= 0 or target_rate <= 0:
+        raise ValueError("Le frequenze di campionamento devono essere positive")
+    g = math.gcd(orig_rate, target_rate)
+    return target_rate // g, orig_rate // g
+
+def design_polyphase_filter(up, down):
+    """
+    Progetta il filtro passa-basso FIR e lo scompone in up fasi.
+    Restituisce (matrice up x taps, ritardo di gruppo in campioni sovracampionati).
+    """
+    key = (up, down)
+    with _FILTER_CACHE_LOCK:
+        if key in _FILTER_CACHE:
+            return _FILTER_CACHE[key]
+
+    max_rate = max(up, down)
+    half_len = FILTER_ZEROS * max_rate
+    length = 2 * half_len + 1
+    cutoff = 1.0 / max_rate
+    t = np.arange(length) - half_len
+    # Guadagno up per compensare gli zeri inseriti dal sovracampionamento
+    h = up * cutoff * np.sinc(cutoff * t) * np.kaiser(length, KAISER_BETA)
+
+    taps = -(-length // up)
+    padded = np.zeros(taps * up)
+    padded[:length] = h
+    # polyphase[r, k] = h[r + k * up]
+    polyphase = np.ascontiguousarray(padded.reshape(taps, up).T, dtype=np.float32)
+
+    with _FILTER_CACHE_LOCK:
+        _FILTER_CACHE[key] = (polyphase, half_len)
+    return polyphase, half_len
+
+def _to_mono_float(block):
+    """Converte un blocco PCM (interi o float, mono o multicanale) in float32 mono"""
+    block = np.asarray(block)
+    channels = block.shape[1] if block.ndim == 2 else 1
+    if block.dtype == np.uint8:
+        offset, scale = 128.0 * channels, 1.0 / 128.0
+    elif np.issubdtype(block.dtype, np.integer):
+        offset, scale = 0.0, 1.0 / float(2 ** (block.dtype.itemsize * 8 - 1))
+    else:
+        offset, scale = 0.0, 1.0
+    if block.ndim == 2:
+        # Somma dei canali colonna per colonna: più veloce di mean(axis=1) su array interleaved
+        data = block[:, 0].astype(np.float32)
+        for channel in range(1, channels):
+            data += block[:, channel]
+    else:
+        data = block.astype(np.float32)
+    if offset:
+        data -= offset
+    data *= scale / channels
+    return data
+
+def output_length(n_samples, orig_rate, target_rate):
+    """Numero di campioni prodotti dal ricampionamento"""
+    up, down = resample_ratio(orig_rate, target_rate)
+    return -(-n_samples * up // down)
+
+def resample_pcm_blocks(samples, orig_rate, target_rate=16000, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Downmix in mono e ricampionamento polifase vettorizzato.
+    samples: array (n,) o (n, canali), anche np.memmap: viene letto un blocco alla volta.
+    Generatore di blocchi float32 in [-1, 1] alla frequenza target.
+    """
+    n_in = len(samples)
+    if n_in == 0:
+        return
+    up, down = resample_ratio(orig_rate, target_rate)
+    if up == 1 and down == 1:
+        for start in range(0, n_in, block_size):
+            yield _to_mono_float(samples[start:start + block_size])
+        return
+
+    polyphase, delay = design_polyphase_filter(up, down)
+    # Coefficienti invertiti: il prodotto scalare avviene su finestre crescenti dell'input
+    reversed_phases = np.ascontiguousarray(polyphase[:, ::-1])
+    taps = polyphase.shape[1]
+    n_out = output_length(n_in, orig_rate, target_rate)
+
+    for out_start in range(0, n_out, block_size):
+        out_idx = np.arange(out_start, min(out_start + block_size, n_out), dtype=np.int64)
+        # Posizione nel segnale sovracampionato (compensando il ritardo del filtro)
+        t = out_idx * down + delay
+        phases = t % up
+        bases = t // up
+
+        # Finestra di input necessaria al blocco, con zero padding ai bordi
+        lo = int(bases[0]) - taps + 1
+        hi = int(bases[-1]) + 1
+        segment = _to_mono_float(samples[max(lo, 0):min(hi, n_in)])
+        pad_left = max(0, -lo)
+        pad_right = (hi - lo) - pad_left - len(segment)
+        if pad_left or pad_right:
+            segment = np.pad(segment, (pad_left, pad_right))
+
+        # Vista (senza copia) di tutte le finestre di taps campioni del blocco
+        windows = sliding_window_view(segment, taps)
+        starts = bases - bases[0]
+        out = np.empty(len(out_idx), dtype=np.float32)
+        # Le uscite con la stessa fase si ripetono ogni up campioni, con passo down sull'input:
+        # un prodotto matrice-vettore per fase
+        for p in range(min(up, len(out_idx))):
+            count = len(out_idx[p::up])
+            out[p::up] = windows[starts[p]::down][:count] @ reversed_phases[phases[p]]
+        yield out
+
+def resample_audio(samples, orig_rate, target_rate=16000, block_size=DEFAULT_BLOCK_SIZE):
+    """Downmix e ricampionamento dell'intero segnale, restituisce float32 mono"""
+    blocks = list(resample_pcm_blocks(samples, orig_rate, target_rate, block_size))
+    if not blocks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(blocks)
+
+def float_to_pcm16(data):
+    """Converte float32 in [-1, 1] in PCM int16 con saturazione"""
+    return (np.clip(data, -1.0, 1.0) * 32767.0).astype("<i2")
@@ -0,0 +1,524 @@
+import os
+import time
+import lzma
+import zlib
+import struct
+import atexit
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Formato del file dati: blocchi compressi, ciascuno con intestazione
+# (magic, codec, byte non compressi, byte compressi, crc32 dei byte compressi).
+# Un blocco contiene record con prefisso di lunghezza (lunghezza chiave, lunghezza valore, chiave, valore).
+BLOCK_MAGIC = b"LRS1"
+BLOCK_HEADER = struct.Struct("<4sBIII")
+RECORD_HEADER = struct.Struct("<HI")
+# Voce dell'indice: offset del blocco, offset del record nel blocco decompresso, lunghezza, lunghezza chiave
+INDEX_ENTRY = struct.Struct("<QIIH")
+
+CODECS = {"zlib": 1, "lzma": 2}
+_CODEC_NAMES = {value: name for name, value in CODECS.items()}
+
+DEFAULT_CODEC = os.environ.get("STORE_CODEC", "zlib")
+DEFAULT_BLOCK_SIZE = 64 * 1024
+# Record in attesa più vecchi di così vengono scritti alla put successiva
+FLUSH_INTERVAL_SECONDS = 5.0
+# Blocchi decompressi tenuti in memoria (letture consecutive dallo stesso blocco)
+BLOCK_CACHE_SIZE = 8
+
+class StoreCorruptedError(Exception):
+    """Blocco illeggibile nel file dati"""
+    pass
+
+def _compress(codec, data):
+    if codec == CODECS["lzma"]:
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 6)
+
+def _decompress(codec, data):
+    if codec == CODECS["lzma"]:
+        return lzma.decompress(data)
+    if codec == CODECS["zlib"]:
+        return zlib.decompress(data)
+    raise StoreCorruptedError(f"Codec sconosciuto: {codec}")
+
+class RecordStore:
+    """
+    Archivio append-only di record chiave -> bytes, compressi a blocchi (zlib o lzma).
+    Un indice degli offset (file .idx accanto al file dati) dà accesso diretto al blocco
+    di ogni record; a ogni chiave corrisponde l'ultimo record scritto.
+    Se l'indice manca o è indietro rispetto ai dati viene ricostruito leggendo i blocchi.
+    Scritture e compattazione si escludono tramite flock su un file .lock accanto ai dati
+    (stabile anche quando la compattazione sostituisce il file dati); le altre istanze
+    riconoscono il file sostituito e ricaricano l'indice.
+    """
+
+    def __init__(self, path, codec=DEFAULT_CODEC, block_size=DEFAULT_BLOCK_SIZE):
+        if codec not in CODECS:
+            raise ValueError(f"Codec non valido. Scegli tra: {list(CODECS)}")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock_path = path + ".lock"
+        self.codec = CODECS[codec]
+        self.block_size = block_size
+        self._lock = threading.RLock()
+        self._index = {}
+        self._indexed_end = 0
+        self._identity = None
+        self._pending = OrderedDict()
+        self._pending_bytes = 0
+        self._pending_since = None
+        self._blocks = OrderedDict()
+        self._closed = False
+        self.stats = {
+            "records_written": 0,
+            "records_read": 0,
+            "raw_bytes_written": 0,
+            "compressed_bytes_written": 0,
+            "write_seconds": 0.0,
+            "raw_bytes_read": 0,
+            "compressed_bytes_read": 0,
+            "read_seconds": 0.0,
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._file_lock(exclusive=False):
+            self._load_index()
+
+    @contextmanager
+    def _file_lock(self, exclusive=True):
+        """flock sul file .lock: esclusivo per scritture e compattazione, condiviso per caricare l'indice"""
+        if not FCNTL_AVAILABLE:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Indice
+
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _reload_if_replaced(self, locked=False, force=False):
+        """
+        Ricarica l'indice se il file dati è stato sostituito (compattazione di un'altra istanza)
+        o è più corto della parte indicizzata. Restituisce True se l'indice è stato ricaricato.
+        """
+        if not force:
+            try:
+                stat = os.stat(self.path)
+                replaced = (stat.st_dev, stat.st_ino) != self._identity or stat.st_size < self._indexed_end
+            except FileNotFoundError:
+                replaced = self._identity is not None
+            if not replaced:
+                return False
+        self._index = {}
+        self._indexed_end = 0
+        self._blocks.clear()
+        if locked:
+            self._load_index()
+        else:
+            # La compattazione sostituisce dati e indice con due rename: si attende che finisca
+            with self._file_lock(exclusive=False):
+                self._load_index()
+        return True
+
+    def _load_index(self):
+        """Carica l'indice salvato e indicizza i blocchi scritti dopo (o da altri processi)"""
+        self._identity = self._file_identity()
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        position = 0
+        while position + INDEX_ENTRY.size <= len(data):
+            block_offset, record_offset, length, key_length = INDEX_ENTRY.unpack_from(data, position)
+            key_start = position + INDEX_ENTRY.size
+            if key_start + key_length > len(data):
+                break
+            key = data[key_start:key_start + key_length].decode("utf-8")
+            self._index[key] = (block_offset, record_offset, length)
+            position = key_start + key_length
+        if self._index:
+            last_block = max(entry[0] for entry in self._index.values())
+            self._indexed_end = self._block_end(last_block)
+        # Blocchi scritti senza aggiornare l'indice (processo interrotto): l'indice viene completato
+        self._scan_new_blocks(persist=True)
+
+    def _block_end(self, offset):
+        """Fine del blocco che inizia a offset, 0 se il blocco non è leggibile"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                header = f.read(BLOCK_HEADER.size)
+        except FileNotFoundError:
+            return 0
+        if len(header) < BLOCK_HEADER.size:
+            return 0
+        magic, _, _, compressed_length, _ = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            return 0
+        return offset + BLOCK_HEADER.size + compressed_length
+
+    def _scan_new_blocks(self, persist=False):
+        """
+        Indicizza i blocchi oltre la fine nota (dati più recenti dell'indice).
+        Con persist=True le voci sono aggiunte anche al file indice; i blocchi degli altri
+        processi sono già nel file indice, scritto da chi ha scritto il blocco.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= self._indexed_end:
+            return
+        with open(self.path, "rb") as f:
+            offset = self._indexed_end
+            while offset < size:
+                f.seek(offset)
+                try:
+                    raw = self._read_block_at(f, offset)
+                except StoreCorruptedError as e:
+                    # Blocco incompleto (scrittura interrotta): i successivi non sono affidabili
+                    logger.warning(f"{self.path}: blocco a {offset} ignorato ({e})")
+                    break
+                new_entries = []
+                for key, record_offset, length in self._iter_records(raw):
+                    self._index[key] = (offset, record_offset, length)
+                    new_entries.append((key, offset, record_offset, length))
+                if persist:
+                    self._append_index(new_entries)
+                offset = f.tell()
+                self._indexed_end = offset
+
+    def _append_index(self, entries):
+        if not entries:
+            return
+        data = bytearray()
+        for key, block_offset, record_offset, length in entries:
+            encoded = key.encode("utf-8")
+            data += INDEX_ENTRY.pack(block_offset, record_offset, length, len(encoded)) + encoded
+        with open(self.index_path, "ab") as f:
+            f.write(data)
+
+    # Blocchi
+
+    @staticmethod
+    def _iter_records(raw):
+        position = 0
+        while position + RECORD_HEADER.size <= len(raw):
+            key_length, value_length = RECORD_HEADER.unpack_from(raw, position)
+            key_start = position + RECORD_HEADER.size
+            value_start = key_start + key_length
+            key = raw[key_start:value_start].decode("utf-8")
+            yield key, value_start, value_length
+            position = value_start + value_length
+
+    def _read_block_at(self, f, offset):
+        """Legge e decomprime il blocco all'offset corrente del file"""
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            raise StoreCorruptedError("intestazione incompleta")
+        magic, codec, raw_length, compressed_length, crc = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            raise StoreCorruptedError("intestazione non valida")
+        compressed = f.read(compressed_length)
+        if len(compressed) < compressed_length or zlib.crc32(compressed) != crc:
+            raise StoreCorruptedError("blocco incompleto o danneggiato")
+        raw = _decompress(codec, compressed)
+        if len(raw) != raw_length:
+            raise StoreCorruptedError("lunghezza decompressa errata")
+        self.stats["compressed_bytes_read"] += BLOCK_HEADER.size + compressed_length
+        return raw
+
+    def _block(self, offset):
+        """Blocco decompresso (con cache LRU dei blocchi recenti); None se il file è stato sostituito"""
+        raw = self._blocks.get(offset)
+        if raw is not None:
+            self._blocks.move_to_end(offset)
+            return raw
+        with open(self.path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_dev, stat.st_ino) != self._identity:
+                return None
+            f.seek(offset)
+            raw = self._read_block_at(f, offset)
+        self._blocks[offset] = raw
+        if len(self._blocks) > BLOCK_CACHE_SIZE:
+            self._blocks.popitem(last=False)
+        return raw
+
+    def _read_value(self, key, entry):
+        """
+        Valore del record indicato dall'indice; None se all'offset non c'è la chiave
+        (indice di un file dati sostituito nel frattempo).
+        """
+        block_offset, record_offset, length = entry
+        raw = self._block(block_offset)
+        encoded_key = key.encode("utf-8")
+        if raw is None or raw[record_offset - len(encoded_key):record_offset] != encoded_key:
+            return None
+        return raw[record_offset:record_offset + length]
+
+    # API
+
+    def get(self, key):
+        """Valore (bytes) dell'ultimo record con la chiave, None se assente"""
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            self._reload_if_replaced()
+            start = time.perf_counter()
+            for attempt in range(2):
+                entry = self._index.get(key)
+                if entry is None:
+                    # Un altro processo potrebbe aver aggiunto blocchi
+                    self._scan_new_blocks()
+                    entry = self._index.get(key)
+                    if entry is None:
+                        return None
+                try:
+                    value = self._read_value(key, entry)
+                except (OSError, StoreCorruptedError) as e:
+                    if attempt:
+                        logger.warning(f"{self.path}: record {key[:12]} illeggibile ({e})")
+                        return None
+                    value = None
+                if value is not None:
+                    break
+                if attempt:
+                    return None
+                # File dati sostituito tra il controllo e la lettura: si ricarica l'indice e si riprova
+                self._reload_if_replaced(force=True)
+            self.stats["records_read"] += 1
+            self.stats["raw_bytes_read"] += len(value)
+            self.stats["read_seconds"] += time.perf_counter() - start
+            return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def put(self, key, value):
+        """Accoda un record; il blocco viene scritto quando è pieno o in attesa da troppo"""
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        encoded_key = key.encode("utf-8")
+        if len(encoded_key) > 0xFFFF:
+            raise ValueError("Chiave troppo lunga")
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Archivio chiuso: {self.path}")
+            if key in self._pending:
+                self._pending_bytes -= RECORD_HEADER.size + len(encoded_key) + len(self._pending[key])
+            self._pending[key] = value
+            self._pending_bytes += RECORD_HEADER.size + len(encoded_key) + len(value)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if (self._pending_bytes >= self.block_size
+                    or time.monotonic() - self._pending_since >= FLUSH_INTERVAL_SECONDS):
+                self.flush()
+
+    def flush(self):
+        """Comprime i record in attesa in un blocco e lo aggiunge in coda al file dati"""
+        with self._lock:
+            if not self._pending:
+                return
+            # Scritture di più processi sullo stesso file e compattazione: un'operazione alla volta
+            with self._file_lock():
+                self._write_pending()
+
+    def _write_pending(self):
+        """Scrive i record in attesa; richiede self._lock e il flock esclusivo"""
+        start = time.perf_counter()
+        raw = bytearray()
+        offsets = []
+        for key, value in self._pending.items():
+            encoded_key = key.encode("utf-8")
+            raw += RECORD_HEADER.pack(len(encoded_key), len(value)) + encoded_key
+            offsets.append((key, len(raw), len(value)))
+            raw += value
+        compressed = _compress(self.codec, bytes(raw))
+        block = BLOCK_HEADER.pack(BLOCK_MAGIC, self.codec, len(raw), len(compressed),
+                                  zlib.crc32(compressed)) + compressed
+
+        # Archivio compattato da un'altra istanza: i record in attesa vanno nel nuovo file
+        self._reload_if_replaced(locked=True)
+        with open(self.path, "ab") as f:
+            if self._identity is None:
+                # File dati appena creato
+                self._identity = self._file_identity()
+            # Blocchi aggiunti da altri processi vanno indicizzati prima del nostro
+            self._scan_new_blocks()
+            if os.path.getsize(self.path) > self._indexed_end:
+                # Coda di un blocco scritto a metà (processo interrotto): viene scartata
+                f.truncate(self._indexed_end)
+            f.seek(0, os.SEEK_END)
+            offset = f.tell()
+            f.write(block)
+            f.flush()
+            entries = [(key, offset, record_offset, length) for key, record_offset, length in offsets]
+            for key, block_offset, record_offset, length in entries:
+                self._index[key] = (block_offset, record_offset, length)
+            self._append_index(entries)
+            self._indexed_end = offset + len(block)
+
+        self.stats["records_written"] += len(self._pending)
+        self.stats["raw_bytes_written"] += len(raw)
+        self.stats["compressed_bytes_written"] += len(block)
+        self.stats["write_seconds"] += time.perf_counter() - start
+        self._pending.clear()
+        self._pending_bytes = 0
+        self._pending_since = None
+
+    def keys(self):
+        with self._lock:
+            self._scan_new_blocks()
+            return list(dict.fromkeys(list(self._index) + list(self._pending)))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def file_stats(self):
+        """
+        Occupazione su disco e rapporto di compressione dei record vivi,
+        più le velocità di lettura e scrittura (MB/s di dati non compressi) di questa istanza.
+        """
+        with self._lock:
+            self.flush()
+            data_bytes = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            index_bytes = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+            live_bytes = sum(length for _, _, length in self._index.values())
+            raw_blocks = 0
+            offset = 0
+            if data_bytes:
+                with open(self.path, "rb") as f:
+                    while offset < data_bytes:
+                        f.seek(offset)
+                        header = f.read(BLOCK_HEADER.size)
+                        if len(header) < BLOCK_HEADER.size:
+                            break
+                        magic, _, raw_length, compressed_length, _ = BLOCK_HEADER.unpack(header)
+                        if magic != BLOCK_MAGIC:
+                            break
+                        raw_blocks += raw_length
+                        offset += BLOCK_HEADER.size + compressed_length
+            stats = dict(self.stats)
+        return dict(
+            stats,
+            records=len(self._index),
+            data_bytes=data_bytes,
+            index_bytes=index_bytes,
+            live_bytes=live_bytes,
+            raw_bytes=raw_blocks,
+            compression_ratio=raw_blocks / data_bytes if data_bytes else 0.0,
+            garbage_ratio=1 - live_bytes / raw_blocks if raw_blocks else 0.0,
+            write_mb_s=_throughput(stats["raw_bytes_written"], stats["write_seconds"]),
+            read_mb_s=_throughput(stats["raw_bytes_read"], stats["read_seconds"]),
+        )
+
+    def compact(self):
+        """
+        Riscrive solo l'ultimo record di ogni chiave in un nuovo file (record sostituiti eliminati).
+        Il flock esclusivo è tenuto per tutta la compattazione: le scritture delle altre istanze
+        attendono e vanno poi in coda al file compattato.
+        Restituisce i byte liberati.
+        """
+        with self._lock, self._file_lock():
+            # Stato aggiornato: compattazione di un'altra istanza e blocchi scritti da altri processi
+            self._reload_if_replaced(locked=True)
+            self._scan_new_blocks()
+            if self._pending:
+                self._write_pending()
+            if not self._index:
+                return 0
+            before = sum(os.path.getsize(p) for p in (self.path, self.index_path) if os.path.exists(p))
+            temp_path = self.path + ".compact"
+            for leftover in (temp_path, temp_path + ".idx", temp_path + ".lock"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            temp = RecordStore(temp_path, codec=_CODEC_NAMES[self.codec], block_size=self.block_size)
+            for key, entry in list(self._index.items()):
+                try:
+                    value = self._read_value(key, entry)
+                except (OSError, StoreCorruptedError) as e:
+                    logger.warning(f"{self.path}: record {key[:12]} illeggibile, escluso dalla compattazione ({e})")
+                    value = None
+                if value is not None:
+                    temp.put(key, value)
+            temp.close()
+            os.replace(temp.path, self.path)
+            os.replace(temp.index_path, self.index_path)
+            if os.path.exists(temp.lock_path):
+                os.remove(temp.lock_path)
+            self._index = temp._index
+            self._indexed_end = temp._indexed_end
+            self._identity = self._file_identity()
+            self._blocks.clear()
+            after = sum(os.path.getsize(p) for p in (self.path, self.index_path))
+            return before - after
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self.flush()
+                self._closed = True
+        with _STORES_LOCK:
+            if _STORES.get(os.path.abspath(self.path)) is self:
+                del _STORES[os.path.abspath(self.path)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def _throughput(byte_count, seconds):
+    return byte_count / 1024 ** 2 / seconds if seconds > 0 else 0.0
+
+# Archivi aperti nel processo: percorso -> RecordStore
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+def open_store(path, codec=DEFAULT_CODEC, block_size=DEFAULT_BLOCK_SIZE):
+    """Archivio condiviso per percorso (una sola istanza per processo)"""
+    key = os.path.abspath(path)
+    with _STORES_LOCK:
+        store = _STORES.get(key)
+        if store is None:
+            store = RecordStore(path, codec=codec, block_size=block_size)
+            _STORES[key] = store
+        return store
+
+def _close_all_stores():
+    """All'uscita del processo scrive i record ancora in attesa"""
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+    for store in stores:
+        try:
+            store.close()
+        except Exception as e:
+            logger.warning(f"Errore chiusura archivio {store.path}: {e}")
+
+atexit.register(_close_all_stores)
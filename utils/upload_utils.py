@@ -0,0 +1,26 @@
+import hashlib
+
+# Copia dell'upload a blocchi: la memoria usata non dipende dalla dimensione del file
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+def spool_upload(source, dest_path, block_size=UPLOAD_BLOCK_SIZE):
+    """
+    Copia un file caricato (oggetto file, es. UploadedFile di Streamlit) su disco a blocchi,
+    calcolando intanto lo sha256 del contenuto (chiave per le cache dei risultati).
+    Restituisce (sha256 esadecimale, byte scritti).
+    """
+    digest = hashlib.sha256()
+    written = 0
+    if hasattr(source, "seek"):
+        source.seek(0)
+    with open(dest_path, "wb") as f:
+        while True:
+            block = source.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+            f.write(block)
+            written += len(block)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return digest.hexdigest(), written
@@ -0,0 +1,63 @@
+import re
+import unicodedata
+
+# Blocchi mostrati per pagina nel confronto (la pagina costa uguale qualunque sia la lezione)
+BLOCKS_PER_PAGE = 10
+# Risultati massimi della ricerca mostrati nel selettore
+MAX_SEARCH_RESULTS = 200
+# Caratteri di contesto attorno al termine trovato
+SNIPPET_WIDTH = 60
+
+def page_count(total, per_page=BLOCKS_PER_PAGE):
+    """Numero di pagine (almeno una, anche senza blocchi)"""
+    return max(1, -(-total // per_page))
+
+def clamp_page(page, total, per_page=BLOCKS_PER_PAGE):
+    """Pagina valida più vicina (es. dopo un nuovo file con meno blocchi)"""
+    return min(max(0, int(page or 0)), page_count(total, per_page) - 1)
+
+def page_bounds(page, total, per_page=BLOCKS_PER_PAGE):
+    """Intervallo [inizio, fine) delle posizioni nella pagina"""
+    start = clamp_page(page, total, per_page) * per_page
+    return start, min(total, start + per_page)
+
+def page_of(position, per_page=BLOCKS_PER_PAGE):
+    """Pagina che contiene la posizione"""
+    return max(0, position) // per_page
+
+def normalize_text(text):
+    """Minuscolo e senza accenti: 'Perché' e 'perche' coincidono nella ricerca"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def search_blocks(blocks, query, limit=MAX_SEARCH_RESULTS):
+    """
+    Indici dei blocchi (originale, appunti) che contengono tutte le parole della query,
+    nell'ordine della lezione. Query vuota: nessun filtro (None).
+    """
+    terms = re.findall(r"\w+", normalize_text(query))
+    if not terms:
+        return None
+    matches = []
+    for index, (original, notes) in enumerate(blocks):
+        haystack = normalize_text(original) + "\n" + normalize_text(notes)
+        if all(term in haystack for term in terms):
+            matches.append(index)
+            if len(matches) >= limit:
+                break
+    return matches
+
+def highlight_snippet(text, query, width=SNIPPET_WIDTH):
+    """Estratto del testo attorno al primo termine trovato, con il termine in grassetto"""
+    text = " ".join((text or "").split())
+    terms = re.findall(r"\w+", normalize_text(query))
+    # La normalizzazione NFKD può cambiare le lunghezze: si cerca sul testo con stessi indici
+    folded = "".join(normalize_text(char)[:1] or char for char in text)
+    positions = [(folded.find(term), term) for term in terms if term in folded]
+    if not positions:
+        return text[:width * 2] + ("…" if len(text) > width * 2 else "")
+    position, term = min(positions)
+    start = max(0, position - width)
+    end = min(len(text), position + len(term) + width)
+    snippet = text[start:position] + f"**{text[position:position + len(term)]}**" + text[position + len(term):end]
+    return ("…" if start else "") + snippet + ("…" if end < len(text) else "")
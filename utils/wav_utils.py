@@ -0,0 +1,149 @@
+import os
+import struct
+import numpy as np
+
+# Formati WAV mappabili direttamente in memoria: (codice formato, bit) -> dtype
+_WAV_DTYPES = {
+    (1, 8): np.dtype("u1"),
+    (1, 16): np.dtype("<i2"),
+    (1, 32): np.dtype("<i4"),
+    (3, 32): np.dtype("<f4"),
+}
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+class WavFormatError(Exception):
+    """Eccezione per file WAV non leggibili tramite memory map"""
+    pass
+
+def read_wav_header(path):
+    """
+    Legge l'header RIFF/WAVE senza caricare i dati audio.
+    Restituisce dict con formato, canali, sample rate, bit, offset e dimensione del chunk data.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise WavFormatError("Header RIFF/WAVE non valido")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                data = f.read(chunk_size)
+                audio_format, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", data[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(data) >= 26:
+                    # Il sottoformato reale sono i primi 2 byte del GUID
+                    audio_format = struct.unpack("<H", data[24:26])[0]
+                fmt = {
+                    "audio_format": audio_format,
+                    "channels": channels,
+                    "sample_rate": sample_rate,
+                    "block_align": block_align,
+                    "bits": bits,
+                }
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WavFormatError("Chunk data prima del chunk fmt")
+                data_offset = f.tell()
+                # Registratori in streaming lasciano dimensione 0 o 0xFFFFFFFF: usa il resto del file
+                available = file_size - data_offset
+                if chunk_size == 0 or chunk_size == 0xFFFFFFFF or chunk_size > available:
+                    chunk_size = available
+                fmt["data_offset"] = data_offset
+                fmt["data_size"] = chunk_size
+                return fmt
+            else:
+                f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+    raise WavFormatError("Chunk data non trovato")
+
+def wav_dtype(header):
+    """dtype numpy dei campioni descritti dall'header; WavFormatError se il formato non è PCM lineare"""
+    dtype = _WAV_DTYPES.get((header["audio_format"], header["bits"]))
+    if dtype is None:
+        raise WavFormatError(
+            f"Formato WAV non supportato (codice {header['audio_format']}, {header['bits']} bit)"
+        )
+    return dtype
+
+class WavMemmap:
+    """
+    Accesso in sola lettura a un WAV PCM tramite numpy.memmap.
+    I chunk sono viste sul page cache (nessuna copia nell'heap del processo),
+    quindi più worker possono leggere regioni diverse dello stesso file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header = read_wav_header(path)
+        dtype = wav_dtype(header)
+        self.dtype = dtype
+        self.channels = header["channels"]
+        self.sample_rate = header["sample_rate"]
+        frame_bytes = dtype.itemsize * self.channels
+        self.frames = header["data_size"] // frame_bytes
+        if self.frames == 0:
+            self.samples = np.zeros((0, self.channels), dtype=dtype)
+        else:
+            self.samples = np.memmap(
+                path, dtype=dtype, mode="r", offset=header["data_offset"],
+                shape=(self.frames, self.channels)
+            )
+
+    @property
+    def duration(self):
+        """Durata in secondi"""
+        return self.frames / float(self.sample_rate) if self.sample_rate else 0.0
+
+    def chunk(self, start_sample, num_samples):
+        """Vista (senza copia) di num_samples frame a partire da start_sample"""
+        start_sample = max(0, int(start_sample))
+        end_sample = min(self.frames, start_sample + int(num_samples))
+        view = self.samples[start_sample:end_sample]
+        return view[:, 0] if self.channels == 1 else view
+
+    def chunk_seconds(self, start_s, duration_s):
+        """Vista del segmento [start_s, start_s + duration_s) in secondi"""
+        return self.chunk(round(start_s * self.sample_rate), round(duration_s * self.sample_rate))
+
+    def iter_chunks(self, chunk_samples):
+        """Restituisce (indice, campione iniziale, vista) per chunk consecutivi"""
+        for index, start in enumerate(range(0, self.frames, chunk_samples)):
+            yield index, start, self.chunk(start, chunk_samples)
+
+    def close(self):
+        """Rilascia la mappatura (necessario su Windows prima di cancellare il file)"""
+        mapping = getattr(self.samples, "_mmap", None)
+        self.samples = None
+        if mapping is not None:
+            try:
+                mapping.close()
+            except Exception:
+                # Esistono ancora viste attive: verrà rilasciata dal garbage collector
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def open_wav_memmap(path):
+    """Apre il WAV come memory map, None se il formato non lo consente"""
+    try:
+        return WavMemmap(path)
+    except (WavFormatError, OSError, ValueError, struct.error):
+        return None
+
+def pcm_to_float32(samples):
+    """Converte una vista PCM mono in float32 [-1, 1] (copia solo il chunk richiesto)"""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128.0) / 128.0
+    if np.issubdtype(samples.dtype, np.integer):
+        return samples.astype(np.float32) / float(2 ** (samples.dtype.itemsize * 8 - 1))
+    return samples.astype(np.float32)
@@ -1,96 +1,475 @@
 import whisper
 import time
 import os
-import tempfile
+import math
+import itertools
+import numpy as np
+import queue
+import threading
 import shutil
-from utils.audio_utils import split_audio, cleanup_temp_files, cleanup_temp_dirs
+from utils.audio_utils import (
+    split_audio, normalize_audio, is_normalized_audio, check_ffmpeg_available,
+    probe_audio, extract_audio_segments, iter_audio_chunks, iter_pcm16_chunks, stream_normalized_pcm,
+    SEGMENT_TARGET_SECONDS, TARGET_SAMPLE_RATE,
+    cleanup_temp_files, cleanup_temp_dirs
+)
+from utils.asr_backends import get_asr_backend, DEFAULT_ASR_BACKEND
+from utils.wav_utils import open_wav_memmap, pcm_to_float32
+from utils.resample_utils import resample_audio
+from utils.guard_utils import is_silent_chunk, guard_transcription, new_guard_stats
+from utils.workspace_utils import make_temp_dir
+from utils.progress_utils import TRANSCRIPTION_STAGE, AUDIO_UNIT
 
-def transcribe_whisper_blocks(audio_path, language="it", model_size="medium", progress_callback=None, chunk_duration=30):
+# Modello della bozza nella trascrizione progressiva
+DRAFT_MODEL_SIZE = "tiny"
+
+# Rilevamento lingua: finestre di parlato analizzate e candidati distribuiti sulla registrazione
+LANGUAGE_DETECTION_WINDOWS = 3
+LANGUAGE_DETECTION_CANDIDATES = 20
+
+# Lingua rilevata per job: (percorso, mtime_ns, dimensione) -> (lingua, probabilità)
+_LANGUAGE_CACHE = {}
+_LANGUAGE_CACHE_LOCK = threading.Lock()
+
+def _iter_segmented_chunks(audio_path, chunk_duration, extraction_workers, temp_files, temp_dirs):
+    """Estrae segmenti in parallelo e restituisce i chunk di ciascuno appena pronto"""
+    # Segmenti multipli della durata chunk: i confini coincidono con la divisione sequenziale
+    segment_duration = chunk_duration * max(1, round(SEGMENT_TARGET_SECONDS / chunk_duration))
+    segments_dir = make_temp_dir("audio_temp_")
+    temp_dirs.append(segments_dir)
+    
+    for index, _, segment_path in extract_audio_segments(
+        audio_path, segments_dir, segment_duration=segment_duration, max_workers=extraction_workers
+    ):
+        if segment_path is None:
+            # Segmento perso: chunk vuoti (saltati) al suo posto, così indici e tempi dei successivi restano giusti
+            print(f"⚠️ Segmento {index + 1} saltato, la trascrizione prosegue")
+            for _ in range(round(segment_duration / chunk_duration)):
+                yield np.zeros(0, dtype=np.float32)
+            continue
+        temp_files.append(segment_path)
+        # I segmenti sono WAV normalizzati: chunk letti via memory map, senza file intermedi
+        chunks = iter_audio_chunks(segment_path, chunk_duration)
+        if chunks is None:
+            chunks = split_audio(segment_path, chunk_duration)
+            temp_files.extend(chunks)
+            if chunks:
+                temp_dirs.append(os.path.dirname(chunks[0]))
+        for chunk in chunks:
+            yield chunk
+        # Il segmento non serve più una volta diviso
+        cleanup_temp_files([segment_path])
+
+def select_speech_windows(audio_path, n_windows=LANGUAGE_DETECTION_WINDOWS, window_seconds=30,
+                          candidates=LANGUAGE_DETECTION_CANDIDATES):
+    """
+    Sceglie le finestre più rappresentative del parlato (energia RMS più alta) tra candidati
+    distribuiti su tutta la registrazione. Richiede un WAV leggibile via memory map, altrimenti [].
+    """
+    reader = open_wav_memmap(audio_path)
+    if reader is None or reader.frames == 0:
+        return []
+    try:
+        window_samples = int(window_seconds * reader.sample_rate)
+        count = max(1, min(candidates, reader.frames // max(1, window_samples)))
+        starts = np.linspace(0, max(0, reader.frames - window_samples), num=count, dtype=np.int64)
+        scored = []
+        for start in starts:
+            view = reader.chunk(start, window_samples)
+            # Stima dell'energia su un campione ogni 16: basta per ordinare le finestre
+            energy = float(np.sqrt(np.mean(np.square(view[::16].astype(np.float32)))))
+            scored.append((energy, int(start)))
+        best = sorted(scored, reverse=True)[:n_windows]
+        # Scarta le finestre quasi silenziose: peggiorano la stima della lingua
+        best = [item for item in best if item[0] >= 0.1 * best[0][0]]
+        return [
+            resample_audio(reader.chunk(start, window_samples), reader.sample_rate, TARGET_SAMPLE_RATE)
+            for _, start in sorted(best, key=lambda item: item[1])
+        ]
+    finally:
+        reader.close()
+
+def detect_job_language(asr, audio_path, fallback_windows=None):
+    """
+    Rileva la lingua una sola volta per job (in cache per file) su poche finestre di parlato.
+    fallback_windows viene usato se il file non è accessibile direttamente.
+    Restituisce (lingua, probabilità) o None.
+    """
+    try:
+        stat = os.stat(audio_path)
+        key = (os.path.abspath(audio_path), stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        key = None
+    if key is not None:
+        with _LANGUAGE_CACHE_LOCK:
+            if key in _LANGUAGE_CACHE:
+                return _LANGUAGE_CACHE[key]
+    
+    windows = select_speech_windows(audio_path) or list(fallback_windows or [])
+    windows = [window[:whisper.audio.N_SAMPLES] for window in windows if len(window)]
+    if not windows:
+        return None
+    try:
+        language, probability = asr.detect_language(windows)
+    except Exception as e:
+        print(f"⚠️ Rilevamento lingua fallito: {e}")
+        return None
+    if language is None:
+        return None
+    
+    if key is not None:
+        with _LANGUAGE_CACHE_LOCK:
+            _LANGUAGE_CACHE[key] = (language, probability)
+    return language, probability
+
+def _validate_transcription_input(audio_path, model_size, chunk_duration):
+    """Valida file e parametri comuni alle modalità di trascrizione"""
+    # Validazione input
+    if not os.path.exists(audio_path):
+        raise ValueError(f"Percorso audio non valido: {audio_path}")
+    
+    if not os.path.getsize(audio_path) > 0:
+        raise ValueError("File audio vuoto")
+    
+    # Validazione parametri
+    valid_models = get_available_whisper_models()
+    if model_size not in valid_models:
+        raise ValueError(f"Modello non valido. Scegli tra: {valid_models}")
+    
+    if chunk_duration < 5 or chunk_duration > 300:
+        raise ValueError("Durata chunk deve essere tra 5 e 300 secondi")
+
+def _ensure_normalized(audio_path, temp_dirs):
+    """Normalizza in mono 16 kHz con un solo passaggio FFmpeg (se non già fatto a monte)"""
+    if is_normalized_audio(audio_path) or not check_ffmpeg_available():
+        return audio_path
+    normalized_dir = make_temp_dir("audio_temp_")
+    temp_dirs.append(normalized_dir)
+    success, message, normalized_path = normalize_audio(
+        audio_path, os.path.join(normalized_dir, "audio.wav")
+    )
+    if success:
+        return normalized_path
+    print(f"⚠️ Normalizzazione audio fallita, uso il file originale: {message}")
+    return audio_path
+
+def _load_chunk_array(chunk):
+    """Restituisce il chunk come array float32 (i percorsi vengono decodificati)"""
+    if isinstance(chunk, str):
+        return whisper.load_audio(chunk)
+    return chunk
+
+def _chunk_seconds(chunk, chunk_duration):
+    """Secondi di audio nuovi in un chunk (senza la sovrapposizione con il successivo)"""
+    if isinstance(chunk, str):
+        return chunk_duration
+    return min(len(chunk) / TARGET_SAMPLE_RATE, chunk_duration)
+
+def _item_progress(item):
+    """Callback on_progress per il motore ASR: avanza l'unità del chunk senza superarne i secondi"""
+    if item is None:
+        return None
+    def advance(seconds):
+        amount = min(seconds, item.estimate - item.done)
+        if amount > 0:
+            item.advance(amount)
+    return advance
+
+def _with_overlap(chunks, overlap_samples):
+    """Estende ogni chunk con i primi overlap_samples campioni del successivo"""
+    previous = None
+    for chunk in chunks:
+        chunk = _load_chunk_array(chunk)
+        if previous is not None:
+            yield np.concatenate([previous, chunk[:overlap_samples]])
+        previous = chunk
+    if previous is not None:
+        yield previous
+
+def _normalize_words(text):
+    """Parole in minuscolo senza punteggiatura, per confrontare le giunzioni"""
+    return [word.strip(".,;:!?\"'«»()[]").lower() for word in text.split()]
+
+def _dedupe_seam(previous_text, next_text, max_words=40, max_skip=3):
+    """
+    Rimuove dall'inizio di next_text le parole già presenti alla fine di previous_text
+    (la zona di sovrapposizione trascritta due volte). Confronta almeno 2 parole.
+    """
+    previous_words = _normalize_words(previous_text)[-max_words:]
+    next_raw = next_text.split()
+    next_words = _normalize_words(next_text)[:max_words + max_skip]
+    for length in range(min(len(previous_words), len(next_words)), 1, -1):
+        tail = previous_words[-length:]
+        for skip in range(0, min(max_skip, len(next_words) - length) + 1):
+            if next_words[skip:skip + length] == tail:
+                return " ".join(next_raw[skip + length:])
+    return next_text
+
+def stitch_chunk_results(chunk_results, chunk_duration, overlap=0):
+    """
+    Unisce i risultati per chunk usando i timestamp dei segmenti.
+    chunk_results: lista di (indice chunk da 1, risultato del backend).
+    Con sovrapposizione ogni chunk tiene solo i segmenti il cui centro cade nella sua metà
+    della zona condivisa; le parole ripetute alla giunzione vengono poi rimosse dal testo.
+    Restituisce (testi per chunk, segmenti con tempi assoluti).
+    """
+    texts = []
+    segments = []
+    previous_text = ""
+    last_index = chunk_results[-1][0] if chunk_results else 0
+    for index, result in chunk_results:
+        chunk_start = (index - 1) * chunk_duration
+        lower = chunk_start + overlap / 2 if overlap and index > 1 else float("-inf")
+        upper = chunk_start + chunk_duration + overlap / 2 if overlap and index < last_index else float("inf")
+        
+        kept = []
+        for segment in result.get("segments") or []:
+            start = chunk_start + segment["start"]
+            end = chunk_start + segment["end"]
+            if lower <= (start + end) / 2 < upper:
+                kept.append(dict(segment, start=start, end=end))
+        
+        if result.get("segments"):
+            text = " ".join(segment["text"].strip() for segment in kept if segment["text"].strip())
+        else:
+            text = result.get("text", "").strip()
+        if overlap and previous_text and text:
+            text = _dedupe_seam(previous_text, text)
+        
+        segments.extend(kept)
+        if text:
+            texts.append(text)
+            previous_text = text
+    return texts, segments
+
+def _iter_batches(items, batch_size):
+    """Raggruppa un iterabile in liste di batch_size elementi"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def transcribe_whisper_blocks(audio_path, language="it", model_size="medium", progress_callback=None, chunk_duration=30,
+                              extraction_workers=1, batch_size=1, quantize=False, backend=None,
+                              overlap=0, stats=None, guard=True, progress=None):
     """
-    Trascrive audio usando Whisper con gestione errori robusta
+    Trascrive audio usando Whisper con gestione errori robusta.
+    Con extraction_workers > 1 un input non normalizzato viene estratto a segmenti
+    da più processi FFmpeg in parallelo, e la trascrizione parte dal primo segmento pronto.
+    Con batch_size > 1 (e chunk fino a 30 s) i chunk sono trascritti a gruppi con encoder batch.
+    Con quantize=True usa il modello quantizzato int8 (CPU).
+    backend sceglie il motore ASR ("whisper", "faster-whisper"; default da ASR_BACKEND).
+    Con overlap > 0 (secondi) i chunk si sovrappongono e vengono uniti tramite i timestamp.
+    Con language="auto" la lingua è rilevata una volta sola e usata per ogni chunk.
+    Se stats è un dict viene popolato con i segmenti ("segments", tempi assoluti in secondi)
+    e con la lingua usata ("language", "language_probability").
+    Con guard=True i chunk silenziosi non vengono decodificati e i cicli di ripetizione
+    sono troncati o scartati prima di entrare nel testo (contatori in stats["guard"]).
+    progress (ProgressTracker) riceve i secondi di audio elaborati nella fase "transcription".
     """
     temp_files = []
     temp_dirs = []
+    chunk_source = []
+    # Generatori da chiudere alla fine (estrazione parallela, memory map)
+    sources = []
     
     try:
-        # Validazione input
-        if not os.path.exists(audio_path):
-            raise ValueError(f"Percorso audio non valido: {audio_path}")
+        _validate_transcription_input(audio_path, model_size, chunk_duration)
         
-        if not os.path.getsize(audio_path) > 0:
-            raise ValueError("File audio vuoto")
+        if batch_size < 1:
+            raise ValueError("Batch size deve essere almeno 1")
         
-        # Validazione parametri
-        valid_models = ["tiny", "base", "small", "medium", "large"]
-        if model_size not in valid_models:
-            raise ValueError(f"Modello non valido. Scegli tra: {valid_models}")
+        if overlap < 0 or overlap > chunk_duration / 2:
+            raise ValueError("Sovrapposizione deve essere tra 0 e metà della durata chunk")
         
-        if chunk_duration < 5 or chunk_duration > 300:
-            raise ValueError("Durata chunk deve essere tra 5 e 300 secondi")
-        
-        # Carica modello con timeout
+        # Carica motore e modello (in cache dopo il primo caricamento)
         try:
-            model = whisper.load_model(model_size)
+            asr = get_asr_backend(backend or DEFAULT_ASR_BACKEND, model_size=model_size, quantize=quantize)
         except Exception as e:
             raise RuntimeError(f"Errore caricamento modello Whisper: {str(e)}")
         
-        # Divide audio in chunks
-        try:
-            chunk_paths = split_audio(audio_path, chunk_duration)
-            temp_files.extend(chunk_paths)
+        # Il batch usa finestre fisse da 30 s: chunk più lunghi passano per transcribe
+        use_batches = (
+            batch_size > 1
+            and asr.supports_batch
+            and chunk_duration + overlap <= whisper.audio.CHUNK_LENGTH
+        )
+        
+        use_segments = (
+            extraction_workers > 1
+            and not is_normalized_audio(audio_path)
+            and check_ffmpeg_available()
+        )
+        
+        if use_segments:
+            # Registrazioni lunghe: estrazione parallela con seek, chunk disponibili in streaming
+            info = probe_audio(audio_path)
+            if not info:
+                raise ValueError("Impossibile leggere la durata del file audio")
+            total_chunks = max(1, math.ceil(info["duration_ms"] / (chunk_duration * 1000)))
+            chunk_source = _iter_segmented_chunks(
+                audio_path, chunk_duration, extraction_workers, temp_files, temp_dirs
+            )
+            sources.append(chunk_source)
+        else:
+            audio_path = _ensure_normalized(audio_path, temp_dirs)
             
-            # Ottieni directory temporanea per cleanup
-            if chunk_paths:
-                temp_dirs.append(os.path.dirname(chunk_paths[0]))
-                
-        except Exception as e:
-            raise RuntimeError(f"Errore divisione audio: {str(e)}")
+            # Divide audio in chunks
+            try:
+                # WAV PCM: chunk serviti direttamente dalla memory map, senza scrivere file
+                info = probe_audio(audio_path)
+                chunk_source = iter_audio_chunks(audio_path, chunk_duration)
+                if chunk_source is not None:
+                    sources.append(chunk_source)
+                if chunk_source is not None and info:
+                    total_chunks = max(1, math.ceil(info["duration_ms"] / (chunk_duration * 1000)))
+                else:
+                    chunk_source = split_audio(audio_path, chunk_duration)
+                    temp_files.extend(chunk_source)
+                    
+                    # Ottieni directory temporanea per cleanup
+                    if chunk_source:
+                        temp_dirs.append(os.path.dirname(chunk_source[0]))
+                    
+                    if not chunk_source:
+                        raise ValueError("Nessun chunk audio generato")
+                    total_chunks = len(chunk_source)
+                    
+            except Exception as e:
+                raise RuntimeError(f"Errore divisione audio: {str(e)}")
         
-        if not chunk_paths:
-            raise ValueError("Nessun chunk audio generato")
+        # Lingua: rilevata una sola volta per job e riusata per ogni chunk
+        language_probability = None
+        if language in (None, "auto"):
+            detected = detect_job_language(asr, audio_path)
+            if detected is None:
+                # File non accessibile direttamente (estrazione a segmenti): usa i primi chunk
+                chunk_iter = iter(chunk_source)
+                peeked = list(itertools.islice(chunk_iter, LANGUAGE_DETECTION_WINDOWS))
+                chunk_source = itertools.chain(peeked, chunk_iter)
+                detected = detect_job_language(
+                    asr, audio_path, fallback_windows=[_load_chunk_array(chunk) for chunk in peeked]
+                )
+            # Se il rilevamento fallisce Whisper rileva la lingua per ogni chunk
+            language, language_probability = detected if detected else (None, None)
+            if language:
+                print(f"🌐 Lingua rilevata: {language} ({(language_probability or 0):.0%})")
+        if stats is not None:
+            stats["language"] = language
+            stats["language_probability"] = language_probability
+        
+        if overlap > 0:
+            chunk_source = _with_overlap(chunk_source, int(overlap * TARGET_SAMPLE_RATE))
+            sources.append(chunk_source)
+        
+        # Filtro allucinazioni: decodifica predefinita, ridecodificati solo i chunk con cicli
+        guard_stats = new_guard_stats()
+        if stats is not None:
+            stats["guard"] = guard_stats
         
         # Trascrizione chunks
-        all_texts = []
-        total_chunks = len(chunk_paths)
+        chunk_results = []
         start_time = time.time()
+        if progress is not None:
+            progress.start_stage(
+                TRANSCRIPTION_STAGE,
+                total=info["duration_ms"] / 1000 if info else total_chunks * chunk_duration,
+                unit=AUDIO_UNIT
+            )
         
-        for i, chunk_path in enumerate(chunk_paths, start=1):
-            try:
-                # Verifica chunk prima della trascrizione
-                if not os.path.exists(chunk_path) or os.path.getsize(chunk_path) == 0:
-                    print(f"⚠️ Chunk {i} vuoto o mancante, saltato")
+        for batch in _iter_batches(enumerate(chunk_source, start=1), batch_size if use_batches else 1):
+            valid = []
+            for i, chunk in batch:
+                # Verifica chunk prima della trascrizione (percorso su disco o array in memoria)
+                if isinstance(chunk, str):
+                    if not os.path.exists(chunk) or os.path.getsize(chunk) == 0:
+                        print(f"⚠️ Chunk {i} vuoto o mancante, saltato")
+                        continue
+                elif len(chunk) == 0:
+                    print(f"⚠️ Chunk {i} vuoto, saltato")
                     continue
-                
-                # Trascrizione con timeout
-                result = model.transcribe(
-                    chunk_path, 
-                    language=language,
-                    fp16=False  # Evita problemi di compatibilità
-                )
-                
-                text = result.get("text", "").strip()
-                if text:
-                    all_texts.append(text)
+                if guard:
+                    # Chunk silenziosi: nessuna decodifica (eviterebbe solo allucinazioni)
+                    chunk = _load_chunk_array(chunk)
+                    if is_silent_chunk(chunk):
+                        guard_stats["silent_chunks"] += 1
+                        print(f"🔇 Chunk {i} silenzioso, saltato")
+                        if progress is not None:
+                            progress.advance(TRANSCRIPTION_STAGE, _chunk_seconds(chunk, chunk_duration),
+                                             measured=False)
+                        continue
+                valid.append((i, chunk))
+            
+            # Un'unità di avanzamento per chunk: avanza per segmento decodificato (se il motore lo consente)
+            # e alla fine del chunk viene portata ai suoi secondi
+            items = [None] * len(valid)
+            if progress is not None:
+                items = [progress.item(TRANSCRIPTION_STAGE, _chunk_seconds(chunk, chunk_duration)) for _, chunk in valid]
+            try:
+                if use_batches:
+                    # Decodifica congiunta: le finestre del batch avanzano una alla volta dopo il filtro
+                    results = asr.transcribe_batch(
+                        [_load_chunk_array(chunk) for _, chunk in valid], language=language
+                    )
                 else:
-                    print(f"⚠️ Chunk {i} senza testo trascritto")
+                    results = None
                 
-                # Aggiorna progresso
-                if progress_callback:
+                for position, (i, chunk) in enumerate(valid):
+                    item = items[position]
                     try:
-                        progress_callback(i / total_chunks)
-                    except Exception as e:
-                        print(f"⚠️ Errore callback progresso: {e}")
+                        if results is None:
+                            result = asr.transcribe(chunk, language=language, on_progress=_item_progress(item))
+                        else:
+                            result = results[position]
+                        if guard:
+                            result = guard_transcription(
+                                result,
+                                lambda **options: asr.transcribe(chunk, language=language, **options),
+                                guard_stats
+                            )
+                            if result is None:
+                                print(f"🛡️ Chunk {i} scartato dal filtro allucinazioni")
+                                continue
+                        if result.get("text", "").strip():
+                            chunk_results.append((i, result))
+                        else:
+                            print(f"⚠️ Chunk {i} senza testo trascritto")
+                    finally:
+                        if item is not None:
+                            item.close(measured=True)
                 
             except Exception as e:
-                print(f"❌ Errore trascrizione chunk {i}: {e}")
+                print(f"❌ Errore trascrizione chunk {', '.join(str(i) for i, _ in batch)}: {e}")
                 # Continua con altri chunks invece di fallire completamente
-                continue
+            
+            for item in items:
+                # Chunk non trascritti per un errore: lavoro non misurato
+                if item is not None:
+                    item.close()
+            
+            # Aggiorna progresso
+            if progress_callback:
+                try:
+                    progress_callback(min(1.0, batch[-1][0] / total_chunks))
+                except Exception as e:
+                    print(f"⚠️ Errore callback progresso: {e}")
+        
+        # Unione dei chunk (rimozione dei duplicati nelle zone sovrapposte)
+        all_texts, segments = stitch_chunk_results(chunk_results, chunk_duration, overlap)
         
         # Verifica risultati
         if not all_texts:
             raise RuntimeError("Nessun testo trascritto da nessun chunk")
         
         final_text = "\n\n".join(all_texts)
+        if stats is not None:
+            stats["segments"] = segments
+        if progress is not None:
+            progress.finish_stage(TRANSCRIPTION_STAGE)
         
         # Verifica testo finale
         if len(final_text.strip()) < 10:
@@ -108,11 +487,216 @@ def transcribe_whisper_blocks(audio_path, language="it", model_size="medium", pr
     finally:
         # Cleanup sicuro
         try:
+            # Ferma l'eventuale estrazione parallela ancora in corso
+            for source in reversed(sources):
+                source.close()
             cleanup_temp_files(temp_files)
             cleanup_temp_dirs(temp_dirs)
         except Exception as e:
             print(f"⚠️ Errore cleanup: {e}")
 
+def _load_chunk_list(audio_path, chunk_duration):
+    """
+    Chunk indicizzabili per la trascrizione a due passate.
+    Da un WAV normalizzato sono viste memmap (nessuna copia), altrimenti l'audio viene decodificato
+    da FFmpeg in streaming direttamente in chunk PCM int16 (metà memoria del float32 intero).
+    """
+    chunks = iter_pcm16_chunks(audio_path, chunk_duration)
+    if chunks is not None:
+        return list(chunks)
+    if check_ffmpeg_available():
+        return [chunk for chunk in stream_normalized_pcm(audio_path, chunk_duration) if len(chunk)]
+    audio = whisper.load_audio(audio_path)
+    step = int(chunk_duration * TARGET_SAMPLE_RATE)
+    return [audio[i:i + step] for i in range(0, len(audio), step)]
+
+def _chunk_to_float(chunk):
+    """Converte un chunk PCM int16 in float32 per il modello (gli array float restano invariati)"""
+    return chunk if chunk.dtype == np.float32 else pcm_to_float32(chunk)
+
+def transcribe_progressive(audio_path, language="it", model_size="medium", draft_model_size=DRAFT_MODEL_SIZE,
+                           on_update=None, chunk_duration=30, quantize=False, backend=None, stats=None,
+                           guard=True, progress=None):
+    """
+    Trascrizione progressiva a due passate: il modello di bozza trascrive subito tutti i chunk,
+    mentre il modello scelto li ritrascrive in un thread in background.
+    on_update(testi, raffinati) viene chiamato nel thread chiamante (sicuro per Streamlit)
+    a ogni chunk in bozza o raffinato; i testi di bozza sono sostituiti al loro posto.
+    Con language="auto" la lingua è rilevata una volta sola con il modello di bozza e condivisa
+    dalle due passate; il modello finale si carica nel thread di raffinamento, senza ritardare la bozza.
+    Con guard=True si applica il filtro allucinazioni; stats["guard"] conta gli interventi sulla passata finale.
+    Se stats è un dict riceve anche i segmenti ("segments", uno per chunk con tempi assoluti).
+    progress (ProgressTracker) conta i secondi di audio della passata finale.
+    Restituisce (testo finale, tempo di elaborazione, tempo alla prima trascrizione).
+    """
+    start_time = time.time()
+    temp_dirs = []
+    stop_event = threading.Event()
+    refine_thread = None
+    
+    try:
+        _validate_transcription_input(audio_path, model_size, chunk_duration)
+        if draft_model_size not in get_available_whisper_models():
+            raise ValueError(f"Modello bozza non valido: {draft_model_size}")
+        
+        try:
+            draft_asr = get_asr_backend(backend or DEFAULT_ASR_BACKEND, model_size=draft_model_size, quantize=quantize)
+        except Exception as e:
+            raise RuntimeError(f"Errore caricamento modello Whisper: {str(e)}")
+        
+        audio_path = _ensure_normalized(audio_path, temp_dirs)
+        chunks = _load_chunk_list(audio_path, chunk_duration)
+        if not chunks:
+            raise ValueError("Nessun chunk audio generato")
+        
+        # Rilevamento con il modello di bozza, già in memoria: la prima bozza non aspetta il modello finale
+        language_probability = None
+        if language in (None, "auto"):
+            detected = detect_job_language(draft_asr, audio_path, fallback_windows=[
+                _chunk_to_float(chunk) for chunk in chunks[:LANGUAGE_DETECTION_WINDOWS]
+            ])
+            language, language_probability = detected if detected else (None, None)
+        if stats is not None:
+            stats["language"] = language
+            stats["language_probability"] = language_probability
+        
+        guard_stats = new_guard_stats()
+        if stats is not None:
+            stats["guard"] = guard_stats
+        
+        def transcribe_text(asr, chunk, counters=None, on_progress=None):
+            """Testo di un chunk, vuoto se silenzioso o scartato dal filtro"""
+            audio = _chunk_to_float(chunk)
+            if guard and is_silent_chunk(audio):
+                if counters is not None:
+                    counters["silent_chunks"] += 1
+                return ""
+            result = asr.transcribe(audio, language=language, on_progress=on_progress)
+            if guard:
+                result = guard_transcription(
+                    result, lambda **options: asr.transcribe(audio, language=language, **options), counters
+                )
+            return result.get("text", "").strip() if result else ""
+        
+        texts = [""] * len(chunks)
+        refined = [False] * len(chunks)
+        refined_queue = queue.Queue()
+        first_text_time = None
+        if progress is not None:
+            progress.start_stage(
+                TRANSCRIPTION_STAGE,
+                total=sum(_chunk_seconds(chunk, chunk_duration) for chunk in chunks),
+                unit=AUDIO_UNIT
+            )
+        
+        def refine():
+            """Passata di qualità: carica il modello finale, ritrascrive i chunk in ordine e accoda i risultati"""
+            try:
+                final_asr = get_asr_backend(backend or DEFAULT_ASR_BACKEND, model_size=model_size, quantize=quantize)
+            except Exception as e:
+                # Senza modello finale resta la bozza per tutti i chunk
+                print(f"❌ Errore caricamento modello Whisper {model_size}: {e}")
+                final_asr = None
+            for index, chunk in enumerate(chunks):
+                if stop_event.is_set():
+                    break
+                if final_asr is None:
+                    refined_queue.put((index, None))
+                    continue
+                # Dal thread di raffinamento: mostrato al prossimo poll del thread chiamante
+                item = None
+                if progress is not None:
+                    item = progress.item(TRANSCRIPTION_STAGE, _chunk_seconds(chunk, chunk_duration))
+                try:
+                    text = transcribe_text(final_asr, chunk, guard_stats, on_progress=_item_progress(item))
+                except Exception as e:
+                    print(f"❌ Errore raffinamento chunk {index + 1}: {e}")
+                    text = None
+                if item is not None:
+                    item.close(measured=True)
+                refined_queue.put((index, text))
+        
+        def apply_refined(block):
+            """Applica i risultati raffinati disponibili; restituisce quanti ne ha applicati"""
+            applied = 0
+            while True:
+                try:
+                    index, text = refined_queue.get(block=block and applied == 0, timeout=1 if block else None)
+                except queue.Empty:
+                    return applied
+                # In caso di errore resta la bozza
+                if text is not None:
+                    texts[index] = text
+                refined[index] = True
+                applied += 1
+        
+        def notify():
+            if progress is not None:
+                progress.poll()
+            if on_update:
+                try:
+                    on_update(list(texts), list(refined))
+                except Exception as e:
+                    print(f"⚠️ Errore callback aggiornamento: {e}")
+        
+        refine_thread = threading.Thread(target=refine, name="whisper-refine", daemon=True)
+        refine_thread.start()
+        
+        # Passata di bozza nel thread chiamante: testo visibile dopo il primo chunk
+        for index, chunk in enumerate(chunks):
+            apply_refined(block=False)
+            if refined[index]:
+                continue
+            try:
+                texts[index] = transcribe_text(draft_asr, chunk)
+            except Exception as e:
+                print(f"❌ Errore bozza chunk {index + 1}: {e}")
+            if first_text_time is None and texts[index]:
+                first_text_time = time.time() - start_time
+            notify()
+        
+        # Attende il raffinamento dei chunk rimanenti
+        while not all(refined):
+            if apply_refined(block=True):
+                notify()
+            elif not refine_thread.is_alive() and refined_queue.empty():
+                break
+            elif progress is not None:
+                progress.poll()
+        
+        final_text = "\n\n".join(text for text in texts if text)
+        if len(final_text.strip()) < 10:
+            raise RuntimeError("Trascrizione troppo corta, possibile errore")
+        if stats is not None:
+            # Un segmento per chunk: i tempi assoluti vengono dalla posizione del chunk
+            stats["segments"] = [
+                {
+                    "start": index * chunk_duration,
+                    "end": index * chunk_duration + len(chunk) / TARGET_SAMPLE_RATE,
+                    "text": text,
+                }
+                for index, (chunk, text) in enumerate(zip(chunks, texts)) if text
+            ]
+        if progress is not None:
+            progress.finish_stage(TRANSCRIPTION_STAGE)
+        
+        processing_time = time.time() - start_time
+        return final_text, processing_time, first_text_time or processing_time
+        
+    except Exception as e:
+        print(f"❌ Errore Whisper: {e}")
+        return "", 0, 0
+    
+    finally:
+        stop_event.set()
+        if refine_thread is not None:
+            # Il thread si ferma al termine del chunk in corso: non deve sopravvivere al cleanup
+            refine_thread.join()
+        try:
+            cleanup_temp_dirs(temp_dirs)
+        except Exception as e:
+            print(f"⚠️ Errore cleanup: {e}")
+
 def validate_whisper_model(model_size):
     """Valida se il modello Whisper è disponibile"""
     try:
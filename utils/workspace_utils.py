@@ -0,0 +1,387 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import shutil
+import tempfile
+import threading
+import logging
+
+# Configurazione logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Workspace unico per gli artefatti dei job: una directory per job con il suo manifest
+WORKSPACE_DIR = os.environ.get("WORKSPACE_DIR", os.path.join(tempfile.gettempdir(), "lesson_workspace"))
+WORKSPACE_QUOTA_BYTES = int(float(os.environ.get("WORKSPACE_QUOTA_GB", "10")) * 1024 ** 3)
+MANIFEST_NAME = "manifest.json"
+
+# Età oltre la quale scratch orfani e job senza processo noto vengono recuperati
+STALE_JOB_SECONDS = 6 * 3600
+
+# Directory temporanee create dalle versioni precedenti nella temp di sistema
+LEGACY_TEMP_PREFIXES = ("lesson_notes_", "audio_chunks_", "audio_temp_")
+
+# Tipi di artefatto: "scratch" viene rimosso a fine job, "output" resta fino all'eviction
+SCRATCH = "scratch"
+OUTPUT = "output"
+
+_WORKSPACE_LOCK = threading.Lock()
+_current = threading.local()
+_open_jobs = set()
+
+def _jobs_root(root=None):
+    return os.path.join(root or WORKSPACE_DIR, "jobs")
+
+def _scratch_root(root=None):
+    return os.path.join(root or WORKSPACE_DIR, "scratch")
+
+def directory_size(path):
+    """Dimensione in byte di un file o di una directory (ricorsiva)"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                pass
+    return total
+
+def _remove_path(path):
+    """Rimuove file o directory; restituisce i byte liberati"""
+    try:
+        size = directory_size(path)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        return size
+    except OSError as e:
+        logger.warning(f"Errore rimozione {path}: {e}")
+        return 0
+
+class Job:
+    """
+    Directory di lavoro di un job con manifest degli artefatti.
+    Come context manager diventa il job corrente del thread (usato da make_temp_dir)
+    e alla chiusura viene concluso: gli artefatti scratch sono rimossi, gli output restano.
+    """
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self._previous = None
+
+    @property
+    def id(self):
+        return self.manifest["job_id"]
+
+    @property
+    def status(self):
+        return self.manifest["status"]
+
+    def _save(self):
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_path, manifest_path)
+
+    def touch(self):
+        """Aggiorna l'ultimo accesso (ordine LRU dell'eviction)"""
+        with _WORKSPACE_LOCK:
+            self.manifest["last_access"] = time.time()
+            self._save()
+
+    def register(self, path, kind=SCRATCH):
+        """Registra un artefatto del job (percorso dentro la directory del job)"""
+        relative = os.path.relpath(path, self.path)
+        if relative.startswith(".."):
+            raise ValueError(f"Artefatto fuori dal job: {path}")
+        with _WORKSPACE_LOCK:
+            self.manifest["artifacts"][relative] = kind
+            self.manifest["last_access"] = time.time()
+            self._save()
+        return path
+
+    def path_for(self, name, kind=SCRATCH):
+        """Percorso registrato per un file del job"""
+        return self.register(os.path.join(self.path, name), kind)
+
+    def mkdtemp(self, prefix="tmp_"):
+        """Directory temporanea dentro il job, rimossa a fine job"""
+        return self.register(tempfile.mkdtemp(prefix=prefix, dir=self.path), SCRATCH)
+
+    def release_scratch(self):
+        """Rimuove subito gli artefatti scratch; restituisce i byte liberati"""
+        with _WORKSPACE_LOCK:
+            scratch = [name for name, kind in self.manifest["artifacts"].items() if kind == SCRATCH]
+        freed = 0
+        for name in scratch:
+            freed += _remove_path(os.path.join(self.path, name))
+        with _WORKSPACE_LOCK:
+            for name in scratch:
+                self.manifest["artifacts"].pop(name, None)
+            self._save()
+        return freed
+
+    def finish(self):
+        """Conclude il job: libera gli scratch, resta candidabile all'eviction LRU"""
+        if self.status == "finished":
+            return
+        if not os.path.isdir(self.path):
+            # Job già rimosso (manutenzione o quota): niente da concludere
+            with _WORKSPACE_LOCK:
+                _open_jobs.discard(self)
+            return
+        self.release_scratch()
+        with _WORKSPACE_LOCK:
+            self.manifest["status"] = "finished"
+            self.manifest["finished"] = time.time()
+            self.manifest["last_access"] = time.time()
+            self.manifest["size_bytes"] = directory_size(self.path)
+            self._save()
+            _open_jobs.discard(self)
+
+    def activate(self):
+        """Rende il job quello corrente del thread"""
+        self._previous = getattr(_current, "job", None)
+        _current.job = self
+        return self
+
+    def deactivate(self):
+        if getattr(_current, "job", None) is self:
+            _current.job = self._previous
+        self._previous = None
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deactivate()
+        self.finish()
+        return False
+
+def _load_manifest(job_path):
+    try:
+        with open(os.path.join(job_path, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def create_job(prefix="job", root=None):
+    """
+    Crea un nuovo job nel workspace. Prima recupera i job abbandonati e applica la quota,
+    così lo spazio viene liberato automaticamente a ogni nuovo job.
+    """
+    reclaim_stale_jobs(root=root)
+    enforce_quota(root=root)
+    jobs_root = _jobs_root(root)
+    os.makedirs(jobs_root, exist_ok=True)
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{prefix}_{uuid.uuid4().hex[:8]}"
+    path = os.path.join(jobs_root, job_id)
+    os.makedirs(path)
+    now = time.time()
+    manifest = {
+        "job_id": job_id,
+        "status": "active",
+        "pid": os.getpid(),
+        "pid_start": _process_start_time(os.getpid()),
+        "created": now,
+        "last_access": now,
+        "artifacts": {},
+    }
+    job = Job(path, manifest)
+    job._save()
+    with _WORKSPACE_LOCK:
+        _open_jobs.add(job)
+    return job
+
+def open_job(job_id, root=None):
+    """Riapre un job esistente (es. per scaricare un output), None se non esiste più"""
+    path = os.path.join(_jobs_root(root), job_id)
+    manifest = _load_manifest(path)
+    if manifest is None:
+        return None
+    job = Job(path, manifest)
+    job.touch()
+    return job
+
+def current_job():
+    """Job corrente del thread, None se non c'è"""
+    return getattr(_current, "job", None)
+
+def make_temp_dir(prefix="tmp_"):
+    """
+    Directory temporanea gestita: dentro il job corrente se presente, altrimenti nello scratch
+    del workspace (recuperato per età). Sostituisce tempfile.mkdtemp nella pipeline.
+    """
+    job = current_job()
+    if job is not None:
+        return job.mkdtemp(prefix)
+    scratch_root = _scratch_root()
+    os.makedirs(scratch_root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=scratch_root)
+
+def list_jobs(root=None):
+    """Manifest di tutti i job con dimensione su disco"""
+    jobs_root = _jobs_root(root)
+    if not os.path.isdir(jobs_root):
+        return []
+    jobs = []
+    for name in sorted(os.listdir(jobs_root)):
+        path = os.path.join(jobs_root, name)
+        if not os.path.isdir(path):
+            continue
+        manifest = _load_manifest(path) or {
+            "job_id": name, "status": "unknown", "last_access": os.path.getmtime(path), "artifacts": {}
+        }
+        manifest = dict(manifest, path=path, size_bytes=directory_size(path))
+        jobs.append(manifest)
+    return jobs
+
+def workspace_usage(root=None):
+    """Occupazione del workspace: totale, per stato dei job e scratch"""
+    jobs = list_jobs(root)
+    scratch_root = _scratch_root(root)
+    usage = {
+        "total_bytes": 0,
+        "active_bytes": sum(job["size_bytes"] for job in jobs if job["status"] == "active"),
+        "finished_bytes": sum(job["size_bytes"] for job in jobs if job["status"] != "active"),
+        "scratch_bytes": directory_size(scratch_root) if os.path.isdir(scratch_root) else 0,
+        "jobs": len(jobs),
+        "quota_bytes": WORKSPACE_QUOTA_BYTES,
+    }
+    usage["total_bytes"] = usage["active_bytes"] + usage["finished_bytes"] + usage["scratch_bytes"]
+    return usage
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # Processo esistente di un altro utente (o piattaforma senza segnali): considerato vivo
+        return True
+
+def _process_start_time(pid):
+    """Istante di avvio del processo (tick dall'avvio del sistema, da /proc); None se non disponibile"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as f:
+            # Il nome del processo può contenere spazi: i campi si contano dopo l'ultima parentesi
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _job_process_alive(job):
+    """True se il processo che ha creato il job è ancora in esecuzione (PID non riassegnato)"""
+    pid = job.get("pid")
+    if not _process_alive(pid):
+        return False
+    # Nei container i PID ripartono da 1: un PID vivo può appartenere a un altro processo
+    started = job.get("pid_start")
+    return started is None or _process_start_time(pid) in (None, started)
+
+def evict_job(job_id, root=None):
+    """Rimuove un job e tutti i suoi artefatti; restituisce i byte liberati"""
+    return _remove_path(os.path.join(_jobs_root(root), job_id))
+
+def reclaim_stale_jobs(max_age=STALE_JOB_SECONDS, root=None):
+    """
+    Recupera lo spazio dei job abbandonati: job attivi non aperti in questo processo il cui
+    processo è terminato (o il cui PID è stato riassegnato) o, senza processo noto, fermi da più
+    di max_age secondi, scratch orfani e directory temporanee delle versioni precedenti più vecchi di max_age.
+    Il job di un processo vivo non viene mai recuperato: durante una trascrizione lunga
+    (o in una coda che crea tutti i job all'inizio) last_access può restare fermo per ore.
+    Restituisce i byte liberati.
+    """
+    now = time.time()
+    freed = 0
+    with _WORKSPACE_LOCK:
+        own_jobs = {job.id for job in _open_jobs}
+    for job in list_jobs(root):
+        if job["status"] == "finished" or job["job_id"] in own_jobs:
+            continue
+        if job.get("pid") is not None:
+            abandoned = not _job_process_alive(job)
+        else:
+            # Senza PID (manifest mancante o in scrittura) conta solo l'età
+            abandoned = now - job["last_access"] > max_age
+        if abandoned:
+            logger.info(f"Recupero job abbandonato {job['job_id']}")
+            freed += _remove_path(job["path"])
+
+    legacy_dirs = []
+    scratch_root = _scratch_root(root)
+    if os.path.isdir(scratch_root):
+        legacy_dirs.extend(os.path.join(scratch_root, name) for name in os.listdir(scratch_root))
+    system_temp = tempfile.gettempdir()
+    try:
+        legacy_dirs.extend(
+            os.path.join(system_temp, name) for name in os.listdir(system_temp)
+            if name.startswith(LEGACY_TEMP_PREFIXES)
+        )
+    except OSError:
+        pass
+    for path in legacy_dirs:
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                freed += _remove_path(path)
+        except OSError:
+            pass
+    return freed
+
+def evict_lru(bytes_needed, root=None):
+    """
+    Rimuove i job conclusi meno usati di recente (LRU) finché non sono liberati bytes_needed byte.
+    I job attivi non vengono mai rimossi. Restituisce i byte liberati.
+    """
+    freed = 0
+    finished = sorted(
+        (job for job in list_jobs(root) if job["status"] != "active"),
+        key=lambda job: job["last_access"]
+    )
+    for job in finished:
+        if freed >= bytes_needed:
+            break
+        logger.info(f"Rimozione job {job['job_id']} ({job['size_bytes'] / 1024 ** 2:.1f} MB)")
+        freed += evict_job(job["job_id"], root)
+    return freed
+
+def enforce_quota(quota_bytes=None, root=None):
+    """
+    Applica la quota del workspace rimuovendo i job conclusi meno usati di recente (LRU).
+    I job attivi non vengono mai rimossi. Restituisce i byte liberati.
+    """
+    quota_bytes = WORKSPACE_QUOTA_BYTES if quota_bytes is None else quota_bytes
+    usage = workspace_usage(root)
+    excess = usage["total_bytes"] - quota_bytes
+    if excess <= 0:
+        return 0
+    logger.info(f"Quota superata di {excess / 1024 ** 2:.1f} MB")
+    freed = evict_lru(excess, root)
+    if freed < excess:
+        logger.warning(f"Quota workspace superata di {(excess - freed) / 1024 ** 2:.1f} MB da job attivi")
+    return freed
+
+def purge_workspace(include_active=False, max_age=STALE_JOB_SECONDS, root=None):
+    """Rimuove tutti i job conclusi (e quelli attivi se richiesto); restituisce i byte liberati"""
+    freed = reclaim_stale_jobs(max_age=max_age, root=root)
+    for job in list_jobs(root):
+        if include_active or job["status"] != "active":
+            freed += evict_job(job["job_id"], root)
+    return freed
+
+def _finish_open_jobs():
+    """All'uscita del processo conclude i job rimasti aperti (rimozione degli scratch)"""
+    for job in list(_open_jobs):
+        try:
+            job.finish()
+        except Exception as e:
+            logger.warning(f"Errore chiusura job {job.id}: {e}")
+
+atexit.register(_finish_open_jobs)